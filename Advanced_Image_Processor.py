@@ -1,13 +1,32 @@
 
+import time
+_STARTUP_T0 = time.perf_counter()  # before the heavy imports, for the startup report
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox, simpledialog, font
 import cv2
 import numpy as np
-from PIL import Image, ImageTk
 import os
-import matplotlib.pyplot as plt
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
-import time
+import image_engine as engine
+import tiled_engine
+from camera_pipeline import CameraPipeline
+from face_tracking import FaceTracker
+from job_executor import JobScheduler
+from interactive_preview import InteractivePreview
+from image_state import ImageState
+from display_renderer import DisplayRenderer
+from edit_stack import EditStack, Step, format_step, is_text_editable
+from mosaic_viewer import MosaicViewer
+from perf_stats import PerfMonitor, instrument_methods, span
+from video_recorder import VideoRecorder
+from motion_gate import MotionDetector, MotionRecorder
+from lazy_loader import BackgroundLoader
+from color_classes import DEFAULT_COLOR_CLASSES
+from watershed_editor import WatershedEditor
+
+_IMPORTS_DONE = time.perf_counter()
+
+# Images at least this large run tileable filters tile by tile in the background
+TILED_PIXELS = 40_000_000
 
 # ==========================================================
 # ToolTip Class (No Changes)
@@ -26,23 +45,6 @@ class ToolTip(object):
         if self.tooltip_window: self.tooltip_window.destroy()
         self.tooltip_window = None
 
-# ==========================================================
-# WatershedHelper Class (No Changes)
-# ==========================================================
-class WatershedHelper:
-    def __init__(self, image):
-        self.image = image; self.markers = np.zeros(image.shape[:2], dtype=np.int32); self.current_marker = 1; self.drawing = False
-    def mouse_callback(self, event, x, y, flags, param):
-        if event == cv2.EVENT_LBUTTONDOWN: self.drawing = True
-        elif event == cv2.EVENT_LBUTTONUP: self.drawing = False
-        if self.drawing:
-            color = (0, 255, 0) if self.current_marker == 1 else (0, 0, 255)
-            cv2.circle(self.markers, (x, y), 5, (self.current_marker), -1)
-            cv2.circle(self.image, (x, y), 5, color, -1)
-    def set_marker_type(self, marker_type):
-        if marker_type == 'foreground': self.current_marker = 1
-        elif marker_type == 'background': self.current_marker = 2
-
 # ==========================================================
 # Main App Class
 # ==========================================================
@@ -55,14 +57,44 @@ class AdvancedImageProcessor:
 
         self.setup_styles()
 
-        self.original_image = None; self.processed_image = None; self.video_capture = None
-        self.is_camera_on = False; self.is_recording = False; self.video_writer = None
+        self.image_state = ImageState(); self.processed_image = None; self.video_capture = None
+        self.edits = EditStack(tile_pixels=TILED_PIXELS, state=self.image_state)
+        self.is_camera_on = False; self.is_recording = False; self.recorder = None
         self.effect_grayscale = tk.BooleanVar(); self.effect_canny = tk.BooleanVar()
-        self.effect_face_detect = tk.BooleanVar(); self.effect_flip = tk.BooleanVar()
-        self.last_processed_frame = None
+        self.effect_face_detect = tk.BooleanVar(); self.effect_flip = tk.BooleanVar(); self.effect_face_tracking = tk.BooleanVar(value=True)
+        self.effect_color_classes = tk.BooleanVar()
+        self.last_processed_frame = None; self.camera_pipeline = None; self.live_chain = None; self.face_tracker = None; self.camera_frame_count = 0
+        self.kmeans_palette = None; self.effect_motion_gating = tk.BooleanVar(); self.motion_recording = tk.BooleanVar()
+        self.motion_detector = MotionDetector(); self.motion_recorder = None; self.camera_motion = True
+        self.renderer = DisplayRenderer(); self.perf = PerfMonitor(); self.show_perf_panel = tk.BooleanVar(); self.perf_panel_job = None
 
         self.load_cascades()
         self.setup_gui()
+        self.jobs = JobScheduler(self.root, max_workers=2, on_change=self.refresh_jobs_panel)
+        self.window_built = time.perf_counter(); self.root.after_idle(self.report_startup)
+
+    @property
+    def face_cascade(self):
+        # Waits for the background load only if a face feature is used in the first moments after startup
+        return self.cascade_loader.get()[0]
+
+    @property
+    def eye_cascade(self):
+        return self.cascade_loader.get()[1]
+
+    def report_startup(self):
+        # Runs once the event loop is idle, i.e. the window is up and usable; the timings show in the performance panel
+        ready = time.perf_counter()
+        for stage, start, end in (("startup:imports", _STARTUP_T0, _IMPORTS_DONE), ("startup:window", _IMPORTS_DONE, self.window_built), ("startup:ready", _STARTUP_T0, ready)):
+            self.perf.record(stage, start, end)
+
+    @property
+    def original_image(self):
+        return self.image_state.original
+    @original_image.setter
+    def original_image(self, image):
+        # Loading (or clearing) an image invalidates every cached derived representation and the edit history
+        self.image_state.set_image(image); self.edits.set_source(self.image_state.original)
 
     def setup_styles(self):
         # ... (No changes here, but adding style for horizontal scrollbar)
@@ -121,6 +153,16 @@ class AdvancedImageProcessor:
         
         reset_btn = ttk.Button(scrollable_frame, text="🔄  إعادة ضبط الصورة", command=self.reset_image, style='Reset.TButton')
         reset_btn.pack(pady=5, padx=10, fill=tk.X)
+
+        history_frame = ttk.LabelFrame(scrollable_frame, text="سجل التعديلات (انقر مرتين لتعديل خطوة)")
+        history_frame.pack(fill=tk.X, pady=5, padx=10)
+        history_buttons = ttk.Frame(history_frame); history_buttons.pack(fill=tk.X, pady=2)
+        ttk.Button(history_buttons, text="↶ تراجع", command=self.undo_edit).pack(side=tk.LEFT, expand=True, fill=tk.X, padx=2)
+        ttk.Button(history_buttons, text="↷ إعادة", command=self.redo_edit).pack(side=tk.LEFT, expand=True, fill=tk.X, padx=2)
+        ttk.Button(history_buttons, text="✖ حذف الخطوة", command=self.remove_edit_step, style='Reset.TButton').pack(side=tk.LEFT, expand=True, fill=tk.X, padx=2)
+        self.history_list = tk.Listbox(history_frame, height=5, bg='#252525', fg=self.FG_COLOR, selectbackground=self.ACCENT_COLOR, font=self.team_font, activestyle='none')
+        self.history_list.pack(fill=tk.X, padx=5, pady=5); self.history_list.bind("<Double-Button-1>", lambda event: self.edit_step())
+        self.root.bind("<Control-z>", lambda event: self.undo_edit()); self.root.bind("<Control-y>", lambda event: self.redo_edit())
         
         ttk.Separator(scrollable_frame, orient='horizontal').pack(fill='x', pady=15, padx=10)
         
@@ -135,6 +177,18 @@ class AdvancedImageProcessor:
         self.create_morphology_tab(notebook)
         self.create_geometric_tab(notebook)
         
+        self.jobs_frame = ttk.LabelFrame(scrollable_frame, text="المهام الجارية في الخلفية")
+        self.jobs_frame.pack(fill=tk.X, pady=10, padx=10); self.job_rows = {}
+        self.jobs_empty_label = ttk.Label(self.jobs_frame, text="لا توجد مهام", font=self.team_font); self.jobs_empty_label.pack(pady=5)
+
+        perf_frame = ttk.LabelFrame(scrollable_frame, text="قياس الأداء")
+        perf_frame.pack(fill=tk.X, pady=10, padx=10)
+        perf_controls = ttk.Frame(perf_frame); perf_controls.pack(fill=tk.X, pady=2)
+        ttk.Checkbutton(perf_controls, text="عرض توقيت المراحل", variable=self.show_perf_panel, command=self.update_perf_panel, style='TCheckbutton').pack(side=tk.LEFT, padx=5)
+        ttk.Button(perf_controls, text="💾 Trace", command=self.export_perf_trace).pack(side=tk.RIGHT, padx=5)
+        ttk.Button(perf_controls, text="↺", width=3, command=self.perf.reset, style='Reset.TButton').pack(side=tk.RIGHT, padx=5)
+        self.perf_label = ttk.Label(perf_frame, text="", font=font.Font(family="Courier", size=8), justify=tk.LEFT)
+
         team_frame = ttk.LabelFrame(scrollable_frame, text="أسماء الفريق")
         team_frame.pack(side=tk.BOTTOM, fill=tk.X, pady=10, padx=10)
         team_names = "أيمن قمحان\nحازم العمري\nضياء الحضرمي\nطارق العمري\nعلي القواس"
@@ -163,6 +217,7 @@ class AdvancedImageProcessor:
         ttk.Button(control_frame, text="⏹️ إيقاف", command=self.stop_camera).pack(side=tk.LEFT, expand=True, padx=2, pady=5)
         self.record_button = ttk.Button(control_frame, text="🔴 تسجيل", command=self.toggle_recording, style='Reset.TButton'); self.record_button.pack(side=tk.LEFT, expand=True, padx=2, pady=5)
         ttk.Button(control_frame, text="📸 التقاط", command=self.take_snapshot).pack(side=tk.LEFT, expand=True, padx=2, pady=5)
+        ttk.Button(tab, text="🎞️ تطبيق المؤثرات على ملف فيديو", command=self.process_video_file).pack(fill=tk.X, padx=10, pady=(0, 5))
         adjustments_frame = ttk.LabelFrame(tab, text="تعديلات الفيديو الحية"); adjustments_frame.pack(fill=tk.X, padx=10, pady=10)
         self.live_sliders = {}
         controls = {"Contrast": [-100, 100], "Exposure": [-100, 100], "Sharpen": [0, 100]}
@@ -173,6 +228,25 @@ class AdvancedImageProcessor:
         ttk.Checkbutton(effects_frame, text="كشف الحواف (Canny)", variable=self.effect_canny, style='TCheckbutton').pack(anchor='w', padx=5)
         ttk.Checkbutton(effects_frame, text="كشف الوجوه والعيون", variable=self.effect_face_detect, style='TCheckbutton').pack(anchor='w', padx=5)
         ttk.Checkbutton(effects_frame, text="قلب أفقي (Flip)", variable=self.effect_flip, style='TCheckbutton').pack(anchor='w', padx=5)
+        ttk.Checkbutton(effects_frame, text=f"تتبع الألوان ({', '.join(DEFAULT_COLOR_CLASSES)})", variable=self.effect_color_classes, style='TCheckbutton').pack(anchor='w', padx=5)
+        tracking_frame = ttk.LabelFrame(tab, text="إعدادات تتبع الوجوه"); tracking_frame.pack(fill=tk.X, padx=10, pady=10)
+        ttk.Checkbutton(tracking_frame, text="وضع التتبع (كشف كل N إطارات)", variable=self.effect_face_tracking, style='TCheckbutton').pack(anchor='w', padx=5)
+        self.tracking_vars = {}
+        tracking_controls = {"detect_every": ("Detect every N", tk.IntVar, 1, 30, 1), "detection_scale": ("Detection scale", tk.DoubleVar, 0.2, 1.0, 0.1),
+                             "min_face_size": ("Min face (px)", tk.IntVar, 10, 400, 10), "max_face_size": ("Max face (0=∞)", tk.IntVar, 0, 2000, 50)}
+        for key, (text, var_type, low, high, step) in tracking_controls.items():
+            f = ttk.Frame(tracking_frame); ttk.Label(f, text=text, width=15, font=self.team_font).pack(side=tk.LEFT); var = var_type(value=engine.DEFAULT_TRACKING_SETTINGS[key])
+            ttk.Spinbox(f, from_=low, to=high, increment=step, textvariable=var, width=8).pack(side=tk.LEFT, padx=5); self.tracking_vars[key] = var; f.pack(fill=tk.X, pady=2, padx=5)
+        motion_frame = ttk.LabelFrame(tab, text="كشف الحركة"); motion_frame.pack(fill=tk.X, padx=10, pady=10)
+        ttk.Checkbutton(motion_frame, text="إيقاف المؤثرات الثقيلة عند سكون المشهد", variable=self.effect_motion_gating, style='TCheckbutton').pack(anchor='w', padx=5)
+        ttk.Checkbutton(motion_frame, text="تسجيل تلقائي عند الحركة (مع الثواني السابقة)", variable=self.motion_recording, command=self.toggle_motion_recording, style='TCheckbutton').pack(anchor='w', padx=5)
+        self.motion_vars = {}
+        motion_controls = {"threshold": ("Threshold", tk.IntVar, 5, 100, 5, 25), "hold_seconds": ("Hold (s)", tk.DoubleVar, 0.5, 30, 0.5, 2.0),
+                           "pre_seconds": ("Pre-event (s)", tk.DoubleVar, 0, 30, 1, 5.0)}
+        for key, (text, var_type, low, high, step, default) in motion_controls.items():
+            f = ttk.Frame(motion_frame); ttk.Label(f, text=text, width=15, font=self.team_font).pack(side=tk.LEFT); var = var_type(value=default)
+            ttk.Spinbox(f, from_=low, to=high, increment=step, textvariable=var, width=8).pack(side=tk.LEFT, padx=5); self.motion_vars[key] = var; f.pack(fill=tk.X, pady=2, padx=5)
+        self.camera_stats_label = ttk.Label(tab, text="", font=self.team_font); self.camera_stats_label.pack(fill=tk.X, padx=10, pady=(0, 10))
     
     def create_basic_filters_tab(self, notebook):
         tab = ttk.Frame(notebook); notebook.add(tab, text='🎨 فلاتر')
@@ -195,11 +269,13 @@ class AdvancedImageProcessor:
         self.add_button(tab, "Line Detection (Hough)", self.detect_lines, "البحث عن الخطوط المستقيمة في الصورة")
         self.add_button(tab, "Corner Detection", self.detect_corners, "كشف الزوايا والاركان المهمة في الصورة")
         self.add_button(tab, "Ball Detection (Color Mask)", self.detect_and_copy_ball, "عزل الأجسام بناءً على لونها (مثال: كرة خضراء)")
+        self.add_button(tab, "Color Classes", self.classify_colors, "تصنيف كل البكسلات إلى فئات لونية مسمّاة دفعة واحدة وتحديد كل كائن ملوّن بمربع")
         self.add_button(tab, "Manual Object Masking", self.manually_mask_object, "عزل كائن عن الخلفية يدويًا باستخدام خوارزمية GrabCut")
 
     def create_segmentation_tab(self, notebook):
         tab = ttk.Frame(notebook); notebook.add(tab, text='🧩 تجزئة')
         self.add_button(tab, "K-Means Segmentation", self.segment_kmeans, "تجزئة الصورة إلى مجموعات لونية باستخدام K-Means")
+        self.add_button(tab, "Fast K-Means (Sampled)", self.segment_kmeans_fast, "تجزئة سريعة للصور الكبيرة: تدريب K-Means على عينة من البكسلات ثم تلوين الصورة كاملة")
         self.add_button(tab, "Automatic Watershed", self.segment_watershed_auto, "تجزئة الصورة تلقائيًا لفصل الكائنات المتلامسة")
         self.add_button(tab, "Interactive Watershed", self.segment_watershed_interactive, "تجزئة الصورة بشكل تفاعلي عبر تحديد الكائن والخلفية")
 
@@ -217,162 +293,200 @@ class AdvancedImageProcessor:
 
     def start_camera(self):
         if self.is_camera_on: return
-        self.video_capture = cv2.VideoCapture(0);
-        if not self.video_capture.isOpened(): messagebox.showerror("خطأ", "لا يمكن فتح الكاميرا."); return
+        # The chain needs more output slots than frames the pipeline can hold at once (display queue + worker + UI).
+        # Chain, tracker and motion detector belong to this pipeline alone: a worker of a stopped pipeline that is
+        # still finishing a frame never shares buffers or state with the next one. The attributes are for the UI to read.
+        chain = engine.LiveEffectsChain(output_buffers=4, monitor=self.perf); detector = MotionDetector()
+        tracker = FaceTracker(self.face_cascade, self.eye_cascade, **self.get_tracking_settings()) if self.face_cascade is not None else None
+        self.live_chain, self.face_tracker, self.motion_detector = chain, tracker, detector
+        process = lambda frame, settings: self.process_camera_frame(frame, settings, chain, tracker, detector)
+        self.camera_pipeline = CameraPipeline(process, source=0, queue_size=2, monitor=self.perf); self.camera_pipeline.update_settings(self.get_live_settings())
+        self.camera_pipeline.frame_sink = self.handle_processed_frame
+        if not self.camera_pipeline.start(): self.camera_pipeline = None; messagebox.showerror("خطأ", "لا يمكن فتح الكاميرا."); return
         self.is_camera_on = True; self.original_image = None; self.processed_image = None
-        self.original_label.pack_forget(); self.display_images(); self.update_camera_feed()
+        self.toggle_motion_recording(); self.original_label.pack_forget(); self.display_images(); self.update_camera_feed()
     def stop_camera(self):
         if not self.is_camera_on: return
-        self.is_camera_on = False
         if self.is_recording: self.toggle_recording()
-        if self.video_capture: self.video_capture.release()
-        self.processed_label.config(image='', text="الكاميرا متوقفة")
+        self.is_camera_on = False
+        if self.camera_pipeline: self.camera_pipeline.stop(); self.camera_pipeline = None
+        self.toggle_motion_recording()
+        self.renderer.clear(self.processed_label, "الكاميرا متوقفة"); self.camera_stats_label.config(text="")
         self.original_label.pack(side=tk.LEFT, fill=tk.BOTH, expand=True, padx=(0, 5))
+    def get_live_settings(self):
+        # Tk variables may only be read on the main thread, so the worker gets a plain snapshot
+        return {"contrast": self.live_sliders["Contrast"].get(), "exposure": self.live_sliders["Exposure"].get(), "sharpen": self.live_sliders["Sharpen"].get(),
+                "flip": self.effect_flip.get(), "face_detect": self.effect_face_detect.get(), "grayscale": self.effect_grayscale.get(), "canny": self.effect_canny.get(),
+                "face_tracking": self.effect_face_tracking.get(), "tracking": self.get_tracking_settings(),
+                "motion_gating": self.effect_motion_gating.get(), "motion_recording": self.motion_recording.get(), "motion": self.get_motion_settings(),
+                "color_classes": tuple(DEFAULT_COLOR_CLASSES) if self.effect_color_classes.get() else ()}
+    def get_motion_settings(self):
+        settings = {}
+        for key in ("threshold", "hold_seconds"):
+            try: settings[key] = self.motion_vars[key].get()
+            except tk.TclError: pass
+        return settings
+    def get_tracking_settings(self):
+        settings = dict(engine.DEFAULT_TRACKING_SETTINGS)
+        for key, var in self.tracking_vars.items():
+            try: settings[key] = var.get()
+            except tk.TclError: pass  # half-typed spinbox value, keep the default
+        return settings
+    def process_camera_frame(self, frame, settings, chain, tracker, detector):
+        # Runs on the pipeline worker thread; motion is only measured when something uses it
+        motion = True
+        if settings.get("motion_gating") or settings.get("motion_recording"):
+            with span(self.perf, "camera:motion"): detector.configure(**settings.get("motion", {})); motion = detector.update(frame)
+        self.camera_motion = motion
+        return chain.process(frame, settings, self.face_cascade, self.eye_cascade, tracker, motion=motion)
+    def handle_processed_frame(self, frame, t_capture):
+        # Frame sink of the camera pipeline (worker thread, right after process_camera_frame)
+        recorder = self.recorder; motion_recorder = self.motion_recorder
+        if recorder is not None: recorder.write(frame, t_capture)
+        if motion_recorder is not None: motion_recorder.push(frame, t_capture, self.camera_motion)
+    def toggle_motion_recording(self):
+        # Called from the checkbox and on camera start/stop
+        if self.motion_recorder is not None: motion_recorder = self.motion_recorder; self.motion_recorder = None; motion_recorder.close()
+        if self.is_camera_on and self.motion_recording.get():
+            try: pre_seconds = self.motion_vars["pre_seconds"].get()
+            except tk.TclError: pre_seconds = 5.0
+            self.motion_recorder = MotionRecorder(pre_seconds=pre_seconds, fps=self.camera_pipeline.capture_meter.fps or None, monitor=self.perf)
     def update_camera_feed(self):
         if not self.is_camera_on: return
-        ret, frame = self.video_capture.read()
-        if ret:
-            processed_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB); contrast = self.live_sliders["Contrast"].get(); exposure = self.live_sliders["Exposure"].get(); sharpen_amount = self.live_sliders["Sharpen"].get()
-            if contrast != 0: factor = (100.0 + contrast) / 100.0; processed_frame = cv2.addWeighted(processed_frame, factor, np.zeros_like(processed_frame), 0, 0)
-            if exposure != 0: processed_frame = cv2.add(processed_frame, np.array([float(exposure)]))
-            if sharpen_amount > 0: blurred = cv2.GaussianBlur(processed_frame, (0,0), 3); alpha = 1.0 + (sharpen_amount / 100.0) * 1.5; processed_frame = cv2.addWeighted(processed_frame, alpha, blurred, 1.0 - alpha, 0)
-            if self.effect_flip.get(): processed_frame = cv2.flip(processed_frame, 1)
-            if self.effect_face_detect.get(): self.detect_faces_on_frame(processed_frame)
-            gray_frame_for_effects = None
-            if self.effect_grayscale.get() or self.effect_canny.get(): gray_frame_for_effects = cv2.cvtColor(processed_frame, cv2.COLOR_RGB2GRAY)
-            if self.effect_canny.get(): processed_frame = cv2.Canny(gray_frame_for_effects, 100, 200)
-            elif self.effect_grayscale.get(): processed_frame = gray_frame_for_effects
-            self.last_processed_frame = processed_frame.copy(); self.display_image(processed_frame, self.processed_label, max_size=800)
-            if self.is_recording and self.video_writer is not None:
-                frame_to_write = self.last_processed_frame
-                if len(frame_to_write.shape) == 2: frame_to_write = cv2.cvtColor(frame_to_write, cv2.COLOR_GRAY2BGR)
-                else: frame_to_write = cv2.cvtColor(frame_to_write, cv2.COLOR_RGB2BGR)
-                self.video_writer.write(frame_to_write)
+        self.camera_pipeline.update_settings(self.get_live_settings())
+        processed_frame = self.camera_pipeline.get_latest()
+        if processed_frame is not None:
+            # Frames come from the effects chain's rotating buffers, so the frame counter tells the renderer it is new
+            self.camera_frame_count += 1; self.last_processed_frame = processed_frame; self.perf.frame()
+            with span(self.perf, "camera:display"): self.display_image(processed_frame, self.processed_label, max_size=800, version=self.camera_frame_count)
+        # Also refreshed without new frames when the effects fail, so the error is visible even if every frame is lost
+        if processed_frame is not None or self.camera_pipeline.error is not None: self.camera_stats_label.config(text=self.camera_status_text())
         self.root.after(15, self.update_camera_feed)
-    def detect_faces_on_frame(self, frame_to_process):
-        if self.face_cascade is None or self.eye_cascade is None: return
-        gray = cv2.cvtColor(frame_to_process, cv2.COLOR_RGB2GRAY); faces = self.face_cascade.detectMultiScale(gray, 1.2, 5)
-        for (x,y,w,h) in faces:
-            cv2.rectangle(frame_to_process, (x,y), (x+w,y+h), (255,0,0), 2); roi_gray = gray[y:y+h, x:x+w]; roi_color = frame_to_process[y:y+h, x:x+w]
-            eyes = self.eye_cascade.detectMultiScale(roi_gray)
-            for (ex,ey,ew,eh) in eyes: cv2.rectangle(roi_color, (ex,ey), (ex+ew,ey+eh), (0,255,0), 2)
+    def camera_status_text(self):
+        stats = self.camera_pipeline.stats(); text = f"FPS: {stats['display_fps']:.1f} (capture {stats['capture_fps']:.1f})  |  Latency: {stats['latency_ms']:.0f} ms  |  Dropped: {stats['dropped_frames']}"
+        if self.recorder is not None:
+            rec = self.recorder.stats(); text += f"\nREC {rec['fps']:.1f} fps  |  Queue: {rec['queue_depth']}/{rec['queue_size']}  |  Dropped: {rec['dropped']}"
+        if self.camera_pipeline.settings.get("motion_gating") or self.motion_recorder is not None:
+            text += f"\nMotion: {'●' if self.camera_motion else '○'} {self.motion_detector.level * 100:.1f}%"
+            if self.motion_recorder is not None: text += f"  |  {'● REC' if self.motion_recorder.recording else 'Armed'}  |  Events: {self.motion_recorder.events}"
+        colors = self.live_chain.last_colors
+        if colors: text += "\nColors: " + "  |  ".join(f"{name} {len(result['components'])}" for name, result in colors.items())
+        error = self.camera_pipeline.error
+        if error is not None: text += f"\n⚠ خطأ في المعالجة ({self.camera_pipeline.error_count} إطار): {type(error).__name__}: {error}"
+        return text
     def toggle_recording(self):
         if not self.is_camera_on: messagebox.showwarning("تنبيه", "يجب تشغيل الكاميرا أولاً."); return
         if self.is_recording:
+            # Frames still queued are encoded before the file is closed
             self.is_recording = False; self.record_button.config(text="🔴 تسجيل", style='Reset.TButton')
-            if self.video_writer: self.video_writer.release(); self.video_writer = None
-            messagebox.showinfo("التسجيل", "تم إيقاف التسجيل وحفظ الملف.")
+            recorder = self.recorder; self.recorder = None; recorder.request_stop(); self.report_recording(recorder)
         else:
-            if self.last_processed_frame is not None:
-                self.is_recording = True; self.record_button.config(text="⏹️ إيقاف", style='TButton'); h, w = self.last_processed_frame.shape[:2]
-                filename = f"recording_{time.strftime('%Y%m%d_%H%M%S')}.avi"; fourcc = cv2.VideoWriter_fourcc(*'XVID'); self.video_writer = cv2.VideoWriter(filename, fourcc, 20.0, (w, h))
-            else: messagebox.showerror("خطأ", "لا يوجد إطار فيديو لبدء التسجيل.")
+            # The recorder is fed from the effects worker with capture timestamps and encodes on its own thread
+            filename = f"recording_{time.strftime('%Y%m%d_%H%M%S')}.avi"
+            self.recorder = VideoRecorder(filename, fps=self.camera_pipeline.capture_meter.fps, monitor=self.perf).start()
+            self.is_recording = True; self.record_button.config(text="⏹️ إيقاف", style='TButton')
+    def report_recording(self, recorder):
+        # Polled from the Tk loop so the UI keeps running while the encoder drains its queue
+        if not recorder.finished: self.root.after(50, self.report_recording, recorder); return
+        stats = recorder.stats()
+        if stats["error"] is not None: messagebox.showerror("خطأ", f"فشل التسجيل:\n{stats['error']}"); return
+        messagebox.showinfo("التسجيل", f"تم إيقاف التسجيل وحفظ الملف:\n{stats['path']}\n{stats['fps']:.1f} FPS, {stats['duration']:.1f} s, {stats['dropped']} إطار مُسقط")
+    def process_video_file(self):
+        # Same effects as the live feed, applied offline by parallel worker processes.
+        # Imported here: multiprocessing and the worker setup are not needed to start the app.
+        import video_processor
+        src = filedialog.askopenfilename(filetypes=[("Video files", "*.mp4 *.avi *.mov *.mkv *.wmv"), ("All files", "*.*")])
+        if not src: return
+        dst = filedialog.asksaveasfilename(defaultextension=".avi", initialfile=f"{os.path.splitext(os.path.basename(src))[0]}_processed.avi", filetypes=[("AVI", "*.avi")])
+        if not dst: return
+        def show_summary(stats):
+            messagebox.showinfo("نجاح", f"تمت معالجة {stats['frames']} إطار في {stats['seconds']:.1f} ثانية\n{stats['fps']:.1f} FPS ({stats['realtime_factor']:.1f}x الزمن الحقيقي)\n{dst}", parent=self.root)
+        self.run_in_background(f"Video: {os.path.basename(src)}", video_processor.process_video, src, dst, self.get_live_settings(), on_result=show_summary, image_bound=False)
     def take_snapshot(self):
         if not self.is_camera_on or self.last_processed_frame is None: messagebox.showwarning("تنبيه", "يجب تشغيل الكاميرا أولاً."); return
         filename = f"snapshot_{time.strftime('%Y%m%d_%H%M%S')}.png"; snapshot = self.last_processed_frame
         if len(snapshot.shape) == 3: snapshot = cv2.cvtColor(snapshot, cv2.COLOR_RGB2BGR)
         cv2.imwrite(filename, snapshot); messagebox.showinfo("نجاح", f"تم حفظ اللقطة باسم:\n{filename}")
-    def _create_interactive_window(self, title):
-        if self.original_image is None: messagebox.showerror("خطأ", "يرجى تحميل صورة أولاً"); return None, None, None
+    def _create_interactive_window(self, title, image, render, to_step):
+        # Sliders drive a debounced, memoized preview on a proxy image; "Apply" adds to_step(params) -> (op, params) to the edit stack
+        if image is None: return None, None  # get_current_image has already reported it
         top = tk.Toplevel(self.root); top.title(title); top.configure(bg=self.BG_COLOR)
         image_label = ttk.Label(top, background=self.BG_COLOR); image_label.pack(pady=10, padx=10)
-        controls_frame = ttk.Frame(top); controls_frame.pack(pady=5, padx=10, fill=tk.X); return top, image_label, controls_frame
+        controls_frame = ttk.Frame(top); controls_frame.pack(pady=5, padx=10, fill=tk.X)
+        preview = InteractivePreview(self.root, image, render, lambda result: self.display_image(result, image_label, max_size=500), max_size=500)
+        def close(): preview.close(); top.destroy()
+        def commit():
+            params = dict(preview.params); close(); name, step_params = to_step(params)
+            self.add_edit_step(title, name, **step_params)
+        ttk.Button(top, text="✔ تطبيق على الصورة", command=commit).pack(pady=(0, 10), padx=10, fill=tk.X)
+        top.protocol("WM_DELETE_WINDOW", close); return preview, controls_frame
     def interactive_blur(self):
-        top, image_label, controls_frame = self._create_interactive_window("Interactive Gaussian Blur")
-        if top is None: return
-        def update_blur(val):
-            ksize = int(float(val)); ksize += 1 if ksize % 2 == 0 else 0
-            blurred_img = cv2.GaussianBlur(self.original_image, (ksize, ksize), 0)
-            self.display_image(blurred_img, image_label, max_size=500)
+        def render(img, scale, ksize): return engine.gaussian_blur(img, max(1, round(ksize * scale)))
+        preview, controls_frame = self._create_interactive_window("Interactive Gaussian Blur", self.get_current_image(), render, lambda p: ("blur", {"ksize": p["ksize"]}))
+        if preview is None: return
+        def update_blur(val): preview.request(ksize=int(float(val)))
         ttk.Label(controls_frame, text="Kernel Size").pack(side=tk.LEFT)
         slider = ttk.Scale(controls_frame, from_=1, to=51, orient=tk.HORIZONTAL, command=update_blur, style='Horizontal.TScale'); slider.set(5); slider.pack(side=tk.LEFT, expand=True, fill=tk.X)
         update_blur(5)
     def interactive_canny(self):
-        top, image_label, controls_frame = self._create_interactive_window("Interactive Canny Edge Detection")
-        if top is None: return
-        gray_img = cv2.cvtColor(self.original_image, cv2.COLOR_RGB2GRAY)
+        def render(gray, scale, t1, t2): return cv2.Canny(gray, t1, t2)
+        gray_img = self.get_current_image(gray=True)
+        preview, controls_frame = self._create_interactive_window("Interactive Canny Edge Detection", gray_img, render, lambda p: ("canny", {"threshold1": p["t1"], "threshold2": p["t2"]}))
+        if preview is None: return
         def update_canny(*args):
             t1, t2 = t1_slider.get(), t2_slider.get()
             if t1 > t2: t1_slider.set(t2); t1 = t2
-            edges = cv2.Canny(gray_img, t1, t2); self.display_image(edges, image_label, max_size=500)
+            preview.request(t1=t1, t2=t2)
         t1_frame = ttk.Frame(controls_frame); ttk.Label(t1_frame, text="Threshold 1").pack(side=tk.LEFT); t1_slider = tk.Scale(t1_frame, from_=0, to=255, orient=tk.HORIZONTAL, command=update_canny); t1_slider.set(100); t1_slider.pack(side=tk.LEFT, expand=True, fill=tk.X); t1_frame.pack(fill=tk.X)
         t2_frame = ttk.Frame(controls_frame); ttk.Label(t2_frame, text="Threshold 2").pack(side=tk.LEFT); t2_slider = tk.Scale(t2_frame, from_=0, to=255, orient=tk.HORIZONTAL, command=update_canny); t2_slider.set(200); t2_slider.pack(side=tk.LEFT, expand=True, fill=tk.X); t2_frame.pack(fill=tk.X)
         update_canny()
     def interactive_sharpen(self):
-        top, image_label, controls_frame = self._create_interactive_window("Interactive Sharpening")
-        if top is None: return
-        def update_sharpen(val):
-            amount = float(val) / 10.0; blurred = cv2.GaussianBlur(self.original_image, (0, 0), 3)
-            sharpened_img = cv2.addWeighted(self.original_image, 1.0 + amount, blurred, -amount, 0)
-            self.display_image(sharpened_img, image_label, max_size=500)
+        def render(img, scale, amount): return engine.sharpen(img, amount, sigma=max(0.5, 3 * scale))
+        preview, controls_frame = self._create_interactive_window("Interactive Sharpening", self.get_current_image(), render, lambda p: ("sharpen", {"amount": p["amount"]}))
+        if preview is None: return
+        def update_sharpen(val): preview.request(amount=float(val) / 10.0)
         ttk.Label(controls_frame, text="Amount").pack(side=tk.LEFT)
         slider = ttk.Scale(controls_frame, from_=0, to=50, orient=tk.HORIZONTAL, command=update_sharpen, style='Horizontal.TScale'); slider.set(10); slider.pack(side=tk.LEFT, expand=True, fill=tk.X)
         update_sharpen(10)
     def apply_log_transform(self):
-        img_gray = self.get_current_image(gray=True);
-        if img_gray is None: return
-        img_float = np.float32(img_gray) + 1; log_image = np.log(img_float)
-        normalized_image = cv2.normalize(log_image, None, 0, 255, cv2.NORM_MINMAX, dtype=cv2.CV_8U)
-        self.processed_image = normalized_image; self.display_images()
+        self.add_edit_step("Log Transform", "log")
     def apply_median_filter(self):
-        img = self.get_current_image();
-        if img is None: return
-        self.processed_image = cv2.medianBlur(img, 5); self.display_images()
+        self.add_edit_step("Median Filter", "median", ksize=5)
     def apply_custom_filter(self):
-        img = self.get_current_image();
-        if img is None: return
-        kernel = np.ones((5, 5), np.float32) / 25; self.processed_image = cv2.filter2D(img, -1, kernel); self.display_images()
+        self.add_edit_step("Custom Filter", "average", ksize=5)
     def apply_difference_filters(self):
         img = self.get_current_image(gray=True);
         if img is None: return
-        kernel_h = np.array([[-1, -2, -1], [0, 0, 0], [1, 2, 1]]); kernel_v = np.array([[-1, 0, 1], [-2, 0, 2], [-1, 0, 1]])
-        horizontal = cv2.filter2D(img, -1, kernel_h); vertical = cv2.filter2D(img, -1, kernel_v)
-        self.show_results_in_new_window([self.original_image, horizontal, vertical], ["Original", "Horizontal", "Vertical"])
+        horizontal, vertical = engine.difference_filters(img)
+        self.show_results_in_new_window([self.get_current_image(), horizontal, vertical], ["Input", "Horizontal", "Vertical"])
     def apply_sobel(self):
         img = self.get_current_image(gray=True);
         if img is None: return
-        sobelx = cv2.Sobel(img, cv2.CV_64F, 1, 0, ksize=5); sobely = cv2.Sobel(img, cv2.CV_64F, 0, 1, ksize=5)
-        sobel_combined = cv2.magnitude(sobelx, sobely)
-        self.show_results_in_new_window([cv2.convertScaleAbs(sobelx), cv2.convertScaleAbs(sobely), cv2.convertScaleAbs(sobel_combined)], ["Sobel X", "Sobel Y", "Magnitude"])
+        titles = ["Sobel X", "Sobel Y", "Magnitude"]
+        if self.is_large_image(img): self.run_tiled("Sobel", img, [[(op, {"ksize": 5})] for op in ("sobel_x", "sobel_y", "sobel")], titles); return
+        self.show_results_in_new_window(list(engine.sobel(img, 5)), titles)
     def detect_faces_eyes(self):
-        img = self.get_current_image();
-        if img is None: return
         if self.face_cascade is None or self.eye_cascade is None: messagebox.showerror("خطأ", "لم يتم تحميل ملفات Haar Cascade."); return
-        gray = cv2.cvtColor(img, cv2.COLOR_RGB2GRAY); faces = self.face_cascade.detectMultiScale(gray, 1.3, 5); img_with_detections = img.copy()
-        for (x, y, w, h) in faces:
-            cv2.rectangle(img_with_detections, (x, y), (x + w, y + h), (255, 0, 0), 3)
-            roi_gray = gray[y:y + h, x:x + w]; roi_color = img_with_detections[y:y + h, x:x + w]; eyes = self.eye_cascade.detectMultiScale(roi_gray)
-            for (ex, ey, ew, eh) in eyes: cv2.rectangle(roi_color, (ex, ey), (ex + ew, ey + eh), (0, 255, 0), 2)
-        self.processed_image = img_with_detections; self.display_images()
+        self.add_edit_step("Face Detection", "faces")
     def detect_circles(self):
-        img = self.get_current_image();
-        if img is None: return
-        output = img.copy(); gray = cv2.cvtColor(img, cv2.COLOR_RGB2GRAY); gray = cv2.medianBlur(gray, 5)
-        circles = cv2.HoughCircles(gray, cv2.HOUGH_GRADIENT, 1, 20, param1=50, param2=30, minRadius=10, maxRadius=100)
-        if circles is not None:
-            circles = np.uint16(np.around(circles))
-            for i in circles[0, :]: cv2.circle(output, (i[0], i[1]), i[2], (0, 255, 0), 2); cv2.circle(output, (i[0], i[1]), 2, (0, 0, 255), 3)
-        self.processed_image = output; self.display_images()
+        self.add_edit_step("Circle Detection", "circles")
     def detect_lines(self):
         img = self.get_current_image();
         if img is None: return
-        gray = cv2.cvtColor(img, cv2.COLOR_RGB2GRAY); edges = cv2.Canny(gray, 50, 150, apertureSize=3)
-        lines = cv2.HoughLinesP(edges, 1, np.pi/180, threshold=80, minLineLength=50, maxLineGap=10); img_with_lines = img.copy()
-        if lines is not None:
-            for line in lines: x1, y1, x2, y2 = line[0]; cv2.line(img_with_lines, (x1, y1), (x2, y2), (0, 255, 0), 2)
-        else: messagebox.showinfo("Result", "لم يتم العثور على خطوط.", parent=self.root)
-        self.show_results_in_new_window([self.original_image, edges, img_with_lines], ["Original", "Canny Edges", "Detected Lines"])
+        def show_lines(result):
+            edges, img_with_lines, lines = result
+            if lines is None: messagebox.showinfo("Result", "لم يتم العثور على خطوط.", parent=self.root)
+            self.show_results_in_new_window([img, edges, img_with_lines], ["Original", "Canny Edges", "Detected Lines"])
+        # Full-image Canny for the "Canny Edges" panel: the cached one of the loaded image, otherwise find_lines
+        # computes it (it runs at full resolution, so the panel never shows only candidate windows)
+        edges = self.image_state.canny(50, 150) if not self.edits.steps else None
+        self.run_in_background("Line Detection", engine.detect_lines, img, edges=edges, on_result=show_lines)
     def detect_corners(self):
-        img = self.get_current_image();
-        if img is None: return
-        gray = cv2.cvtColor(img, cv2.COLOR_RGB2GRAY); gray = np.float32(gray); dst = cv2.cornerHarris(gray, 2, 3, 0.04); dst = cv2.dilate(dst, None)
-        img_with_corners = img.copy(); img_with_corners[dst > 0.01 * dst.max()] = [0, 0, 255]; self.processed_image = img_with_corners; self.display_images()
+        self.add_edit_step("Corner Detection", "corners")
     def detect_and_copy_ball(self):
-        img = self.get_current_image();
-        if img is None: return
-        hsv = cv2.cvtColor(img, cv2.COLOR_RGB2HSV); lower_green = np.array([35, 100, 100]); upper_green = np.array([85, 255, 255])
-        mask = cv2.inRange(hsv, lower_green, upper_green); result = cv2.bitwise_and(img, img, mask=mask)
-        self.processed_image = result; self.display_images()
+        self.add_edit_step("Ball Mask", "color_classes", classes="green", mode="keep")
+    def classify_colors(self):
+        self.add_edit_step("Color Classes", "color_classes")
    # -------------------------------- Tareq--------------------------------------
    
     def segment_kmeans(self):
@@ -380,126 +494,202 @@ class AdvancedImageProcessor:
         if img is None: return
         k = simpledialog.askinteger("K-Means Clusters", "أدخل عدد الألوان (K):", parent=self.root, minvalue=2, maxvalue=32)
         if k is None: return
-        pixel_values = img.reshape((-1, 3)); pixel_values = np.float32(pixel_values); criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 100, 0.2)
-        _, labels, (centers) = cv2.kmeans(pixel_values, k, None, criteria, 10, cv2.KMEANS_RANDOM_CENTERS)
-        centers = np.uint8(centers); segmented_image = centers[labels.flatten()]; self.processed_image = segmented_image.reshape(img.shape); self.display_images()
-    def segment_watershed_auto(self):
+        self.add_edit_step(f"K-Means (K={k})", "kmeans", k=k)
+    def segment_kmeans_fast(self):
         img = self.get_current_image();
         if img is None: return
-        gray = cv2.cvtColor(img, cv2.COLOR_RGB2GRAY); ret, thresh = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU); kernel = np.ones((3,3), np.uint8)
-        opening = cv2.morphologyEx(thresh, cv2.MORPH_OPEN, kernel, iterations=2); sure_bg = cv2.dilate(opening, kernel, iterations=3)
-        dist_transform = cv2.distanceTransform(opening, cv2.DIST_L2, 5); ret, sure_fg = cv2.threshold(dist_transform, 0.7*dist_transform.max(), 255, 0)
-        sure_fg = np.uint8(sure_fg); unknown = cv2.subtract(sure_bg, sure_fg); ret, markers = cv2.connectedComponents(sure_fg)
-        markers = markers + 1; markers[unknown==255] = 0; markers = cv2.watershed(img, markers)
-        img_result = img.copy(); img_result[markers == -1] = [255, 0, 0]; self.processed_image = img_result; self.display_images()
+        k = simpledialog.askinteger("Fast K-Means", "أدخل عدد الألوان (K):", parent=self.root, minvalue=2, maxvalue=64)
+        if k is None: return
+        palette = self.kmeans_palette if self.kmeans_palette is not None and len(self.kmeans_palette) == k and messagebox.askyesno("Fast K-Means", "استخدام لوحة الألوان السابقة بنفس العدد؟", parent=self.root) else None
+        # The fitted palette is stored in the step, so replaying the stack quantizes with the same colours
+        def use_palette(centers): self.kmeans_palette = centers; self.add_edit_step(f"Fast K-Means (K={k})", "kmeans_fast", k=k, palette=centers)
+        if palette is not None: use_palette(palette); return
+        self.run_in_background(f"K-Means palette (K={k})", engine.fit_kmeans_palette, img, k, sample_size=100_000, attempts=3, on_result=use_palette)
+    def segment_watershed_auto(self):
+        self.add_edit_step("Automatic Watershed", "watershed")
     def segment_watershed_interactive(self):
         img = self.get_current_image();
         if img is None: return
-        helper = WatershedHelper(img.copy()); window_name = "Watershed Marking - Press Enter to Apply"; cv2.namedWindow(window_name)
-        cv2.setMouseCallback(window_name, helper.mouse_callback); messagebox.showinfo("Watershed Instructions", "1. ارسم على الصورة.\n2. اضغط 'f' للكائن و 'b' للخلفية.\n3. اضغط 'Enter' للتنفيذ.", parent=self.root)
-        while True:
-            cv2.imshow(window_name, helper.image); key = cv2.waitKey(1) & 0xFF
-            if key == ord('b'): helper.set_marker_type('background')
-            elif key == ord('f'): helper.set_marker_type('foreground')
-            elif key == 13: break
-            elif key == 27: cv2.destroyWindow(window_name); return
-        cv2.destroyWindow(window_name); original_img_for_watershed = self.get_current_image(); markers = cv2.watershed(original_img_for_watershed, helper.markers)
-        img_result = original_img_for_watershed.copy(); img_result[markers == -1] = [255, 0, 0]; self.processed_image = img_result; self.display_images()
-       
+        # Markers are painted in a Tk window that re-segments a preview after each stroke; "Apply" adds the full-resolution step
+        WatershedEditor(self.root, img, lambda strokes, preview_size: self.add_edit_step("Interactive Watershed", "watershed_strokes", strokes=strokes, preview_size=preview_size))
+
     def manually_mask_object(self):
         img = self.get_current_image();
         if img is None: return
         messagebox.showinfo("Instructions", "ارسم مستطيلًا حول الكائن ثم اضغط Enter", parent=self.root)
         roi = cv2.selectROI("Select Object", cv2.cvtColor(img, cv2.COLOR_RGB2BGR), False); cv2.destroyWindow("Select Object")
         if not any(roi): return
-        mask = np.zeros(img.shape[:2], np.uint8); bgdModel = np.zeros((1, 65), np.float64); fgdModel = np.zeros((1, 65), np.float64)
-        cv2.grabCut(img, mask, roi, bgdModel, fgdModel, 5, cv2.GC_INIT_WITH_RECT)
-        mask2 = np.where((mask == 2) | (mask == 0), 0, 1).astype('uint8'); self.processed_image = img * mask2[:, :, np.newaxis]; self.display_images()
+        self.add_edit_step("GrabCut", "grabcut", rect=tuple(int(v) for v in roi), iterations=5)
     
     def apply_morph_basic(self):
         img = self.get_current_image(gray=True);
         if img is None: return
-        _, img_bin = cv2.threshold(img, 127, 255, cv2.THRESH_BINARY); kernel = np.ones((5,5), np.uint8)
-        erosion = cv2.erode(img_bin, kernel, iterations=1); dilation = cv2.dilate(img_bin, kernel, iterations=1); gradient = cv2.morphologyEx(img_bin, cv2.MORPH_GRADIENT, kernel)
-        self.show_results_in_new_window([img_bin, erosion, dilation, gradient], ["Binary", "Erosion", "Dilation", "Gradient"])
+        titles = ["Binary", "Erosion", "Dilation", "Gradient"]
+        if self.is_large_image(img): self.run_tiled("Morphology", img, [[("binary", {})]] + [[(op, {"ksize": 5})] for op in ("erode", "dilate", "gradient")], titles); return
+        self.show_results_in_new_window(list(engine.morph_basic(img, 5)), titles)
     def apply_opening_tophat(self):
         img = self.get_current_image(gray=True);
         if img is None: return
-        _, img_bin = cv2.threshold(img, 127, 255, cv2.THRESH_BINARY); kernel = np.ones((9,9), np.uint8)
-        opening = cv2.morphologyEx(img_bin, cv2.MORPH_OPEN, kernel); tophat = cv2.morphologyEx(img_bin, cv2.MORPH_TOPHAT, kernel)
-        self.show_results_in_new_window([img_bin, opening, tophat], ["Binary", "Opening", "Top-hat"])
+        titles = ["Binary", "Opening", "Top-hat"]
+        if self.is_large_image(img): self.run_tiled("Opening & TopHat", img, [[("binary", {})]] + [[(op, {"ksize": 9})] for op in ("opening", "tophat")], titles); return
+        self.show_results_in_new_window(list(engine.opening_tophat(img, 9)), titles)
 # -------------------------------- Tareq--------------------------------------
     def apply_rotation(self):
         img = self.get_current_image();
         if img is None: return
         angle = simpledialog.askfloat("Input", "أدخل زاوية الدوران:", parent=self.root, minvalue=-360, maxvalue=360)
         if angle is None: return
-        (h, w) = img.shape[:2]; center = (w // 2, h // 2); M = cv2.getRotationMatrix2D(center, angle, 1.0)
-        self.processed_image = cv2.warpAffine(img, M, (w, h)); self.display_images()
+        self.add_edit_step("Rotation", "rotate", angle=angle)
     def apply_translation(self):
         img = self.get_current_image();
         if img is None: return
         tx = simpledialog.askinteger("Input", "أدخل الإزاحة الأفقية (X):", parent=self.root); ty = simpledialog.askinteger("Input", "أدخل الإزاحة العمودية (Y):", parent=self.root)
         if tx is None or ty is None: return
-        (h, w) = img.shape[:2]; M = np.float32([[1, 0, tx], [0, 1, ty]]); self.processed_image = cv2.warpAffine(img, M, (w, h)); self.display_images()
+        self.add_edit_step("Translation", "translate", tx=tx, ty=ty)
     def apply_zoom(self):
         img = self.get_current_image();
         if img is None: return
         factor = simpledialog.askfloat("Input", "أدخل معامل التكبير:", parent=self.root, minvalue=0.1)
         if factor is None: return
-        self.processed_image = cv2.resize(img, None, fx=factor, fy=factor, interpolation=cv2.INTER_LINEAR); self.display_images()
+        self.add_edit_step("Zoom", "zoom", factor=factor)
     def apply_crop(self):
         img = self.get_current_image();
         if img is None: return
         messagebox.showinfo("Instructions", "ارسم مستطيلًا للقص ثم اضغط Enter", parent=self.root)
         roi = cv2.selectROI("Crop Image", cv2.cvtColor(img, cv2.COLOR_RGB2BGR), False); cv2.destroyWindow("Crop Image")
         if not any(roi): return
-        x, y, w, h = roi; self.processed_image = img[y:y+h, x:x+w]; self.display_images()
+        x, y, w, h = (int(v) for v in roi); self.add_edit_step("Crop", "crop", x=x, y=y, w=w, h=h)
     def load_cascades(self):
-        self.face_cascade, self.eye_cascade = None, None
-        face_path = os.path.join('haarcascades', 'haarcascade_frontalface_default.xml'); eye_path = os.path.join('haarcascades', 'haarcascade_eye.xml')
-        if os.path.exists(face_path): self.face_cascade = cv2.CascadeClassifier(face_path)
-        if os.path.exists(eye_path): self.eye_cascade = cv2.CascadeClassifier(eye_path)
+        # Parsed on a background thread; the edit stack resolves them only when a step needs them.
+        # The load time and whether the files were found show in the performance panel.
+        def loaded(cascades, seconds):
+            now = time.perf_counter(); self.perf.record("startup:cascades", now - seconds, now)
+            self.perf.set_counter("cascades", "ok" if cascades[0] is not None else "missing")
+        self.cascade_loader = BackgroundLoader(engine.load_cascades, name="cascade-loader", on_loaded=loaded).start(); self.edits.cascades = self.cascade_loader.get
     def load_image(self):
         self.stop_camera()
         path = filedialog.askopenfilename(filetypes=[("Image files", "*.jpg *.jpeg *.png *.bmp")])
         if not path: return
         self.original_image = cv2.cvtColor(cv2.imread(path), cv2.COLOR_BGR2RGB); self.reset_image()
     def reset_image(self):
-        if self.original_image is not None: self.processed_image = self.original_image.copy(); self.display_images()
+        # Back to the loaded image as an undoable step; cached results of the old steps stay available
+        if self.original_image is not None: self.edits.reset(); self.show_edit_result()
     def display_images(self):
         self.display_image(self.original_image, self.original_label); self.display_image(self.processed_image, self.processed_label)
-    def display_image(self, img, label_widget, max_size=600):
-        if img is None: label_widget.config(image='', text=""); return
-        if len(img.shape) == 2: img = cv2.cvtColor(img, cv2.COLOR_GRAY2RGB)
-        h, w, _ = img.shape
-        if w == 0 or h == 0: return
-        scale = min(max_size/w, max_size/h) if w > 0 and h > 0 else 1
-        img_resized = cv2.resize(img, (int(w*scale), int(h*scale)))
-        img_pil = Image.fromarray(img_resized); img_tk = ImageTk.PhotoImage(image=img_pil)
-        label_widget.config(image=img_tk); label_widget.image = img_tk
+    def display_image(self, img, label_widget, max_size=600, version=None):
+        self.renderer.render(img, label_widget, max_size, version)
     def show_results_in_new_window(self, images, titles):
-        top = tk.Toplevel(self.root); top.title("نتائج المعالجة"); top.configure(bg=self.BG_COLOR)
-        fig = plt.figure(figsize=(12, 8), facecolor=self.BG_COLOR)
-        cols = 3; rows = (len(images) + cols - 1) // cols
-        for i, (img, title) in enumerate(zip(images, titles)):
-            img_display = cv2.cvtColor(img, cv2.COLOR_GRAY2RGB) if len(img.shape) == 2 else img
-            ax = fig.add_subplot(rows, cols, i + 1); ax.imshow(img_display)
-            ax.set_title(title, color=self.FG_COLOR); ax.axis('off')
-        plt.tight_layout()
-        canvas = FigureCanvasTkAgg(fig, master=top); canvas.get_tk_widget().pack(side=tk.TOP, fill=tk.BOTH, expand=1); canvas.draw()
+        # One downscaled mosaic; panels open at full resolution on click and everything is freed on close
+        return MosaicViewer(self.root, images, titles, bg=self.BG_COLOR)
     def get_current_image(self, gray=False):
-        if self.original_image is None: messagebox.showerror("خطأ", "يرجى تحميل صورة أولاً"); return None
-        img = self.original_image.copy()
-        if gray: return cv2.cvtColor(img, cv2.COLOR_RGB2GRAY)
-        return img
+        # The output of the edit stack (the loaded image when it is empty) as a zero-copy read-only view;
+        # callers that draw on it take their own copy
+        if self.image_state.is_empty: messagebox.showerror("خطأ", "يرجى تحميل صورة أولاً"); return None
+        if not self.edits.steps: return self.image_state.gray() if gray else self.image_state.original
+        img = self.edits.cached()
+        if img is None:
+            # Evicted from the cache: never recompute on the Tk thread; replay in the background instead
+            self.show_edit_result(); messagebox.showinfo("تنبيه", "يُعاد حساب الصورة الحالية في الخلفية، أعد المحاولة بعد انتهائها.", parent=self.root); return None
+        return engine.to_gray(img) if gray else img
+    def add_edit_step(self, title, name, **params):
+        # Adds (name, params) on top of the edit stack; the step runs in the background unless its result is cached
+        if self.image_state.is_empty: messagebox.showerror("خطأ", "يرجى تحميل صورة أولاً"); return
+        # The step hashes its parameters here, once; history and cache lookups reuse that digest
+        step = Step(name, params); steps = self.edits.steps + (step,)
+        def on_result(result): self.edits.push(step); self.show_edit_result()
+        if self.edits.cached(steps) is not None: on_result(None); return
+        self.run_in_background(title, self.edits.compute, steps, on_result=on_result)
+    def show_edit_result(self):
+        self.refresh_history_list()
+        result = self.edits.cached()
+        if result is not None: self.set_processed_image(result); return
+        # Evicted from the cache (or an earlier step was changed): recompute from the nearest cached step
+        steps = self.edits.steps
+        def on_result(result):
+            if self.edits.steps == steps: self.set_processed_image(result)
+        self.run_in_background("Replay edits", self.edits.compute, steps, on_result=on_result)
+    def refresh_history_list(self):
+        self.history_list.delete(0, tk.END); self.history_list.insert(tk.END, "• الصورة الأصلية")
+        for i, (name, params) in enumerate(self.edits.steps): self.history_list.insert(tk.END, f"{i + 1}. {format_step(name, params)}")
+    def undo_edit(self):
+        if self.edits.undo(): self.show_edit_result()
+    def redo_edit(self):
+        if self.edits.redo(): self.show_edit_result()
+    def selected_step_index(self):
+        selection = self.history_list.curselection()
+        return selection[0] - 1 if selection and selection[0] > 0 else None
+    def remove_edit_step(self):
+        index = self.selected_step_index()
+        if index is None: messagebox.showinfo("تنبيه", "اختر خطوة من السجل أولاً.", parent=self.root); return
+        self.edits.remove(index); self.show_edit_result()
+    def edit_step(self):
+        # Later steps are re-run on the new output; earlier ones come from the cache
+        index = self.selected_step_index()
+        if index is None: return
+        name, params = self.edits.steps[index]
+        if not is_text_editable(params): messagebox.showinfo("تنبيه", "لا يمكن تعديل هذه الخطوة نصياً.", parent=self.root); return
+        spec = simpledialog.askstring("تعديل الخطوة", "op:key=value:key=value", initialvalue=format_step(name, params), parent=self.root)
+        if not spec: return
+        try: new_name, new_params = engine.parse_operation(spec.strip())
+        except ValueError as e: messagebox.showerror("خطأ", str(e), parent=self.root); return
+        self.edits.replace(index, new_name, new_params); self.show_edit_result()
+    def set_processed_image(self, img):
+        self.processed_image = img; self.display_images()
+    def run_in_background(self, name, func, *args, on_result=None, image_bound=True, **kwargs):
+        # func must accept a progress= callback; the result is applied on the Tk thread. Results of
+        # image_bound jobs are dropped if another image was loaded (or the camera started) meanwhile.
+        version = self.edits.source_version; on_result = on_result or self.set_processed_image
+        def on_error(job, error): messagebox.showerror("خطأ", f"فشلت العملية '{job.name}':\n{error}", parent=self.root)
+        def on_done(result):
+            if not image_bound or self.edits.source_version == version: on_result(result)
+        def run(job):
+            with span(self.perf, f"job:{name}"): return func(*args, progress=job.report, **kwargs)
+        return self.jobs.submit(name, run, on_done=on_done, on_error=on_error)
+    def is_large_image(self, img):
+        return img.shape[0] * img.shape[1] >= TILED_PIXELS
+    def run_tiled(self, name, img, chains, titles=None):
+        # Large images: run each chain tile by tile in the background so intermediates stay tile-sized
+        def run(progress=None):
+            results = []
+            for i, chain in enumerate(chains):
+                step = (lambda f, msg=None, i=i: progress((i + f) / len(chains), msg)) if progress else None
+                results.append(tiled_engine.process_tiled(img, chain, progress=step))
+            return results
+        on_result = (lambda results: self.show_results_in_new_window(results, titles)) if titles else (lambda results: self.set_processed_image(results[0]))
+        return self.run_in_background(name, run, on_result=on_result)
+    def refresh_jobs_panel(self, jobs):
+        for job_id in [job_id for job_id in self.job_rows if job_id not in {job.id for job in jobs}]: self.job_rows.pop(job_id)[0].destroy()
+        for job in jobs:
+            if job.id not in self.job_rows:
+                row = ttk.Frame(self.jobs_frame); label = ttk.Label(row, text=job.name, font=self.team_font, width=18); label.pack(side=tk.LEFT, padx=5)
+                bar = ttk.Progressbar(row, maximum=1.0, length=120); bar.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=5)
+                ttk.Button(row, text="✖", width=3, command=job.cancel, style='Reset.TButton').pack(side=tk.LEFT, padx=5); row.pack(fill=tk.X, pady=2)
+                self.job_rows[job.id] = (row, label, bar)
+            _, label, bar = self.job_rows[job.id]; bar['value'] = job.progress
+            label.config(text=f"{job.name} {job.message}".strip() if job.status == "running" else f"{job.name} (في الانتظار)")
+        if self.job_rows: self.jobs_empty_label.pack_forget()
+        else: self.jobs_empty_label.pack(pady=5)
+    def update_perf_panel(self):
+        # Refreshes itself twice a second while the panel is shown
+        if self.perf_panel_job is not None: self.root.after_cancel(self.perf_panel_job); self.perf_panel_job = None
+        if not self.show_perf_panel.get(): self.perf_label.pack_forget(); return
+        self.perf_label.config(text=self.perf.format_summary()); self.perf_label.pack(fill=tk.X, padx=5, pady=5)
+        self.perf_panel_job = self.root.after(500, self.update_perf_panel)
+    def export_perf_trace(self):
+        path = filedialog.asksaveasfilename(defaultextension=".json", initialfile=f"trace_{time.strftime('%Y%m%d_%H%M%S')}.json", filetypes=[("Chrome trace", "*.json")])
+        if not path: return
+        self.perf.export_chrome_trace(path); messagebox.showinfo("نجاح", f"تم حفظ ملف التتبع:\n{path}\n(افتحه في chrome://tracing أو ui.perfetto.dev)")
     def add_button(self, parent, text, command, tooltip_text=None):
         button = ttk.Button(parent, text=text, command=command)
         button.pack(fill=tk.X, padx=10, pady=4)
         tip_text = tooltip_text if tooltip_text else text
         ToolTip(button, tip_text)
 
+# Every apply_*/detect_*/segment_* action is timed as "ui:<method>"; background work is timed as "job:<name>"
+instrument_methods(AdvancedImageProcessor, ("apply_", "detect_", "segment_"))
+
 if __name__ == "__main__":
     root = tk.Tk()
     app = AdvancedImageProcessor(root)
-    root.mainloop()
\ No newline at end of file
+    root.mainloop()
+    app.jobs.shutdown()
\ No newline at end of file
@@ -0,0 +1,150 @@
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+import image_engine as engine
+import tiled_engine
+
+# ==========================================================
+# Batch CLI: run a chain of engine operations over a directory
+# Example:
+#   python batch_processor.py photos/ out/ --chain median:ksize=5 canny:threshold1=50:threshold2=150
+# ==========================================================
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff')
+
+_worker_chain = None; _worker_cascades = None
+
+
+def _init_worker(chain, cascade_dir):
+    global _worker_chain, _worker_cascades
+    _worker_chain = chain
+    _worker_cascades = engine.load_cascades(cascade_dir) if engine.chain_needs_cascades(chain) else None
+
+
+def _process_one(src, dst):
+    start = time.perf_counter()
+    try:
+        img = engine.read_image(src); pixels = img.shape[0] * img.shape[1]
+        engine.write_image(dst, engine.run_chain(img, _worker_chain, _worker_cascades))
+        return src, None, pixels, time.perf_counter() - start
+    except Exception as e:
+        return src, str(e), 0, time.perf_counter() - start
+
+
+def find_images(input_dir, recursive=False, extensions=IMAGE_EXTENSIONS):
+    for dirpath, dirnames, filenames in os.walk(input_dir):
+        for name in sorted(filenames):
+            if name.lower().endswith(extensions): yield os.path.join(dirpath, name)
+        if not recursive: break
+
+
+def output_path_for(src, input_dir, output_dir, out_ext=None):
+    rel = os.path.relpath(src, input_dir)
+    if out_ext: rel = os.path.splitext(rel)[0] + out_ext
+    return os.path.join(output_dir, rel)
+
+
+def fit_shared_palette(input_dir, k, recursive=False, max_images=50, sample_per_image=20_000, seed=None, log=print):
+    # Pools a pixel sample from (up to) max_images readable inputs so the whole batch is quantized with one
+    # palette; unreadable files are reported and skipped like in the batch itself
+    samples = []; found = 0
+    for path in find_images(input_dir, recursive):
+        found += 1
+        try: samples.append(engine.sample_pixels(engine.read_image(path), sample_per_image, seed=seed))
+        except Exception as e: log(f"[ERROR] {path}: {e}"); continue
+        if len(samples) == max_images: break
+    if not found: raise ValueError(f"No images found in {input_dir}")
+    if not samples: raise ValueError(f"None of the images in {input_dir} could be read")
+    samples = np.concatenate(samples)
+    return engine.fit_kmeans_palette(samples.reshape((-1, 1, 3)), k, sample_size=len(samples), seed=seed)
+
+
+def with_palette(chain, palette_path):
+    return [(name, dict(params, palette=params.get("palette", palette_path)) if name == "kmeans_fast" else params) for name, params in chain]
+
+
+def run_batch(input_dir, output_dir, chain, workers=None, recursive=False, out_ext=None, cascade_dir=engine.CASCADE_DIR, max_pending=None, log=print):
+    workers = workers or os.cpu_count() or 1; max_pending = max_pending or workers * 4
+    done = failed = total_pixels = 0; start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(chain, cascade_dir)) as pool:
+        pending = set()
+
+        def drain(block_until):
+            nonlocal done, failed, total_pixels
+            while len(pending) > block_until:
+                future = next(as_completed(pending)); pending.discard(future)
+                src, error, pixels, _ = future.result()
+                if error: failed += 1; log(f"[ERROR] {src}: {error}")
+                else: done += 1; total_pixels += pixels
+                if (done + failed) % 100 == 0:
+                    elapsed = time.perf_counter() - start
+                    log(f"[*] {done + failed} images, {(done + failed) / elapsed:.1f} img/s")
+
+        # Keep only a bounded number of submitted jobs so huge directories stream instead of queueing up front
+        for src in find_images(input_dir, recursive):
+            dst = output_path_for(src, input_dir, output_dir, out_ext); os.makedirs(os.path.dirname(dst) or '.', exist_ok=True)
+            pending.add(pool.submit(_process_one, src, dst))
+            if len(pending) >= max_pending: drain(max_pending // 2)
+        drain(0)
+    elapsed = time.perf_counter() - start
+    stats = {"processed": done, "failed": failed, "seconds": elapsed,
+             "images_per_second": done / elapsed if elapsed > 0 else 0.0,
+             "megapixels_per_second": total_pixels / 1e6 / elapsed if elapsed > 0 else 0.0}
+    return stats
+
+
+def run_batch_tiled(input_dir, output_dir, chain, workers=None, recursive=False, out_ext=None, tile_size=tiled_engine.DEFAULT_TILE_SIZE, log=print):
+    # One image at a time, with the tiles of each image spread over the workers; for images too large to hold several in RAM
+    done = failed = total_pixels = 0; start = time.perf_counter()
+    for src in find_images(input_dir, recursive, IMAGE_EXTENSIONS + ('.npy',)):
+        dst = output_path_for(src, input_dir, output_dir, out_ext); os.makedirs(os.path.dirname(dst) or '.', exist_ok=True)
+        try: shape = tiled_engine.process_file_tiled(src, dst, chain, tile_size, workers); done += 1; total_pixels += shape[0] * shape[1]
+        except Exception as e: failed += 1; log(f"[ERROR] {src}: {e}")
+    elapsed = time.perf_counter() - start
+    return {"processed": done, "failed": failed, "seconds": elapsed,
+            "images_per_second": done / elapsed if elapsed > 0 else 0.0,
+            "megapixels_per_second": total_pixels / 1e6 / elapsed if elapsed > 0 else 0.0}
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Run a chain of image operations over a directory of images.")
+    parser.add_argument("input_dir"); parser.add_argument("output_dir")
+    parser.add_argument("--chain", nargs='+', required=True, metavar="OP[:key=value...]", help=f"Operations applied in order. Available: {', '.join(sorted(engine.OPERATIONS))}")
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes (default: CPU count)")
+    parser.add_argument("--recursive", action="store_true", help="Include sub-directories")
+    parser.add_argument("--ext", default=None, help="Output extension, e.g. .png (default: keep input extension)")
+    parser.add_argument("--fit-palette", type=int, default=None, metavar="K", help="Fit one K-colour palette on a sample of the inputs and use it for every kmeans_fast step")
+    parser.add_argument("--tiled", action="store_true", help="Process each image in halo-overlapped tiles with bounded memory (.npy inputs are memory-mapped)")
+    parser.add_argument("--tile-size", type=int, default=tiled_engine.DEFAULT_TILE_SIZE, help="Tile side in pixels for --tiled")
+    parser.add_argument("--cascade-dir", default=engine.CASCADE_DIR, help="Directory with Haar cascade XML files")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    try: chain = engine.parse_chain(args.chain)
+    except ValueError as e: print(f"[ERROR] {e}", file=sys.stderr); return 2
+    if not os.path.isdir(args.input_dir): print(f"[ERROR] Input directory not found: {args.input_dir}", file=sys.stderr); return 2
+    if args.fit_palette:
+        if not any(name == "kmeans_fast" for name, _ in chain): print("[ERROR] --fit-palette needs a kmeans_fast step in the chain", file=sys.stderr); return 2
+        os.makedirs(args.output_dir, exist_ok=True); palette_path = os.path.join(args.output_dir, "palette.npy")
+        try: palette = fit_shared_palette(args.input_dir, args.fit_palette, args.recursive)
+        except ValueError as e: print(f"[ERROR] {e}", file=sys.stderr); return 2
+        engine.save_palette(palette_path, palette); chain = with_palette(chain, os.path.abspath(palette_path))
+        print(f"[*] Shared palette saved to {palette_path}")
+    if args.tiled:
+        if not tiled_engine.is_tileable(chain): print(f"[ERROR] --tiled supports only: {', '.join(sorted(tiled_engine.TILE_HALOS))}", file=sys.stderr); return 2
+        stats = run_batch_tiled(args.input_dir, args.output_dir, chain, args.workers, args.recursive, args.ext, args.tile_size)
+    else: stats = run_batch(args.input_dir, args.output_dir, chain, args.workers, args.recursive, args.ext, args.cascade_dir)
+    print(f"[SUCCESS] {stats['processed']} processed, {stats['failed']} failed in {stats['seconds']:.2f}s "
+          f"({stats['images_per_second']:.1f} img/s, {stats['megapixels_per_second']:.1f} MP/s)")
+    return 1 if stats['failed'] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,256 @@
+import argparse
+import json
+import math
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+import color_classes
+import image_engine as engine
+from face_tracking import FaceTracker
+
+# ==========================================================
+# Operation Benchmarks
+# Runs every engine operation (and the live effects chain) on generated
+# images, records wall time, peak memory and throughput to JSON and
+# compares median timings against a stored baseline, allowing for the
+# machine's run-to-run noise. Needs no display and no camera.
+# Examples:
+#   python benchmark.py --resolutions vga hd --output bench.json
+#   python benchmark.py --baseline bench_baseline.json --tolerance 0.25
+# ==========================================================
+
+RESOLUTIONS = {"vga": (640, 480), "hd": (1280, 720), "fhd": (1920, 1080), "12mp": (4000, 3000), "24mp": (6000, 4000)}
+CONTENT_TYPES = ("noise", "gradient", "circles", "lines", "faces")
+
+
+# ----------------------------------------------------------
+# Synthetic inputs (RGB, deterministic for a given seed)
+# ----------------------------------------------------------
+def make_noise(w, h, rng):
+    return rng.integers(0, 256, (h, w, 3), dtype=np.uint8)
+
+
+def make_gradient(w, h, rng):
+    x = np.linspace(0, 255, w, dtype=np.float32)[None, :]; y = np.linspace(0, 255, h, dtype=np.float32)[:, None]
+    return np.dstack([np.broadcast_to(x, (h, w)), np.broadcast_to(y, (h, w)), (x + y) / 2]).astype(np.uint8)
+
+
+def make_circles(w, h, rng):
+    # Rings rather than discs: the Hough gradient detector finds next to nothing on filled discs
+    img = np.full((h, w, 3), 30, np.uint8); scale = min(w, h); thickness = max(2, scale // 480)
+    for _ in range(25):
+        r = int(rng.integers(scale // 60, scale // 12)); c = (int(rng.integers(r, w - r)), int(rng.integers(r, h - r)))
+        cv2.circle(img, c, r, tuple(int(v) for v in rng.integers(80, 256, 3)), thickness, cv2.LINE_AA)
+    return img
+
+
+def make_lines(w, h, rng):
+    img = np.full((h, w, 3), 20, np.uint8)
+    for _ in range(40):
+        p1 = (int(rng.integers(0, w)), int(rng.integers(0, h))); p2 = (int(rng.integers(0, w)), int(rng.integers(0, h)))
+        cv2.line(img, p1, p2, (230, 230, 230), max(1, min(w, h) // 300))
+    return img
+
+
+def make_faces(w, h, rng):
+    # Cartoon faces (skin ellipse, dark eyes and mouth): enough structure to exercise the cascades
+    img = make_gradient(w, h, rng) // 2 + 60; size = min(w, h) // 5
+    for cx in range(size, w - size, int(size * 2.2)):
+        for cy in range(size, h - size, int(size * 2.5)):
+            cv2.ellipse(img, (cx, cy), (int(size * 0.75), size), 0, 0, 360, (224, 172, 140), -1)
+            for ex in (-1, 1): cv2.ellipse(img, (cx + ex * size // 3, cy - size // 4), (size // 7, size // 12), 0, 0, 360, (40, 30, 30), -1)
+            cv2.ellipse(img, (cx, cy + size // 2), (size // 3, size // 10), 0, 0, 180, (120, 40, 40), -1)
+    return img
+
+
+GENERATORS = {"noise": make_noise, "gradient": make_gradient, "circles": make_circles, "lines": make_lines, "faces": make_faces}
+
+
+def generate(content, resolution, seed=0):
+    w, h = RESOLUTIONS[resolution]
+    return GENERATORS[content](w, h, np.random.default_rng(seed))
+
+# ----------------------------------------------------------
+# Benchmarked operations: name -> (content types, callable(img, context))
+# ----------------------------------------------------------
+def _live_settings(**overrides):
+    return dict(engine.DEFAULT_LIVE_SETTINGS, **overrides)
+
+
+def _live_chain(settings):
+    def run(img, ctx):
+        chain = ctx.setdefault(("live_chain", id(settings)), engine.LiveEffectsChain())
+        return chain.process(cv2.cvtColor(img, cv2.COLOR_RGB2BGR), settings, *ctx["cascades"], ctx.get("tracker"))
+    return run
+
+
+def _seed_markers(img):
+    # Foreground seed in the centre and background along the border, like a user's two strokes
+    h, w = img.shape[:2]; markers = np.zeros((h, w), np.int32); r = max(2, min(h, w) // 20)
+    markers[h // 2 - r:h // 2 + r, w // 2 - r:w // 2 + r] = 1; markers[:r, :] = markers[-r:, :] = markers[:, :r] = markers[:, -r:] = 2
+    return markers
+
+
+def _seed_strokes(img):
+    # The same two seeds as editor strokes: a short foreground line in the centre and the image border
+    h, w = img.shape[:2]; r = max(2, min(h, w) // 40)
+    return ((1, r, ((w * 0.45, h / 2), (w * 0.55, h / 2))), (2, r, ((r, r), (w - r, r), (w - r, h - r), (r, h - r), (r, r))))
+
+
+
+def _preview_size(img, max_size=800):
+    # What the editor's proxy of this image would measure
+    h, w = img.shape[:2]; scale = min(1.0, max_size / w, max_size / h)
+    return max(1, int(w * scale)), max(1, int(h * scale))
+
+
+OPERATION_PARAMS = {"grabcut": lambda img: {"rect": (img.shape[1] // 4, img.shape[0] // 4, img.shape[1] // 2, img.shape[0] // 2)},
+                    "watershed_markers": lambda img: {"markers": _seed_markers(img)},
+                    "watershed_strokes": lambda img: {"strokes": _seed_strokes(img), "preview_size": _preview_size(img)},
+                    "kmeans": lambda img: {"k": 4, "attempts": 3}, "kmeans_fast": lambda img: {"k": 8}}
+DEFAULT_CONTENT = {"faces": ("faces",), "circles": ("circles",), "lines": ("lines",), "corners": ("lines",), "color_classes": ("circles",)}
+
+
+def build_operations():
+    ops = {}
+    for name in engine.OPERATIONS:
+        params = OPERATION_PARAMS.get(name, lambda img: {})
+        ops[name] = (DEFAULT_CONTENT.get(name, ("noise", "gradient")),
+                     lambda img, ctx, name=name, params=params: engine.run_operation(img, name, params(img), ctx["cascades"]))
+    # Circles default to the coarse-to-fine pyramid, lines and corners to full resolution; each is also
+    # timed the other way. The corner pyramid keeps only the dominant corners (about 5% of the
+    # full-resolution peaks on "lines"), so those two timings are not like for like.
+    ops["circles_fullres"] = (DEFAULT_CONTENT["circles"], lambda img, ctx: engine.run_operation(img, "circles", {"pyramid": 0}))
+    for name in ("lines", "corners"):
+        ops[f"{name}_pyramid"] = (DEFAULT_CONTENT[name], lambda img, ctx, name=name: engine.run_operation(img, name, {"pyramid": None}))
+    ops["live_adjust"] = (("noise",), _live_chain(_live_settings(contrast=20, exposure=10, sharpen=30, flip=True)))
+    ops["live_canny"] = (("noise",), _live_chain(_live_settings(contrast=20, canny=True)))
+    ops["live_faces"] = (("faces",), _live_chain(_live_settings(face_detect=True)))
+    ops["live_faces_tracked"] = (("faces",), _live_chain(_live_settings(face_detect=True, face_tracking=True)))
+    ops["live_colors"] = (("circles",), _live_chain(_live_settings(color_classes=tuple(color_classes.DEFAULT_COLOR_CLASSES))))
+    return ops
+
+# ----------------------------------------------------------
+# Measurement
+# ----------------------------------------------------------
+def measure(func, img, ctx, repeat):
+    # Peak memory comes from tracemalloc, which sees numpy (and so OpenCV output) allocations but
+    # not OpenCV's internal scratch buffers. Timing runs are separate so tracing does not skew them.
+    func(img, ctx)
+    tracemalloc.start(); func(img, ctx); _, peak = tracemalloc.get_traced_memory(); tracemalloc.stop()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter(); func(img, ctx); times.append(time.perf_counter() - start)
+    # The spread (slowest minus fastest run) is the noise the regression gate allows for
+    return min(times), statistics.median(times), max(times) - min(times), peak
+
+
+def run_benchmarks(resolutions, op_names=None, contents=None, repeat=3, seed=0, log=print):
+    operations = build_operations(); results = []
+    cascades = engine.load_cascades()
+    if cascades[0] is None: log("[WARNING] Haar cascades not found; face operations are skipped")
+    for name in op_names or sorted(operations):
+        if name not in operations: raise ValueError(f"Unknown benchmark '{name}'. Available: {', '.join(sorted(operations))}")
+        op_contents, func = operations[name]
+        if "faces" in name and cascades[0] is None: continue
+        for resolution in resolutions:
+            for content in op_contents:
+                if contents and content not in contents: continue
+                img = generate(content, resolution, seed); mp = img.shape[0] * img.shape[1] / 1e6
+                ctx = {"cascades": cascades, "tracker": FaceTracker(*cascades) if cascades[0] is not None else None}
+                best, median, spread, peak = measure(func, img, ctx, repeat)
+                results.append({"operation": name, "resolution": resolution, "content": content, "megapixels": round(mp, 3), "repeat": repeat,
+                                "seconds": best, "median_seconds": median, "spread_seconds": spread, "peak_mb": peak / 2 ** 20, "mp_per_second": mp / best if best > 0 else None})
+                log(f"{name:20s} {resolution:5s} {content:9s} {best * 1000:10.2f} ms {peak / 2 ** 20:9.1f} MB {mp / best if best > 0 else 0:9.1f} MP/s")
+    return results
+
+
+def environment():
+    return {"python": platform.python_version(), "platform": platform.platform(), "machine": platform.machine(),
+            "cpu_count": os.cpu_count(), "opencv": cv2.__version__, "numpy": np.__version__, "opencv_threads": cv2.getNumThreads(),
+            "timestamp": time.strftime('%Y-%m-%dT%H:%M:%S')}
+
+
+def _key(r): return r["operation"], r["resolution"], r["content"]
+
+
+MIN_BASELINE_REPEAT = 3
+NOISE_SCATTER = 4.0  # robust standard deviations of the case-to-case scatter that still count as noise
+MIN_DRIFT_CASES = 5
+
+
+def _median(r): return r.get("median_seconds", r["seconds"])
+
+
+def _drift(pairs, min_seconds):
+    # Machine-wide speed change between the two runs (clock, load) and how far single cases scatter
+    # around it, from the log-ratios of the timings long enough to judge
+    logs = [math.log(_median(r) / _median(b)) for r, b in pairs if _median(b) > 0 and _median(r) >= min_seconds]
+    if len(logs) < MIN_DRIFT_CASES: return 0.0, 0.0
+    drift = statistics.median(logs)
+    return drift, 1.4826 * statistics.median(abs(x - drift) for x in logs)
+
+
+def compare(results, baseline, tolerance=0.2, min_seconds=0.002, noise=NOISE_SCATTER):
+    # Medians are compared, not best runs, after taking out the drift shared by all cases. A result
+    # regresses when it is slower than the drift predicts by more than `tolerance` or `noise` times the
+    # case-to-case scatter, whichever is larger, and by more than both runs' spread (slowest minus fastest
+    # repeat); sub-`min_seconds` timings are too noisy to judge.
+    base = {_key(r): r for r in baseline["results"]}; pairs = [(r, base[_key(r)]) for r in results if _key(r) in base]
+    drift, scatter = _drift(pairs, min_seconds); threshold = max(math.log(1 + tolerance), noise * scatter); report = []
+    for r, b in pairs:
+        current, previous = _median(r), _median(b); expected = previous * math.exp(drift)
+        margin = r.get("spread_seconds", 0.0) + b.get("spread_seconds", 0.0)
+        excess = math.log(current / expected) if current > 0 and expected > 0 else float('inf') if current > 0 else 0.0
+        if excess > threshold and current - expected > margin and current >= min_seconds: status = "regression"
+        elif excess < -threshold and expected - current > margin: status = "improvement"
+        else: status = "ok"
+        report.append({"operation": r["operation"], "resolution": r["resolution"], "content": r["content"], "baseline_seconds": previous,
+                       "seconds": current, "ratio": current / previous if previous > 0 else float('inf'), "expected_seconds": expected,
+                       "drift": math.exp(drift), "threshold": math.exp(threshold), "baseline_peak_mb": b["peak_mb"], "peak_mb": r["peak_mb"], "status": status})
+    return report
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Benchmark image operations on synthetic inputs.")
+    parser.add_argument("--resolutions", nargs='+', default=["vga", "hd"], choices=sorted(RESOLUTIONS))
+    parser.add_argument("--ops", nargs='+', default=None, help="Operations to run (default: all)")
+    parser.add_argument("--content", nargs='+', default=None, choices=CONTENT_TYPES, help="Restrict to these content types")
+    parser.add_argument("--repeat", type=int, default=3, help=f"Timed runs per case (best is reported, medians are compared; at least {MIN_BASELINE_REPEAT} with --baseline)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="Write results to this JSON file")
+    parser.add_argument("--baseline", default=None, help="Compare against this JSON file and exit 1 on regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Smallest slowdown flagged as a regression (0.2 = 20%%); widened to the measured noise")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.baseline and args.repeat < MIN_BASELINE_REPEAT: print(f"[ERROR] --baseline needs --repeat {MIN_BASELINE_REPEAT} or more to tell regressions from noise", file=sys.stderr); return 2
+    try: results = run_benchmarks(args.resolutions, args.ops, args.content, args.repeat, args.seed)
+    except ValueError as e: print(f"[ERROR] {e}", file=sys.stderr); return 2
+    report = {"environment": environment(), "results": results}
+    exit_code = 0
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f: baseline = json.load(f)
+        report["comparison"] = comparison = compare(results, baseline, args.tolerance)
+        regressions = [c for c in comparison if c["status"] == "regression"]
+        for c in regressions: print(f"[REGRESSION] {c['operation']} {c['resolution']} {c['content']}: median {c['baseline_seconds'] * 1000:.2f} -> {c['seconds'] * 1000:.2f} ms (x{c['ratio']:.2f}, expected {c['expected_seconds'] * 1000:.2f} ms)")
+        if comparison: print(f"[*] Machine drift x{comparison[0]['drift']:.2f}, flagging beyond x{comparison[0]['threshold']:.2f}")
+        print(f"[*] {len(comparison)} compared, {len(regressions)} regressions, {sum(c['status'] == 'improvement' for c in comparison)} improvements")
+        exit_code = 1 if regressions else 0
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f: json.dump(report, f, indent=2)
+        print(f"[SUCCESS] Results written to {args.output}")
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
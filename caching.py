@@ -0,0 +1,68 @@
+from collections import OrderedDict
+import threading
+
+import numpy as np
+
+# ==========================================================
+# LRU Cache with optional entry-count and memory budgets
+# ==========================================================
+
+_MISSING = object()
+
+
+def estimate_nbytes(value):
+    if isinstance(value, np.ndarray): return value.nbytes
+    if isinstance(value, (tuple, list)): return sum(estimate_nbytes(v) for v in value)
+    if isinstance(value, dict): return sum(estimate_nbytes(v) for v in value.values())
+    return 0
+
+
+class LRUCache:
+    def __init__(self, max_entries=None, max_bytes=None):
+        self.max_entries = max_entries; self.max_bytes = max_bytes
+        self._data = OrderedDict(); self._sizes = {}; self.total_bytes = 0
+        self.hits = 0; self.misses = 0; self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._data: self.misses += 1; return default
+            self._data.move_to_end(key); self.hits += 1
+            return self._data[key]
+
+    def put(self, key, value):
+        with self._lock:
+            if key in self._data: self._discard(key)
+            size = estimate_nbytes(value)
+            # A single value larger than the whole budget is simply not cached
+            if self.max_bytes is not None and size > self.max_bytes: return value
+            self._data[key] = value; self._sizes[key] = size; self.total_bytes += size
+            self._evict()
+            return value
+
+    def get_or_compute(self, key, compute):
+        value = self.get(key, _MISSING)
+        return self.put(key, compute()) if value is _MISSING else value
+
+    def pop(self, key, default=None):
+        with self._lock:
+            if key not in self._data: return default
+            value = self._data[key]; self._discard(key)
+            return value
+
+    def clear(self):
+        with self._lock: self._data.clear(); self._sizes.clear(); self.total_bytes = 0
+
+    def _discard(self, key):
+        del self._data[key]; self.total_bytes -= self._sizes.pop(key)
+
+    def _evict(self):
+        while self._data and ((self.max_entries is not None and len(self._data) > self.max_entries) or
+                              (self.max_bytes is not None and self.total_bytes > self.max_bytes)):
+            self._discard(next(iter(self._data)))
+
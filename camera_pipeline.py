@@ -0,0 +1,122 @@
+import queue
+import threading
+import time
+from collections import deque
+
+import cv2
+
+from perf_stats import span
+
+# ==========================================================
+# Threaded Camera Pipeline
+# capture thread -> [raw queue] -> effects worker -> [display queue] -> Tk UI
+# The raw queue holds a single frame and the display queue a few; both drop
+# the oldest frame when full, so a slow stage never makes the others fall
+# behind real time. An optional PerfMonitor times the "camera:read" and
+# "camera:effects" stages and receives the drop count. A `frame_sink`
+# callable(frame, capture_time), e.g. a VideoRecorder, sees every processed
+# frame on the worker thread, independent of the display rate. A frame whose
+# effects raise is skipped; the exception is kept in `error` until the next
+# frame goes through, and `error_count` counts them all, for the UI to report.
+# ==========================================================
+
+def put_latest(q, item):
+    # Returns the number of stale items discarded to make room
+    dropped = 0
+    while True:
+        try: q.put_nowait(item); return dropped
+        except queue.Full:
+            try: q.get_nowait(); dropped += 1
+            except queue.Empty: pass
+
+
+class RateMeter:
+    def __init__(self, window=30):
+        self.times = deque(maxlen=window)
+    def tick(self, t=None):
+        self.times.append(time.perf_counter() if t is None else t)
+    @property
+    def fps(self):
+        if len(self.times) < 2: return 0.0
+        span = self.times[-1] - self.times[0]
+        return (len(self.times) - 1) / span if span > 0 else 0.0
+
+
+class CameraPipeline:
+    def __init__(self, process_func, source=0, queue_size=2, capture=None, monitor=None):
+        self.process_func = process_func; self.source = source; self.capture = capture; self.monitor = monitor
+        self.raw_queue = queue.Queue(maxsize=1); self.display_queue = queue.Queue(maxsize=queue_size)
+        self.settings = {}; self.stop_event = threading.Event(); self.threads = []
+        self.capture_meter = RateMeter(); self.process_meter = RateMeter(); self.display_meter = RateMeter()
+        self.latencies = deque(maxlen=30); self.dropped_frames = 0; self.error = None; self.error_count = 0; self.frame_sink = None
+        self._stats_lock = threading.Lock(); self._capture_lock = threading.Lock()
+
+    def open(self):
+        if self.capture is None: self.capture = cv2.VideoCapture(self.source)
+        return self.capture.isOpened()
+
+    def start(self):
+        if not self.open(): return False
+        self.stop_event.clear()
+        self.threads = [threading.Thread(target=self._capture_loop, name="camera-capture", daemon=True),
+                        threading.Thread(target=self._process_loop, name="camera-effects", daemon=True)]
+        for t in self.threads: t.start()
+        return True
+
+    def stop(self, timeout=1.0):
+        self.stop_event.set()
+        for t in self.threads: t.join(timeout)
+        capture_thread = self.threads[0] if self.threads else None; self.threads = []
+        # Never release the device under a read() in progress: if the capture thread is still
+        # inside one, it releases the capture itself when the read returns
+        if capture_thread is None or not capture_thread.is_alive(): self._release()
+
+    def _release(self):
+        with self._capture_lock: capture = self.capture; self.capture = None
+        if capture is not None: capture.release()
+
+    def update_settings(self, settings):
+        # Swapping the whole dict is atomic, so the worker always sees a consistent snapshot
+        self.settings = dict(settings)
+
+    def _count_drops(self, dropped):
+        if dropped:
+            with self._stats_lock: self.dropped_frames += dropped
+            if self.monitor is not None: self.monitor.set_counter("dropped", self.dropped_frames)
+
+    def _capture_loop(self):
+        try:
+            while not self.stop_event.is_set():
+                with span(self.monitor, "camera:read"): ret, frame = self.capture.read()
+                if not ret: time.sleep(0.005); continue
+                t = time.perf_counter(); self.capture_meter.tick(t)
+                self._count_drops(put_latest(self.raw_queue, (t, frame)))
+        finally:
+            if self.stop_event.is_set(): self._release()
+
+    def _process_loop(self):
+        while not self.stop_event.is_set():
+            try: t_capture, frame = self.raw_queue.get(timeout=0.1)
+            except queue.Empty: continue
+            try:
+                with span(self.monitor, "camera:effects"): processed = self.process_func(frame, self.settings)
+            except Exception as e: self.error = e; self.error_count += 1; continue
+            self.error = None; self.process_meter.tick(); sink = self.frame_sink
+            if sink is not None: sink(processed, t_capture)
+            self._count_drops(put_latest(self.display_queue, (t_capture, processed)))
+
+    def get_latest(self):
+        # Non-blocking; called from the Tk thread. Returns the newest processed frame or None.
+        item = None; skipped = -1
+        while True:
+            try: item = self.display_queue.get_nowait(); skipped += 1
+            except queue.Empty: break
+        if item is None: return None
+        self._count_drops(skipped); t_capture, frame = item; now = time.perf_counter()
+        self.display_meter.tick(now); self.latencies.append(now - t_capture)
+        return frame
+
+    def stats(self):
+        latency = sum(self.latencies) / len(self.latencies) if self.latencies else 0.0
+        return {"capture_fps": self.capture_meter.fps, "process_fps": self.process_meter.fps, "display_fps": self.display_meter.fps,
+                "latency_ms": latency * 1000.0, "dropped_frames": self.dropped_frames}
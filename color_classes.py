@@ -0,0 +1,141 @@
+import json
+
+import cv2
+import numpy as np
+
+# ==========================================================
+# Colour Classes
+# Named colour ranges (boxes in HSV or RGB) are compiled once into a
+# quantized 3D lookup table indexed by the top `bits` bits of R, G and B,
+# holding the label of the first class that contains each cell. Labelling
+# an image is then one index computation and one table read per pixel,
+# however many classes there are, instead of one inRange per colour.
+# Each cell is classified by its centre colour, so pixels within half a
+# cell (4 levels at 5 bits) of a range border may fall either way.
+# 5 bits (a 32 KB table, compiled in a few ms) is the live-feed default and
+# agrees with per-pixel inRange on about 99% of pixels; 8 bits gives every
+# colour its own cell and is exact, at 16 MB and about a second to compile,
+# which is what still images use.
+# Label 0 is "no class"; class i (in definition order) is label i + 1.
+# ==========================================================
+
+DEFAULT_BITS = 5
+EXACT_BITS = 8
+
+# OpenCV HSV ranges (H 0-179); a lower hue above the upper one wraps around red
+DEFAULT_COLOR_CLASSES = {
+    "green": {"space": "hsv", "lower": (35, 100, 100), "upper": (85, 255, 255), "color": (0, 255, 0)},
+    "red": {"space": "hsv", "lower": (170, 120, 70), "upper": (10, 255, 255), "color": (255, 0, 0)},
+    "blue": {"space": "hsv", "lower": (100, 120, 70), "upper": (130, 255, 255), "color": (0, 128, 255)},
+    "yellow": {"space": "hsv", "lower": (20, 120, 120), "upper": (34, 255, 255), "color": (255, 255, 0)},
+}
+
+
+def load_color_classes(path):
+    # JSON object of the same shape as DEFAULT_COLOR_CLASSES; key order is priority order
+    with open(path, 'r', encoding='utf-8') as f: classes = json.load(f)
+    for name, spec in classes.items():
+        if spec.get("space", "hsv") not in ("hsv", "rgb"): raise ValueError(f"Colour class '{name}': space must be 'hsv' or 'rgb'")
+        if len(spec["lower"]) != 3 or len(spec["upper"]) != 3: raise ValueError(f"Colour class '{name}': lower and upper need 3 values")
+    return classes
+
+
+def _in_range(values, lower, upper, wrap_first):
+    # values: (N, 3); with wrap_first a first-channel range with lower > upper wraps (hue)
+    inside = np.ones(len(values), bool)
+    for c in range(3):
+        lo, hi = lower[c], upper[c]
+        if c == 0 and wrap_first and lo > hi: inside &= (values[:, 0] >= lo) | (values[:, 0] <= hi)
+        else: inside &= (values[:, c] >= lo) & (values[:, c] <= hi)
+    return inside
+
+
+class ColorClassifier:
+    def __init__(self, classes=None, bits=DEFAULT_BITS):
+        if not 1 <= bits <= 8: raise ValueError("bits must be between 1 and 8")
+        classes = DEFAULT_COLOR_CLASSES if classes is None else classes
+        if len(classes) > 255: raise ValueError("At most 255 colour classes are supported")
+        self.classes = dict(classes); self.names = list(self.classes); self.bits = bits
+        self.colors = [tuple(spec.get("color", (255, 255, 255))) for spec in self.classes.values()]
+        self.table = self._compile()
+        # Per-channel tables turn a pixel into its cell index with one cv2.LUT and one weighted channel sum;
+        # float32 holds indices exactly up to 8 bits per channel, uint16 is faster up to 5
+        cells = np.arange(256) >> (8 - bits); self._index_dtype = np.uint16 if 3 * bits <= 16 else np.float32
+        self._channel_lut = np.stack([cells << (2 * bits), cells << bits, cells], axis=-1).astype(self._index_dtype).reshape(1, 256, 3)
+
+    def _compile(self):
+        n = 1 << self.bits; half = (1 << (8 - self.bits)) >> 1
+        levels = (np.arange(n, dtype=np.uint16) << (8 - self.bits)) + half
+        centres = np.stack(np.meshgrid(levels, levels, levels, indexing='ij'), axis=-1).reshape(-1, 3).astype(np.uint8)
+        hsv = cv2.cvtColor(centres.reshape(-1, 1, 3), cv2.COLOR_RGB2HSV).reshape(-1, 3)
+        table = np.zeros(len(centres), np.uint8)
+        # Reversed so the earliest class wins where ranges overlap
+        for label in range(len(self.names), 0, -1):
+            spec = self.classes[self.names[label - 1]]; hsv_space = spec.get("space", "hsv") == "hsv"
+            table[_in_range(hsv if hsv_space else centres, spec["lower"], spec["upper"], hsv_space)] = label
+        return table
+
+    def label(self, img_rgb, dst=None, chunk_rows=64):
+        # (H, W) uint8 labels for an RGB image. Rows are processed in chunks so the per-channel
+        # indices stay in cache instead of making full-image passes through memory.
+        if img_rgb.ndim != 3 or img_rgb.shape[2] != 3: raise ValueError("Colour classes need a 3-channel RGB image")
+        h, w = img_rgb.shape[:2]; dst = np.empty((h, w), np.uint8) if dst is None else dst; rows = min(chunk_rows, h)
+        channels = np.empty((rows, w, 3), self._index_dtype); index = np.empty((rows, w), self._index_dtype); weights = np.ones((1, 3), np.float32)
+        for y in range(0, h, rows):
+            n = min(rows, h - y); cells = cv2.transform(cv2.LUT(img_rgb[y:y + n], self._channel_lut, dst=channels[:n]), weights, dst=index[:n])
+            np.take(self.table, cells if self._index_dtype is np.uint16 else cells.astype(np.intp), out=dst[y:y + n])
+        return dst
+
+    def mask(self, labels, name):
+        return cv2.compare(labels, self.names.index(name) + 1, cv2.CMP_EQ)
+
+    def analyze(self, labels, min_area=0, names=None, masks=False, scale=1.0):
+        # Per class: pixel count, bounding box of all its pixels and connected components of at least
+        # min_area pixels as (x, y, w, h, area, (cx, cy)), largest first; with masks=True also the mask.
+        # scale maps coordinates measured on a reduced label image back to the full frame.
+        results = {}
+        for name in names or self.names:
+            mask = self.mask(labels, name); count = cv2.countNonZero(mask); components = []
+            if count:
+                # Grana's block-based labelling; about twice as fast as the default on these masks
+                _, _, stats, centroids = cv2.connectedComponentsWithStatsWithAlgorithm(mask, 8, cv2.CV_32S, cv2.CCL_GRANA)
+                for (x, y, w, h, area), (cx, cy) in zip(stats[1:], centroids[1:]):
+                    if area >= min_area: components.append((int(x * scale), int(y * scale), int(w * scale), int(h * scale), int(area * scale * scale), (cx * scale, cy * scale)))
+                components.sort(key=lambda c: -c[4])
+            bbox = tuple(int(v * scale) for v in cv2.boundingRect(mask)) if count else None
+            results[name] = {"count": int(count * scale * scale), "bbox": bbox, "components": components}
+            if masks: results[name]["mask"] = mask
+        return results
+
+    def draw(self, frame, results, thickness=2):
+        for name, result in results.items():
+            color = self.colors[self.names.index(name)] if frame.ndim == 3 else (255,)
+            for x, y, w, h, _, _ in result["components"]:
+                cv2.rectangle(frame, (x, y), (x + w, y + h), color, thickness)
+                cv2.putText(frame, name, (x, max(12, y - 4)), cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 1, cv2.LINE_AA)
+        return frame
+
+
+_classifiers = {}
+
+
+def _spec_key(classes, bits):
+    return bits, tuple((name, spec.get("space", "hsv"), tuple(spec["lower"]), tuple(spec["upper"]), tuple(spec.get("color", ()))) for name, spec in classes.items())
+
+
+def get_classifier(classes=None, bits=DEFAULT_BITS):
+    # Compiled tables are kept per distinct set of definitions, so chains and the live feed compile each once
+    classes = DEFAULT_COLOR_CLASSES if classes is None else classes; key = _spec_key(classes, bits)
+    classifier = _classifiers.get(key)
+    if classifier is None: classifier = _classifiers[key] = ColorClassifier(classes, bits)
+    return classifier
+
+
+def select_classes(names=None, definitions=None):
+    # names: one name, a sequence of names or None (all); definitions: a dict or a JSON file path
+    classes = DEFAULT_COLOR_CLASSES if definitions is None else definitions if isinstance(definitions, dict) else load_color_classes(definitions)
+    if names is None: return classes
+    names = (names,) if isinstance(names, str) else tuple(names)
+    unknown = [name for name in names if name not in classes]
+    if unknown: raise ValueError(f"Unknown colour class(es) {', '.join(unknown)}. Available: {', '.join(classes)}")
+    return {name: classes[name] for name in names}
@@ -0,0 +1,55 @@
+import weakref
+
+import cv2
+import numpy as np
+
+# ==========================================================
+# Display Renderer
+# Keeps one PhotoImage per label and pastes new pixels into it instead
+# of creating a new one, remembers the last scaled view of each label so
+# unchanged images are not re-rendered, scales with INTER_AREA when
+# shrinking and converts gray to RGB only after resizing. PIL is imported
+# on the first render, not at startup.
+# ==========================================================
+
+class _LabelState:
+    def __init__(self):
+        self.photo = None; self.source = None; self.version = None; self.size = None
+        self.scaled = None; self.rgb = None
+
+
+class DisplayRenderer:
+    def __init__(self):
+        # Weak keys so closing a window releases its label's PhotoImage and buffers
+        self._labels = weakref.WeakKeyDictionary(); self.rendered = 0; self.skipped = 0
+
+    @staticmethod
+    def target_size(shape, max_size):
+        h, w = shape[:2]; scale = min(max_size / w, max_size / h)
+        return max(1, int(w * scale)), max(1, int(h * scale))
+
+    def forget(self, label_widget):
+        self._labels.pop(label_widget, None)
+
+    def clear(self, label_widget, text=""):
+        label_widget.config(image='', text=text); self.forget(label_widget)
+
+    def render(self, img, label_widget, max_size=600, version=None):
+        # `version` lets callers that reuse the same buffer for new frames force a redraw
+        if img is None: self.clear(label_widget); return
+        h, w = img.shape[:2]
+        if w == 0 or h == 0: return
+        from PIL import Image, ImageTk
+        state = self._labels.setdefault(label_widget, _LabelState()); size = self.target_size(img.shape, max_size)
+        if state.source is img and state.version == version and state.size == size and state.photo is not None: self.skipped += 1; return
+        interpolation = cv2.INTER_AREA if size[0] < w else cv2.INTER_LINEAR
+        if state.scaled is None or state.scaled.shape[:2] != (size[1], size[0]) or state.scaled.ndim != img.ndim:
+            state.scaled = np.empty((size[1], size[0]) + img.shape[2:], np.uint8)
+        scaled = img if size == (w, h) else cv2.resize(img, size, dst=state.scaled, interpolation=interpolation)
+        if scaled.ndim == 2:
+            if state.rgb is None or state.rgb.shape[:2] != scaled.shape: state.rgb = np.empty(scaled.shape + (3,), np.uint8)
+            scaled = cv2.cvtColor(scaled, cv2.COLOR_GRAY2RGB, dst=state.rgb)
+        pil_image = Image.fromarray(np.ascontiguousarray(scaled))
+        if state.photo is not None and state.size == size: state.photo.paste(pil_image)
+        else: state.photo = ImageTk.PhotoImage(image=pil_image); label_widget.config(image=state.photo); label_widget.image = state.photo
+        state.source = img; state.version = version; state.size = size; self.rendered += 1
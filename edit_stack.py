@@ -0,0 +1,171 @@
+import hashlib
+import inspect
+
+import numpy as np
+
+import image_engine as engine
+import tiled_engine
+from caching import LRUCache, _MISSING
+
+# ==========================================================
+# Non-destructive Edit Stack
+# The image being edited is a list of steps (operation name, params)
+# applied to the loaded image. The output of every prefix of the list is
+# cached under a memory budget, keyed by the whole prefix, so:
+#   - adding a step only runs that step,
+#   - changing step i re-runs steps i.. only (earlier outputs are hits),
+#   - undo/redo just move through the history of step lists and are
+#     cache lookups as long as the outputs have not been evicted.
+# History entries are immutable tuples of Steps; outputs are read-only
+# arrays. A Step hashes its parameters once when it is created, so cache
+# keys are built from stored digests and never re-hash array parameters.
+# ==========================================================
+
+DEFAULT_CACHE_BYTES = 512 * 1024 * 1024
+
+# Representations an ImageState already caches for the loaded image, handed to
+# the first step that runs on it (they are not part of the cache key)
+SOURCE_HINTS = {
+    "faces": lambda state: {"gray": state.gray()},
+    "circles": lambda state: {"gray": state.gray()},
+    "corners": lambda state: {"gray": state.float32(gray=True)},
+}
+
+
+def _freeze(value):
+    # Hashable stand-in for a parameter value (arrays are keyed by content)
+    if isinstance(value, np.ndarray): return ("ndarray", value.shape, value.dtype.str, hashlib.sha1(np.ascontiguousarray(value).tobytes()).hexdigest())
+    if isinstance(value, dict): return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple)): return tuple(_freeze(v) for v in value)
+    return value
+
+
+class Step(tuple):
+    # (name, params) that unpacks like a plain pair and carries its cache key
+    def __new__(cls, name, params=None):
+        step = super().__new__(cls, (name, dict(params or {}))); step.key = (name, _freeze(step[1]))
+        return step
+
+
+def _as_step(step):
+    return step if isinstance(step, Step) else Step(*step)
+
+
+def _accepts_progress(name):
+    try: return "progress" in inspect.signature(engine.OPERATIONS[name]).parameters
+    except (TypeError, ValueError): return False
+
+
+def _is_text(value):
+    # Values the "name:key=value" syntax can express: scalars and flat sequences of them
+    if isinstance(value, (list, tuple)): return all(not isinstance(v, (list, tuple, dict, np.ndarray)) for v in value)
+    return not isinstance(value, (dict, np.ndarray))
+
+
+def is_text_editable(params):
+    return all(_is_text(value) for value in params.values())
+
+
+def format_step(name, params):
+    # The chain syntax of the batch CLI ("name:key=value"); arrays and nested data (e.g. strokes) are
+    # summarised and cannot be edited
+    def fmt(value):
+        if isinstance(value, np.ndarray): return f"<array {'x'.join(map(str, value.shape))}>"
+        if not _is_text(value): return f"<{len(value)} items>"
+        if isinstance(value, (list, tuple)): return ",".join(fmt(v) for v in value)
+        return str(value)
+    return ":".join([name] + [f"{key}={fmt(value)}" for key, value in params.items()])
+
+
+class EditStack:
+    def __init__(self, cascades=None, max_bytes=DEFAULT_CACHE_BYTES, tile_pixels=None, state=None):
+        # Steps on images of at least `tile_pixels` pixels run tile by tile when the operation allows it;
+        # `state` is the ImageState of the loaded image, used for SOURCE_HINTS. `cascades` may be a
+        # (face, eye) pair or a callable returning one, so they can be loaded lazily.
+        self.cascades = cascades; self.tile_pixels = tile_pixels; self.state = state; self.cache = LRUCache(max_bytes=max_bytes)
+        self.source = None; self.source_version = 0; self.history = [()]; self.position = 0
+
+    def set_source(self, image):
+        self.source = image; self.source_version += 1; self.history = [()]; self.position = 0; self.cache.clear()
+
+    @property
+    def steps(self):
+        return self.history[self.position]
+
+    @property
+    def can_undo(self):
+        return self.position > 0
+
+    @property
+    def can_redo(self):
+        return self.position < len(self.history) - 1
+
+    def _commit(self, steps):
+        del self.history[self.position + 1:]; self.history.append(tuple(steps)); self.position += 1
+
+    def push(self, name, params=None):
+        # `name` may also be a ready-made Step, so a step hashed by the caller is not hashed again
+        step = name if isinstance(name, Step) else Step(name, params)
+        if step[0] not in engine.OPERATIONS: raise ValueError(f"Unknown operation '{step[0]}'")
+        self._commit(self.steps + (step,))
+
+    def replace(self, index, name, params=None):
+        if name not in engine.OPERATIONS: raise ValueError(f"Unknown operation '{name}'")
+        steps = list(self.steps); steps[index] = Step(name, params); self._commit(steps)
+
+    def remove(self, index):
+        steps = list(self.steps); del steps[index]; self._commit(steps)
+
+    def reset(self):
+        # Undoable, unlike loading a new image
+        if self.steps: self._commit(())
+
+    def undo(self):
+        if not self.can_undo: return False
+        self.position -= 1; return True
+
+    def redo(self):
+        if not self.can_redo: return False
+        self.position += 1; return True
+
+    def _key(self, steps, version=None):
+        return (self.source_version if version is None else version,) + tuple(step.key for step in steps)
+
+    def cached(self, steps=None):
+        # The output for `steps` (default: current) if it needs no computation, else None
+        steps = self.steps if steps is None else tuple(_as_step(step) for step in steps)
+        if not steps: return self.source
+        value = self.cache.get(self._key(steps), _MISSING)
+        return None if value is _MISSING else value
+
+    def compute(self, steps=None, progress=None):
+        # Safe to call from a worker thread: the source and its version are read once up front
+        steps = self.steps if steps is None else tuple(_as_step(step) for step in steps); source = self.source; version = self.source_version
+        if source is None: raise ValueError("No image loaded")
+        image = source; start = 0
+        for i in range(len(steps), 0, -1):
+            hit = self.cache.get(self._key(steps[:i], version), _MISSING)
+            if hit is not _MISSING: image = hit; start = i; break
+        for i in range(start, len(steps)):
+            name, params = steps[i]
+            if progress: progress(i / len(steps), f"{i + 1}/{len(steps)} {name}")
+            image = self._run_step(image, name, params, self._step_progress(progress, i, len(steps)))
+            if image.flags.writeable: image.setflags(write=False)
+            self.cache.put(self._key(steps[:i + 1], version), image)
+        if progress: progress(1.0)
+        return image
+
+    @staticmethod
+    def _step_progress(progress, index, count):
+        if progress is None: return None
+        return lambda fraction, message=None: progress((index + fraction) / count, message)
+
+    def _run_step(self, image, name, params, progress=None):
+        chain = [(name, params)]
+        if self.tile_pixels and image.shape[0] * image.shape[1] >= self.tile_pixels and tiled_engine.is_tileable(chain):
+            return tiled_engine.process_tiled(image, chain, progress=progress)
+        if progress is not None and _accepts_progress(name): params = dict(params, progress=progress)
+        if self.state is not None and name in SOURCE_HINTS and image is self.state.original: params = dict(params, **SOURCE_HINTS[name](self.state))
+        # Operations must not modify their input: cached outputs are shared
+        cascades = self.cascades() if callable(self.cascades) and engine.chain_needs_cascades(chain) else self.cascades
+        return np.ascontiguousarray(engine.run_operation(image, name, params, None if callable(cascades) else cascades))
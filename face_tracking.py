@@ -0,0 +1,111 @@
+import cv2
+import numpy as np
+
+# ==========================================================
+# Face Tracker (detect every N frames, track in between)
+# Full Haar detection runs on a downscaled frame every `detect_every`
+# frames; in between each face is carried forward by template matching
+# in a small search window. Eyes are searched only inside faces that
+# have been confirmed by `stable_hits` detections, and only on
+# detection frames.
+# ==========================================================
+
+def box_iou(a, b):
+    ax, ay, aw, ah = a; bx, by, bw, bh = b
+    ix = max(0, min(ax + aw, bx + bw) - max(ax, bx)); iy = max(0, min(ay + ah, by + bh) - max(ay, by))
+    inter = ix * iy; union = aw * ah + bw * bh - inter
+    return inter / union if union > 0 else 0.0
+
+
+class FaceTrack:
+    def __init__(self, box):
+        self.box = box; self.hits = 1; self.misses = 0; self.eyes = []; self.template = None
+
+
+class FaceTracker:
+    def __init__(self, face_cascade, eye_cascade=None, detect_every=5, detection_scale=0.5, min_face_size=40, max_face_size=0,
+                 stable_hits=2, max_misses=2, search_margin=0.5, match_threshold=0.5):
+        self.face_cascade = face_cascade; self.eye_cascade = eye_cascade
+        self.stable_hits = stable_hits; self.max_misses = max_misses; self.search_margin = search_margin; self.match_threshold = match_threshold
+        self.tracks = []; self.frame_index = 0; self._small = None
+        self.configure(detect_every, detection_scale, min_face_size, max_face_size)
+
+    def configure(self, detect_every=None, detection_scale=None, min_face_size=None, max_face_size=None):
+        # Sizes are in full-resolution pixels; a max size of 0 means unlimited
+        if detect_every is not None: self.detect_every = max(1, int(detect_every))
+        if detection_scale is not None:
+            scale = min(1.0, max(0.1, float(detection_scale)))
+            if scale != getattr(self, 'detection_scale', scale): self.tracks = []  # templates were cut at the old scale
+            self.detection_scale = scale
+        if min_face_size is not None: self.min_face_size = max(1, int(min_face_size))
+        if max_face_size is not None: self.max_face_size = max(0, int(max_face_size))
+
+    def reset(self):
+        self.tracks = []; self.frame_index = 0
+
+    def _downscale(self, gray):
+        s = self.detection_scale; h, w = gray.shape[:2]; size = (max(1, int(w * s)), max(1, int(h * s)))
+        if self._small is None or self._small.shape != (size[1], size[0]): self._small = np.empty((size[1], size[0]), np.uint8)
+        return cv2.resize(gray, size, dst=self._small, interpolation=cv2.INTER_AREA)
+
+    def _to_small(self, box):
+        s = self.detection_scale
+        return tuple(int(round(v * s)) for v in box)
+
+    def _to_full(self, box):
+        s = self.detection_scale
+        return tuple(int(round(v / s)) for v in box)
+
+    def update(self, gray):
+        small = self._downscale(gray)
+        if self.frame_index % self.detect_every == 0: self._detect(gray, small)
+        else: self._track(small)
+        self.frame_index += 1
+        return self.tracks
+
+    def _detect(self, gray, small):
+        s = self.detection_scale; min_side = max(1, int(self.min_face_size * s)); max_side = int(self.max_face_size * s)
+        faces = self.face_cascade.detectMultiScale(small, 1.2, 5, minSize=(min_side, min_side), maxSize=(max_side, max_side) if max_side > 0 else (0, 0))
+        unmatched = list(self.tracks); matched = []
+        for small_box in faces:
+            box = self._to_full(small_box); best = max(unmatched, key=lambda t: box_iou(t.box, box), default=None)
+            if best is not None and box_iou(best.box, box) > 0.3: unmatched.remove(best); best.box = box; best.hits += 1; best.misses = 0; track = best
+            else: track = FaceTrack(box)
+            self._store_template(track, small, small_box); matched.append(track)
+            if track.hits >= self.stable_hits: self._detect_eyes(gray, track)
+        for track in unmatched:
+            track.misses += 1
+            if track.misses <= self.max_misses: matched.append(track)
+        self.tracks = matched
+
+    def _store_template(self, track, small, small_box):
+        x, y, w, h = small_box
+        track.template = small[y:y + h, x:x + w].copy() if w > 0 and h > 0 else None
+
+    def _track(self, small):
+        sh, sw = small.shape[:2]
+        for track in self.tracks:
+            if track.template is None: continue
+            x, y, w, h = self._to_small(track.box); mx = int(w * self.search_margin); my = int(h * self.search_margin)
+            x0, y0 = max(0, x - mx), max(0, y - my); x1, y1 = min(sw, x + w + mx), min(sh, y + h + my)
+            th, tw = track.template.shape[:2]
+            if x1 - x0 < tw or y1 - y0 < th: continue
+            scores = cv2.matchTemplate(small[y0:y1, x0:x1], track.template, cv2.TM_CCOEFF_NORMED)
+            _, score, _, loc = cv2.minMaxLoc(scores)
+            if score < self.match_threshold: continue
+            fx, fy = self._to_full((x0 + loc[0], y0 + loc[1], 0, 0))[:2]; dx, dy = fx - track.box[0], fy - track.box[1]
+            track.box = (fx, fy, track.box[2], track.box[3]); track.eyes = [(ex + dx, ey + dy, ew, eh) for (ex, ey, ew, eh) in track.eyes]
+
+    def _detect_eyes(self, gray, track):
+        if self.eye_cascade is None: return
+        x, y, w, h = track.box; roi = gray[max(0, y):y + h, max(0, x):x + w]
+        if roi.size == 0: track.eyes = []; return
+        # Eyes live in the upper part of the face; searching only there is cheaper and avoids nostril false positives
+        upper = roi[:max(1, int(roi.shape[0] * 0.6))]
+        track.eyes = [(max(0, x) + ex, max(0, y) + ey, ew, eh) for (ex, ey, ew, eh) in self.eye_cascade.detectMultiScale(upper)]
+
+    def draw(self, frame, face_color=(255, 0, 0), eye_color=(0, 255, 0)):
+        if frame.ndim == 2: face_color, eye_color = (76,), (150,)
+        for track in self.tracks:
+            x, y, w, h = track.box; cv2.rectangle(frame, (x, y), (x + w, y + h), face_color, 2)
+            for (ex, ey, ew, eh) in track.eyes: cv2.rectangle(frame, (ex, ey), (ex + ew, ey + eh), eye_color, 2)
@@ -0,0 +1,713 @@
+import os
+import time
+import cv2
+import numpy as np
+
+import color_classes
+from perf_stats import span
+
+# ==========================================================
+# Headless Processing Engine
+# All functions take and return RGB (or single-channel) numpy
+# arrays and never touch Tk, so they can run in worker processes.
+# ==========================================================
+
+# Resolved next to this file, so the app and CLIs work from any working directory
+CASCADE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'haarcascades')
+FACE_CASCADE_FILE = 'haarcascade_frontalface_default.xml'
+EYE_CASCADE_FILE = 'haarcascade_eye.xml'
+
+
+def load_cascades(cascade_dir=CASCADE_DIR):
+    face_cascade, eye_cascade = None, None
+    face_path = os.path.join(cascade_dir, FACE_CASCADE_FILE); eye_path = os.path.join(cascade_dir, EYE_CASCADE_FILE)
+    if os.path.exists(face_path): face_cascade = cv2.CascadeClassifier(face_path)
+    if os.path.exists(eye_path): eye_cascade = cv2.CascadeClassifier(eye_path)
+    return face_cascade, eye_cascade
+
+
+def to_gray(img):
+    return img if img.ndim == 2 else cv2.cvtColor(img, cv2.COLOR_RGB2GRAY)
+
+
+def to_rgb(img):
+    return cv2.cvtColor(img, cv2.COLOR_GRAY2RGB) if img.ndim == 2 else img
+
+
+def read_image(path):
+    img = cv2.imread(path)
+    if img is None: raise IOError(f"Cannot read image: {path}")
+    return cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+
+
+def write_image(path, img):
+    out = img if img.ndim == 2 else cv2.cvtColor(img, cv2.COLOR_RGB2BGR)
+    if not cv2.imwrite(path, out): raise IOError(f"Cannot write image: {path}")
+
+# ----------------------------------------------------------
+# Basic filters
+# ----------------------------------------------------------
+def log_transform(img):
+    img_float = np.float32(to_gray(img)) + 1; log_image = np.log(img_float)
+    return cv2.normalize(log_image, None, 0, 255, cv2.NORM_MINMAX, dtype=cv2.CV_8U)
+
+
+def gaussian_blur(img, ksize=5):
+    ksize = int(ksize); ksize += 1 if ksize % 2 == 0 else 0
+    return cv2.GaussianBlur(img, (ksize, ksize), 0)
+
+
+def median_filter(img, ksize=5):
+    return cv2.medianBlur(img, int(ksize))
+
+
+def custom_filter(img, ksize=5):
+    kernel = np.ones((ksize, ksize), np.float32) / (ksize * ksize)
+    return cv2.filter2D(img, -1, kernel)
+
+
+def difference_filters(img):
+    gray = to_gray(img)
+    kernel_h = np.array([[-1, -2, -1], [0, 0, 0], [1, 2, 1]]); kernel_v = np.array([[-1, 0, 1], [-2, 0, 2], [-1, 0, 1]])
+    return cv2.filter2D(gray, -1, kernel_h), cv2.filter2D(gray, -1, kernel_v)
+
+
+def sharpen(img, amount=1.0, sigma=3):
+    blurred = cv2.GaussianBlur(img, (0, 0), sigma)
+    return cv2.addWeighted(img, 1.0 + amount, blurred, -amount, 0)
+
+# ----------------------------------------------------------
+# Edge detection
+# ----------------------------------------------------------
+def sobel(img, ksize=5):
+    gray = to_gray(img)
+    sobelx = cv2.Sobel(gray, cv2.CV_64F, 1, 0, ksize=ksize); sobely = cv2.Sobel(gray, cv2.CV_64F, 0, 1, ksize=ksize)
+    sobel_combined = cv2.magnitude(sobelx, sobely)
+    return cv2.convertScaleAbs(sobelx), cv2.convertScaleAbs(sobely), cv2.convertScaleAbs(sobel_combined)
+
+
+def canny(img, threshold1=100, threshold2=200, aperture_size=3):
+    return cv2.Canny(to_gray(img), threshold1, threshold2, apertureSize=aperture_size)
+
+# ----------------------------------------------------------
+# Feature detection
+# ----------------------------------------------------------
+def detect_faces_eyes(img, face_cascade, eye_cascade, scale_factor=1.3, min_neighbors=5, gray=None):
+    gray = to_gray(img) if gray is None else gray; faces = face_cascade.detectMultiScale(gray, scale_factor, min_neighbors); img_with_detections = to_rgb(img).copy()
+    for (x, y, w, h) in faces:
+        cv2.rectangle(img_with_detections, (x, y), (x + w, y + h), (255, 0, 0), 3)
+        roi_gray = gray[y:y + h, x:x + w]; roi_color = img_with_detections[y:y + h, x:x + w]; eyes = eye_cascade.detectMultiScale(roi_gray)
+        for (ex, ey, ew, eh) in eyes: cv2.rectangle(roi_color, (ex, ey), (ex + ew, ey + eh), (0, 255, 0), 2)
+    return img_with_detections
+
+
+# Coarse-to-fine mode: candidates are found on a downscaled copy with the size parameters
+# rescaled to it, then each one is confirmed and located precisely in a small full-resolution
+# window. pyramid=None picks the number of 2x levels automatically, 0 runs at full resolution.
+PYRAMID_WORK_SIDE = 1024
+MIN_PYRAMID_FEATURE = 8
+
+
+def pyramid_levels(shape, pyramid=None, min_feature=None, work_side=PYRAMID_WORK_SIDE):
+    # Enough levels to bring the long side near work_side, without shrinking the smallest
+    # feature of interest (radius, line length...) below MIN_PYRAMID_FEATURE pixels
+    if pyramid is not None: return max(0, int(pyramid))
+    levels = 0
+    while max(shape[:2]) / 2 ** levels > work_side and (min_feature is None or min_feature / 2 ** (levels + 1) >= MIN_PYRAMID_FEATURE): levels += 1
+    return levels
+
+
+def pyramid_down(img, levels):
+    # The image reduced by 2**levels and the exact full/reduced scale factor
+    if levels <= 0: return img, 1.0
+    h, w = img.shape[:2]; size = (max(1, round(w / 2 ** levels)), max(1, round(h / 2 ** levels)))
+    return cv2.resize(img, size, interpolation=cv2.INTER_AREA), w / size[0]
+
+
+def _window(x, y, half, shape):
+    h, w = shape[:2]; x0, y0 = max(0, int(x - half)), max(0, int(y - half))
+    return x0, y0, min(w, int(x + half) + 1), min(h, int(y + half) + 1)
+
+
+def default_circle_params(shape, min_dist=None, min_radius=None, max_radius=None):
+    # Radius range and spacing relative to the image instead of a fixed 10-100 px
+    side = min(shape[:2])
+    min_radius = max(5, side // 64) if min_radius is None else min_radius
+    max_radius = side // 2 if max_radius is None else max_radius
+    return (max(10, side // 32) if min_dist is None else min_dist), min_radius, max_radius
+
+
+def find_circles(gray, min_dist=None, param1=50, param2=30, min_radius=None, max_radius=None, pyramid=None):
+    # (N, 3) float32 array of (x, y, r); gray should already be median-blurred
+    min_dist, min_radius, max_radius = default_circle_params(gray.shape, min_dist, min_radius, max_radius)
+    levels = pyramid_levels(gray.shape, pyramid, min_radius)
+    if levels == 0:
+        circles = cv2.HoughCircles(gray, cv2.HOUGH_GRADIENT, 1, min_dist, param1=param1, param2=param2, minRadius=min_radius, maxRadius=max_radius)
+        return np.zeros((0, 3), np.float32) if circles is None else circles[0]
+    small, scale = pyramid_down(gray, levels)
+    # param2 is kept: the levels are capped so the smallest radius still spans MIN_PYRAMID_FEATURE
+    # pixels, and each candidate is re-tested against it at full resolution anyway
+    coarse = cv2.HoughCircles(small, cv2.HOUGH_GRADIENT, 1, max(1.0, min_dist / scale), param1=param1, param2=param2,
+                              minRadius=max(1, int(min_radius / scale)), maxRadius=max(2, int(np.ceil(max_radius / scale))))
+    if coarse is None: return np.zeros((0, 3), np.float32)
+    refined = []; slack = 3 * scale + 2
+    for cx, cy, r in coarse[0] * scale:
+        x0, y0, x1, y1 = _window(cx, cy, r + 2 * slack, gray.shape)
+        found = cv2.HoughCircles(np.ascontiguousarray(gray[y0:y1, x0:x1]), cv2.HOUGH_GRADIENT, 1, max(x1 - x0, y1 - y0), param1=param1, param2=param2,
+                                 minRadius=max(min_radius, int(r - slack)), maxRadius=min(max_radius, int(np.ceil(r + slack))))
+        if found is not None: refined.append(found[0, 0] + (x0, y0, 0))
+    return np.array(refined, np.float32).reshape(-1, 3)
+
+
+def detect_circles(img, min_dist=None, param1=50, param2=30, min_radius=None, max_radius=None, pyramid=None, progress=None, gray=None):
+    output = to_rgb(img).copy(); gray = cv2.medianBlur(to_gray(img) if gray is None else gray, 5)
+    if progress: progress(0.2, "Hough transform")
+    for x, y, r in np.around(find_circles(gray, min_dist, param1, param2, min_radius, max_radius, pyramid)).astype(int):
+        cv2.circle(output, (int(x), int(y)), int(r), (0, 255, 0), 2); cv2.circle(output, (int(x), int(y)), 2, (0, 0, 255), 3)
+    return output
+
+
+def _segment_window(segment, band, shape):
+    x1, y1, x2, y2 = segment; h, w = shape[:2]
+    return max(0, int(min(x1, x2) - band)), max(0, int(min(y1, y2) - band)), min(w, int(max(x1, x2) + band) + 1), min(h, int(max(y1, y2) + band) + 1)
+
+
+def _refine_segments(edges, segments, band, step=1.0):
+    # Re-fits every coarse segment to the full-resolution edge pixels found within `band` of it, by
+    # sampling a strip across the segment every `step` pixels (all segments at once) and fitting the
+    # offset of the hits as a linear function of the position along the segment. Returns the
+    # refined (x1, y1, x2, y2) rows and a mask of the segments with edge support along most of their length.
+    if len(segments) == 0: return np.zeros((0, 4), np.float32), np.zeros(0, bool)
+    h, w = edges.shape[:2]; x1, y1, x2, y2 = segments.T; lengths = np.maximum(np.hypot(x2 - x1, y2 - y1), 1e-6)
+    ux, uy = (x2 - x1) / lengths, (y2 - y1) / lengths; rows = np.ceil((lengths + 2 * band) / step).astype(np.intp) + 1
+    ids = np.repeat(np.arange(len(segments)), rows); t = (np.arange(len(ids)) - np.repeat(np.cumsum(rows) - rows, rows)) * step - band
+    d = np.arange(-int(band), int(band) + 1, dtype=np.float32)
+    xs = np.rint((x1[ids] + t * ux[ids])[:, None] - d * uy[ids][:, None]).astype(np.intp); ys = np.rint((y1[ids] + t * uy[ids])[:, None] + d * ux[ids][:, None]).astype(np.intp)
+    inside = (xs >= 0) & (xs < w) & (ys >= 0) & (ys < h); hits = np.zeros(xs.shape, bool); hits[inside] = edges[ys[inside], xs[inside]] > 0
+    row_hits = hits.any(axis=1); count = len(segments)
+    support = np.bincount(ids, row_hits & (t >= 0) & (t <= lengths[ids]), count) / np.maximum(lengths / step, 1)
+    # Least squares fit of offset = a + b * t over all hits of each segment
+    hit_rows, hit_cols = np.nonzero(hits); hid = ids[hit_rows]; ht = t[hit_rows]; hd = d[hit_cols]
+    n = np.bincount(hid, minlength=count); st = np.bincount(hid, ht, count); sd = np.bincount(hid, hd, count)
+    stt = np.bincount(hid, ht * ht, count); std = np.bincount(hid, ht * hd, count); det = n * stt - st * st
+    slope = np.divide(n * std - st * sd, det, out=np.zeros(count), where=det > 0); offset = np.divide(sd - slope * st, n, out=np.zeros(count), where=n > 0)
+    # Ends at the first and last supported rows
+    rid = ids[row_hits]; rt = t[row_hits]; t0 = np.zeros(count); t1 = np.zeros(count)
+    first = np.unique(rid, return_index=True); last = np.unique(rid[::-1], return_index=True)
+    t0[first[0]] = rt[first[1]]; t1[last[0]] = rt[::-1][last[1]]
+    ends = [(x1 + tt * ux - (offset + slope * tt) * uy, y1 + tt * uy + (offset + slope * tt) * ux) for tt in (t0, t1)]
+    return np.column_stack((ends[0][0], ends[0][1], ends[1][0], ends[1][1])).astype(np.float32), (support >= 0.5) & (n >= 2)
+
+
+def find_lines(gray, threshold1=50, threshold2=150, threshold=80, min_line_length=50, max_line_gap=10, pyramid=0, edges=None):
+    # Returns (edges, lines) with lines shaped (N, 1, 4) like HoughLinesP, or None. Full resolution by
+    # default: min_line_length caps the pyramid at two levels, where it saves only about a third of the
+    # time on line drawings, so it is opt-in (pyramid=None or N). In pyramid mode without precomputed
+    # edges, the returned edge map covers only the candidate windows (or is the coarse one scaled up).
+    levels = pyramid_levels(gray.shape, pyramid, min_line_length)
+    if levels == 0:
+        edges = cv2.Canny(gray, threshold1, threshold2) if edges is None else edges
+        return edges, cv2.HoughLinesP(edges, 1, np.pi / 180, threshold=threshold, minLineLength=min_line_length, maxLineGap=max_line_gap)
+    small, scale = pyramid_down(gray, levels); small_edges = cv2.Canny(small, threshold1, threshold2)
+    coarse = cv2.HoughLinesP(small_edges, 1, np.pi / 180, threshold=max(10, int(threshold / scale)),
+                             minLineLength=max(MIN_PYRAMID_FEATURE, min_line_length / scale), maxLineGap=max(1.0, max_line_gap / scale))
+    segments = np.zeros((0, 4), np.float32) if coarse is None else coarse[:, 0].astype(np.float32) * scale
+    band = int(np.ceil(scale)) + 2; full_edges = edges
+    if full_edges is None and len(segments):
+        windows = [_segment_window(segment, band, gray.shape) for segment in segments]
+        if sum((x1 - x0) * (y1 - y0) for x0, y0, x1, y1 in windows) > gray.shape[0] * gray.shape[1]: full_edges = cv2.Canny(gray, threshold1, threshold2)
+        else:
+            # Only the windows around the candidates are edge-detected at full resolution
+            full_edges = np.zeros(gray.shape[:2], np.uint8)
+            for x0, y0, x1, y1 in windows: full_edges[y0:y1, x0:x1] = cv2.Canny(np.ascontiguousarray(gray[y0:y1, x0:x1]), threshold1, threshold2)
+    if edges is None: edges = full_edges if full_edges is not None else cv2.resize(small_edges, (gray.shape[1], gray.shape[0]), interpolation=cv2.INTER_NEAREST)
+    if not len(segments): return edges, None
+    refined, supported = _refine_segments(full_edges, segments, band, max(1.0, scale / 2))
+    refined = refined[supported & (np.hypot(refined[:, 2] - refined[:, 0], refined[:, 3] - refined[:, 1]) >= min_line_length)]
+    return edges, (np.rint(refined).astype(np.int32).reshape(-1, 1, 4) if len(refined) else None)
+
+
+def detect_lines(img, threshold1=50, threshold2=150, threshold=80, min_line_length=50, max_line_gap=10, pyramid=0, progress=None, edges=None):
+    if progress: progress(0.3, "Hough transform")
+    edges, lines = find_lines(to_gray(img), threshold1, threshold2, threshold, min_line_length, max_line_gap, pyramid, edges); img_with_lines = to_rgb(img).copy()
+    if lines is not None:
+        for line in lines: x1, y1, x2, y2 = line[0]; cv2.line(img_with_lines, (int(x1), int(y1)), (int(x2), int(y2)), (0, 255, 0), 2)
+    return edges, img_with_lines, lines
+
+
+def harris_peaks(response, quality=0.01, min_distance=1, max_corners=0):
+    # Non-maximum suppression: local maxima within min_distance above quality * max response,
+    # as an (N, 2) float32 array of (x, y) sorted by response
+    size = 2 * max(1, int(min_distance)) + 1
+    peaks = (response == cv2.dilate(response, cv2.getStructuringElement(cv2.MORPH_RECT, (size, size)))) & (response > quality * response.max())
+    ys, xs = np.nonzero(peaks); order = np.argsort(-response[ys, xs])
+    if max_corners: order = order[:max_corners]
+    return np.column_stack((xs[order], ys[order])).astype(np.float32)
+
+
+def find_corners(gray, block_size=2, ksize=3, k=0.04, quality=0.01, min_distance=5, max_corners=0, pyramid=0):
+    # Full resolution by default: Harris is one filter pass, and the pyramid mode only keeps the strongest
+    # corner around each coarse candidate, a sparse summary (2-10% of the full-resolution peaks on
+    # detailed content) for when only the dominant corners matter. pyramid=None or N opts in.
+    gray = np.asarray(gray, np.float32); levels = pyramid_levels(gray.shape, pyramid)
+    if levels == 0: return harris_peaks(cv2.cornerHarris(gray, block_size, ksize, k), quality, min_distance, max_corners)
+    small, scale = pyramid_down(gray, levels)
+    coarse = harris_peaks(cv2.cornerHarris(small, block_size, ksize, k), quality, max(1.0, min_distance / scale))
+    # Each candidate moves to the strongest full-resolution response in its window; the quality
+    # threshold is then applied against the strongest refined corner
+    half = int(np.ceil(scale)) + block_size + ksize; corners = []; strengths = []
+    for x, y in coarse * scale:
+        x0, y0, x1, y1 = _window(x, y, half, gray.shape)
+        response = cv2.cornerHarris(np.ascontiguousarray(gray[y0:y1, x0:x1]), block_size, ksize, k)
+        iy, ix = np.unravel_index(np.argmax(response), response.shape); corners.append((ix + x0, iy + y0)); strengths.append(response[iy, ix])
+    if not corners: return np.zeros((0, 2), np.float32)
+    corners = np.array(corners, np.float32); strengths = np.array(strengths, np.float32)
+    keep = strengths > quality * strengths.max(); corners, strengths = corners[keep], strengths[keep]
+    # Neighbouring candidates can converge on the same pixel
+    corners, first = np.unique(corners, axis=0, return_index=True); order = np.argsort(-strengths[first])
+    if max_corners: order = order[:max_corners]
+    return corners[order]
+
+
+def detect_corners(img, block_size=2, ksize=3, k=0.04, quality=0.01, min_distance=0, max_corners=0, pyramid=0, gray=None):
+    # min_distance=0 at full resolution paints every pixel above the threshold; otherwise the
+    # suppressed corner list is drawn as dots
+    gray = np.asarray(to_gray(img) if gray is None else gray, np.float32); img_with_corners = to_rgb(img).copy()
+    if min_distance <= 0 and pyramid_levels(gray.shape, pyramid) == 0:
+        dst = cv2.dilate(cv2.cornerHarris(gray, block_size, ksize, k), None); img_with_corners[dst > quality * dst.max()] = [0, 0, 255]
+        return img_with_corners
+    radius = max(2, min(gray.shape[:2]) // 400)
+    for x, y in find_corners(gray, block_size, ksize, k, quality, max(1, min_distance), max_corners, pyramid).astype(int): cv2.circle(img_with_corners, (int(x), int(y)), radius, (0, 0, 255), -1)
+    return img_with_corners
+
+
+def classify_colors(img, classes=None, definitions=None, mode="overlay", min_area=0.0005, bits=color_classes.EXACT_BITS):
+    # All named colour classes in one lookup-table pass (see color_classes). classes: name(s) to use,
+    # default all; definitions: dict or JSON path replacing the built-in classes; min_area below 1 is a
+    # fraction of the image. mode "keep" keeps only classified pixels, "overlay" dims the rest and boxes
+    # each component, "labels" paints every pixel with its class colour. Still images default to the
+    # exact 8-bit table; the live chain uses the coarser default.
+    img = to_rgb(img); classifier = color_classes.get_classifier(color_classes.select_classes(classes, definitions), bits)
+    labels = classifier.label(img)
+    if mode == "keep": return cv2.bitwise_and(img, img, mask=labels)
+    if mode == "labels":
+        palette = np.zeros((256, 3), np.uint8); palette[1:len(classifier.colors) + 1] = classifier.colors
+        return palette[labels]
+    if mode != "overlay": raise ValueError(f"Unknown mode '{mode}' (expected keep, overlay or labels)")
+    min_area = min_area * labels.size if min_area < 1 else min_area
+    output = cv2.convertScaleAbs(img, alpha=1 / 3); cv2.copyTo(img, labels, output)
+    return classifier.draw(output, classifier.analyze(labels, min_area), thickness=max(2, min(img.shape[:2]) // 300))
+
+# ----------------------------------------------------------
+# Segmentation
+# ----------------------------------------------------------
+def segment_kmeans(img, k=4, attempts=10, max_iter=100, epsilon=0.2, progress=None):
+    pixel_values = np.float32(img.reshape((-1, 3))); criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, max_iter, epsilon); best = None
+    # One attempt per call (same as cv2's own attempts loop) so progress can be reported between attempts
+    for attempt in range(attempts):
+        if progress: progress(attempt / attempts, f"attempt {attempt + 1}/{attempts}")
+        compactness, labels, centers = cv2.kmeans(pixel_values, int(k), None, criteria, 1, cv2.KMEANS_RANDOM_CENTERS)
+        if best is None or compactness < best[0]: best = (compactness, labels, centers)
+    _, labels, centers = best; centers = np.uint8(centers); segmented_image = centers[labels.flatten()]
+    return segmented_image.reshape(img.shape)
+
+
+def sample_pixels(img, sample_size=100_000, method="random", seed=None):
+    # "random": uniform draw without replacement; "stratified": one pixel per cell of a jittered grid
+    pixels = img.reshape((-1, img.shape[-1] if img.ndim == 3 else 1)); n = len(pixels); rng = np.random.default_rng(seed)
+    if sample_size >= n: return np.float32(pixels)
+    if method == "stratified":
+        h, w = img.shape[:2]; step = max(1.0, np.sqrt(h * w / sample_size))
+        ys = np.arange(0, h, step); xs = np.arange(0, w, step)
+        ys = np.minimum(h - 1, (ys + rng.random(len(ys)) * step).astype(np.int64)); xs = np.minimum(w - 1, (xs + rng.random(len(xs)) * step).astype(np.int64))
+        return np.float32(pixels[(ys[:, None] * w + xs[None, :]).ravel()])
+    return np.float32(pixels[rng.choice(n, sample_size, replace=False)])
+
+
+def _kmeans_pp_init(samples, k, rng):
+    centers = [samples[rng.integers(len(samples))]]; dist = np.sum((samples - centers[0]) ** 2, axis=1)
+    for _ in range(1, k):
+        total = dist.sum()
+        idx = rng.integers(len(samples)) if total <= 0 else rng.choice(len(samples), p=dist / total)
+        centers.append(samples[idx]); dist = np.minimum(dist, np.sum((samples - samples[idx]) ** 2, axis=1))
+    return np.array(centers, np.float32)
+
+
+def _minibatch_kmeans(samples, k, iterations, batch_size, rng, progress=None):
+    centers = _kmeans_pp_init(samples, k, rng); counts = np.zeros(k, np.float64)
+    for i in range(iterations):
+        if progress: progress(i / iterations, f"mini-batch {i + 1}/{iterations}")
+        batch = samples[rng.integers(len(samples), size=min(batch_size, len(samples)))]
+        labels = assign_to_palette(batch, centers)
+        for c in np.unique(labels):
+            members = batch[labels == c]; counts[c] += len(members)
+            # Per-center learning rate 1/count (Sculley, 2010)
+            centers[c] += (members.sum(axis=0) - len(members) * centers[c]) / counts[c]
+    return centers
+
+
+def fit_kmeans_palette(img, k=4, sample_size=100_000, attempts=3, max_iter=100, epsilon=0.2, init="kmeans++", sampling="random",
+                       minibatch=False, batch_size=4096, seed=None, progress=None):
+    # Fits k colour centers on a pixel sample instead of the whole image
+    samples = sample_pixels(img, int(sample_size), sampling, seed); k = int(k)
+    if minibatch: return _minibatch_kmeans(samples, k, max_iter, batch_size, np.random.default_rng(seed), progress)
+    criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, max_iter, epsilon)
+    flags = cv2.KMEANS_PP_CENTERS if init == "kmeans++" else cv2.KMEANS_RANDOM_CENTERS; best = None
+    for attempt in range(int(attempts)):
+        if progress: progress(attempt / attempts, f"attempt {attempt + 1}/{attempts}")
+        compactness, _, centers = cv2.kmeans(samples, k, None, criteria, 1, flags)
+        if best is None or compactness < best[0]: best = (compactness, centers)
+    return best[1]
+
+
+def assign_to_palette(pixels, centers, chunk_size=1 << 20):
+    # Nearest center for every row of `pixels`, in chunks to bound the (chunk x k) distance matrix
+    pixels = pixels.reshape((-1, centers.shape[1])); centers = np.float32(centers)
+    center_norms = np.sum(centers * centers, axis=1); labels = np.empty(len(pixels), np.int32)
+    for start in range(0, len(pixels), chunk_size):
+        chunk = np.float32(pixels[start:start + chunk_size])
+        # |x - c|^2 = |x|^2 - 2 x.c + |c|^2, and |x|^2 does not change the argmin
+        labels[start:start + chunk_size] = np.argmin(center_norms - 2.0 * (chunk @ centers.T), axis=1)
+    return labels
+
+
+def quantize_with_palette(img, centers, chunk_size=1 << 20):
+    palette = np.uint8(np.clip(np.round(centers), 0, 255))
+    return palette[assign_to_palette(img, centers, chunk_size)].reshape(img.shape)
+
+
+def save_palette(path, centers):
+    np.save(path, np.float32(centers))
+
+
+_palette_files = {}
+
+
+def load_palette(path):
+    # Memoized per process so every image in a batch reuses the same palette without re-reading it
+    if path not in _palette_files: _palette_files[path] = np.float32(np.load(path))
+    return _palette_files[path]
+
+
+def segment_kmeans_fast(img, k=4, sample_size=100_000, attempts=3, init="kmeans++", sampling="random", minibatch=False, palette=None, seed=None, progress=None):
+    # palette may be an array of centers or the path of a saved .npy palette
+    if isinstance(palette, str): palette = load_palette(palette)
+    if palette is None: palette = fit_kmeans_palette(img, k, sample_size, attempts, init=init, sampling=sampling, minibatch=bool(minibatch), seed=seed, progress=progress)
+    if progress: progress(0.9, "assigning pixels")
+    return quantize_with_palette(img, palette)
+
+
+def segment_watershed_auto(img, progress=None):
+    gray = to_gray(img); ret, thresh = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU); kernel = np.ones((3, 3), np.uint8)
+    opening = cv2.morphologyEx(thresh, cv2.MORPH_OPEN, kernel, iterations=2); sure_bg = cv2.dilate(opening, kernel, iterations=3)
+    dist_transform = cv2.distanceTransform(opening, cv2.DIST_L2, 5); ret, sure_fg = cv2.threshold(dist_transform, 0.7 * dist_transform.max(), 255, 0)
+    sure_fg = np.uint8(sure_fg); unknown = cv2.subtract(sure_bg, sure_fg); ret, markers = cv2.connectedComponents(sure_fg)
+    if progress: progress(0.5, "watershed")
+    markers = markers + 1; markers[unknown == 255] = 0; markers = cv2.watershed(to_rgb(img), markers)
+    img_result = to_rgb(img).copy(); img_result[markers == -1] = [255, 0, 0]
+    return img_result
+
+
+def segment_watershed_markers(img, markers):
+    markers = cv2.watershed(to_rgb(img), markers.astype(np.int32, copy=True))
+    img_result = to_rgb(img).copy(); img_result[markers == -1] = [255, 0, 0]
+    return img_result
+
+
+def rasterize_markers(strokes, shape, scale=1.0, markers=None):
+    # strokes: [(label, radius, [(x, y), ...]), ...] in full-resolution coordinates, drawn into an
+    # int32 marker map of `shape` at `scale` (into `markers` when given, so strokes can be added one by one)
+    markers = np.zeros(shape[:2], np.int32) if markers is None else markers
+    for label, radius, points in strokes:
+        pts = np.round(np.asarray(points, np.float64) * scale).astype(np.int32).reshape(-1, 1, 2); r = max(1, int(round(radius * scale)))
+        if len(pts) == 1: cv2.circle(markers, (int(pts[0, 0, 0]), int(pts[0, 0, 1])), r, int(label), -1)
+        else: cv2.polylines(markers, [pts], False, int(label), 2 * r, cv2.LINE_8)
+    return markers
+
+
+def refine_watershed_markers(preview_labels, strokes, shape, band=2):
+    # Full-resolution markers from a watershed result on a reduced copy: its regions scaled up with
+    # everything within `band` preview pixels of a boundary cleared, so the full-resolution watershed
+    # only re-floods a narrow strip, and the user's strokes redrawn on top at full resolution
+    h, w = shape[:2]; labels = np.maximum(preview_labels, 0).astype(np.int32)
+    boundary = cv2.dilate((preview_labels == -1).astype(np.uint8), cv2.getStructuringElement(cv2.MORPH_RECT, (2 * band + 1, 2 * band + 1)))
+    labels[boundary > 0] = 0
+    markers = cv2.resize(labels, (w, h), interpolation=cv2.INTER_NEAREST)
+    stroke_markers = rasterize_markers(strokes, shape)
+    np.copyto(markers, stroke_markers, where=stroke_markers > 0)
+    return markers
+
+
+def segment_watershed_strokes(img, strokes, preview_size, band=2):
+    # The interactive editor's result from its strokes alone, so an edit step keeps a few point lists
+    # instead of a full-resolution marker map: the watershed runs on the same preview-sized copy the
+    # editor showed, then only a band around its boundaries is re-flooded at full resolution
+    rgb = to_rgb(img); h, w = rgb.shape[:2]; pw, ph = preview_size
+    preview = rgb if (pw, ph) == (w, h) else cv2.resize(rgb, (pw, ph), interpolation=cv2.INTER_AREA)
+    preview_labels = cv2.watershed(preview, rasterize_markers(strokes, (ph, pw), pw / w))
+    return segment_watershed_markers(rgb, refine_watershed_markers(preview_labels, strokes, rgb.shape, band))
+
+
+def grabcut(img, rect, iterations=5, progress=None):
+    mask = np.zeros(img.shape[:2], np.uint8); bgdModel = np.zeros((1, 65), np.float64); fgdModel = np.zeros((1, 65), np.float64)
+    # Iterate one step at a time (GC_EVAL continues from the models) so progress can be reported
+    for i in range(iterations):
+        if progress: progress(i / iterations, f"iteration {i + 1}/{iterations}")
+        cv2.grabCut(img, mask, tuple(int(v) for v in rect), bgdModel, fgdModel, 1, cv2.GC_INIT_WITH_RECT if i == 0 else cv2.GC_EVAL)
+    mask2 = np.where((mask == 2) | (mask == 0), 0, 1).astype('uint8')
+    return img * mask2[:, :, np.newaxis]
+
+# ----------------------------------------------------------
+# Morphology
+# ----------------------------------------------------------
+def binarize(img, threshold=127):
+    _, img_bin = cv2.threshold(to_gray(img), threshold, 255, cv2.THRESH_BINARY)
+    return img_bin
+
+
+def morph_basic(img, ksize=5):
+    img_bin = binarize(img); kernel = np.ones((ksize, ksize), np.uint8)
+    erosion = cv2.erode(img_bin, kernel, iterations=1); dilation = cv2.dilate(img_bin, kernel, iterations=1); gradient = cv2.morphologyEx(img_bin, cv2.MORPH_GRADIENT, kernel)
+    return img_bin, erosion, dilation, gradient
+
+
+def opening_tophat(img, ksize=9):
+    img_bin = binarize(img); kernel = np.ones((ksize, ksize), np.uint8)
+    opening = cv2.morphologyEx(img_bin, cv2.MORPH_OPEN, kernel); tophat = cv2.morphologyEx(img_bin, cv2.MORPH_TOPHAT, kernel)
+    return img_bin, opening, tophat
+
+# ----------------------------------------------------------
+# Geometric transforms
+# ----------------------------------------------------------
+def rotate(img, angle=0.0):
+    (h, w) = img.shape[:2]; center = (w // 2, h // 2); M = cv2.getRotationMatrix2D(center, float(angle), 1.0)
+    return cv2.warpAffine(img, M, (w, h))
+
+
+def translate(img, tx=0, ty=0):
+    (h, w) = img.shape[:2]; M = np.float32([[1, 0, tx], [0, 1, ty]])
+    return cv2.warpAffine(img, M, (w, h))
+
+
+def zoom(img, factor=1.0):
+    interpolation = cv2.INTER_AREA if factor < 1 else cv2.INTER_LINEAR
+    return cv2.resize(img, None, fx=factor, fy=factor, interpolation=interpolation)
+
+
+def crop(img, x=0, y=0, w=None, h=None):
+    w = img.shape[1] - x if w is None else w; h = img.shape[0] - y if h is None else h
+    return img[y:y + h, x:x + w]
+
+# ----------------------------------------------------------
+# Live video effects
+# ----------------------------------------------------------
+DEFAULT_TRACKING_SETTINGS = {"detect_every": 5, "detection_scale": 0.5, "min_face_size": 40, "max_face_size": 0}
+DEFAULT_LIVE_SETTINGS = {"contrast": 0.0, "exposure": 0.0, "sharpen": 0.0, "flip": False, "face_detect": False, "grayscale": False, "canny": False,
+                         "face_tracking": False, "tracking": DEFAULT_TRACKING_SETTINGS, "motion_gating": False,
+                         "color_classes": (), "color_min_area": 0.001}
+
+
+def draw_face_boxes(frame, faces):
+    # faces: [((x, y, w, h), [(ex, ey, ew, eh), ...]), ...] with eyes relative to their face
+    # On single-channel frames draw with the luma of the usual blue/green boxes
+    face_color, eye_color = ((255, 0, 0), (0, 255, 0)) if frame.ndim == 3 else ((76,), (150,))
+    for (x, y, w, h), eyes in faces:
+        cv2.rectangle(frame, (x, y), (x + w, y + h), face_color, 2); roi_color = frame[y:y + h, x:x + w]
+        for (ex, ey, ew, eh) in eyes: cv2.rectangle(roi_color, (ex, ey), (ex + ew, ey + eh), eye_color, 2)
+
+
+def draw_faces_on_frame(frame, face_cascade, eye_cascade, gray=None):
+    # Returns the detected faces so callers can redraw them without detecting again
+    if face_cascade is None or eye_cascade is None: return []
+    if gray is None: gray = cv2.cvtColor(frame, cv2.COLOR_RGB2GRAY)
+    faces = [(tuple(face), list(eye_cascade.detectMultiScale(gray[face[1]:face[1] + face[3], face[0]:face[0] + face[2]])))
+             for face in face_cascade.detectMultiScale(gray, 1.2, 5)]
+    draw_face_boxes(frame, faces)
+    return faces
+
+
+def build_adjustment_lut(contrast=0.0, exposure=0.0):
+    # Contrast (scale) followed by exposure (offset), each saturated like cv2.addWeighted/cv2.add
+    values = np.arange(256, dtype=np.float32) * ((100.0 + contrast) / 100.0)
+    values = np.clip(np.round(values), 0, 255) + round(float(exposure))
+    return np.clip(values, 0, 255).astype(np.uint8)
+
+
+class LiveEffectsChain:
+    # Per-frame effects for the live feed. Every stage writes into buffers that
+    # are reused between frames; the returned frame lives in one of
+    # `output_buffers` rotating slots and stays valid until that many newer
+    # frames have been produced. Not thread-safe: use one chain per worker.
+    # An optional PerfMonitor times each stage as "live:<stage>".
+    # With settings["motion_gating"], frames processed with motion=False reuse
+    # the last face boxes instead of running detection or tracking, except for
+    # one refresh every `idle_refresh` seconds so a still scene is not stale forever.
+    # With settings["color_classes"] (class names) colour frames are labelled in one
+    # lookup-table pass on a copy at most `color_width` pixels wide, components are
+    # boxed and the per-class results are kept in `last_colors` (empty while the output is gray).
+    def __init__(self, output_buffers=4, monitor=None, idle_refresh=1.0, color_width=320):
+        self.output_buffers = output_buffers; self._slot = 0; self._buffers = {}; self.monitor = monitor; self.last_colors = {}
+        self.idle_refresh = idle_refresh; self._last_faces = []; self._last_face_update = None; self.color_width = color_width
+        self._lut = None; self._lut_key = None
+
+    def _buffer(self, name, shape):
+        buf = self._buffers.get(name)
+        if buf is None or buf.shape != shape: buf = self._buffers[name] = np.empty(shape, np.uint8)
+        return buf
+
+    def _output_buffer(self, shape):
+        self._slot = (self._slot + 1) % self.output_buffers
+        return self._buffer(f"out{self._slot}", shape)
+
+    def adjustment_lut(self, contrast, exposure):
+        # Rebuilt only when a slider actually moves
+        key = (float(contrast), float(exposure))
+        if key != self._lut_key: self._lut = build_adjustment_lut(contrast, exposure); self._lut_key = key
+        return self._lut
+
+    def _draw_faces(self, frame, gray, settings, face_cascade, eye_cascade, face_tracker, motion=True):
+        now = time.perf_counter()
+        idle = settings.get("motion_gating") and not motion and self._last_face_update is not None and now - self._last_face_update < self.idle_refresh
+        if not idle: self._last_face_update = now
+        if face_tracker is not None and settings.get("face_tracking"):
+            if not idle: face_tracker.configure(**settings.get("tracking", DEFAULT_TRACKING_SETTINGS)); face_tracker.update(gray)
+            face_tracker.draw(frame)
+        elif idle: draw_face_boxes(frame, self._last_faces)
+        else: self._last_faces = draw_faces_on_frame(frame, face_cascade, eye_cascade, gray)
+
+    def _classify_colors(self, frame, settings):
+        classifier = color_classes.get_classifier(color_classes.select_classes(settings["color_classes"]))
+        h, w = frame.shape[:2]; small = frame
+        if w > self.color_width:
+            size = (self.color_width, max(1, round(h * self.color_width / w)))
+            small = cv2.resize(frame, size, dst=self._buffer("color_small", (size[1], size[0], 3)), interpolation=cv2.INTER_AREA)
+        labels = classifier.label(small, dst=self._buffer("labels", small.shape[:2]))
+        self.last_colors = classifier.analyze(labels, settings.get("color_min_area", 0.001) * labels.size, scale=w / small.shape[1])
+        return classifier
+
+    def process(self, frame_bgr, settings, face_cascade=None, eye_cascade=None, face_tracker=None, motion=True):
+        # BGR camera frame in, RGB (or gray for grayscale/Canny) frame out.
+        # LUT, sharpening and flipping are per-channel, so they run before the
+        # single colour conversion; gray outputs convert straight from BGR.
+        h, w = frame_bgr.shape[:2]; contrast = settings["contrast"]; exposure = settings["exposure"]; sharpen_amount = settings["sharpen"]
+        want_gray = settings["grayscale"] or settings["canny"]; work = frame_bgr
+        monitor = self.monitor
+        if contrast != 0 or exposure != 0:
+            with span(monitor, "live:adjust"): work = cv2.LUT(work, self.adjustment_lut(contrast, exposure), dst=self._buffer("adjusted", work.shape))
+        if want_gray:
+            with span(monitor, "live:gray"): work = cv2.cvtColor(work, cv2.COLOR_BGR2GRAY, dst=self._buffer("gray", (h, w)))
+        if sharpen_amount > 0:
+            with span(monitor, "live:sharpen"):
+                alpha = 1.0 + (sharpen_amount / 100.0) * 1.5; blurred = cv2.GaussianBlur(work, (0, 0), 3, dst=self._buffer("blurred", work.shape))
+                work = cv2.addWeighted(work, alpha, blurred, 1.0 - alpha, 0, dst=self._buffer("sharpened", work.shape))
+        if settings["flip"]:
+            with span(monitor, "live:flip"): work = cv2.flip(work, 1, dst=self._buffer("flipped", work.shape))
+        if not want_gray:
+            with span(monitor, "live:to_rgb"): out = cv2.cvtColor(work, cv2.COLOR_BGR2RGB, dst=self._output_buffer(work.shape))
+            classifier = None
+            if settings.get("color_classes"):
+                # Labelled before any boxes are drawn, so the overlays are not classified themselves
+                with span(monitor, "live:colors"): classifier = self._classify_colors(out, settings)
+            else: self.last_colors = {}
+            if settings["face_detect"]:
+                with span(monitor, "live:faces"): self._draw_faces(out, cv2.cvtColor(out, cv2.COLOR_RGB2GRAY, dst=self._buffer("gray", (h, w))), settings, face_cascade, eye_cascade, face_tracker, motion)
+            if classifier is not None: classifier.draw(out, self.last_colors)
+            return out
+        self.last_colors = {}
+        if settings["face_detect"]:
+            # work is always one of our own buffers here, so boxes can be drawn on it directly
+            with span(monitor, "live:faces"):
+                detect_gray = self._buffer("detect_gray", (h, w)); np.copyto(detect_gray, work)
+                self._draw_faces(work, detect_gray, settings, face_cascade, eye_cascade, face_tracker, motion)
+        out = self._output_buffer((h, w))
+        if settings["canny"]:
+            with span(monitor, "live:canny"): return cv2.Canny(work, 100, 200, edges=out)
+        np.copyto(out, work); return out
+
+# ==========================================================
+# Operation registry (used by chains and the batch CLI)
+# Multi-output operations expose their main result.
+# ==========================================================
+def _needs_cascades(func):
+    func.needs_cascades = True
+    return func
+
+
+@_needs_cascades
+def _faces_op(img, face_cascade=None, eye_cascade=None, **params):
+    if face_cascade is None or eye_cascade is None: raise RuntimeError("Haar cascades are not loaded")
+    return detect_faces_eyes(img, face_cascade, eye_cascade, **params)
+
+
+OPERATIONS = {
+    "log": log_transform,
+    "blur": gaussian_blur,
+    "median": median_filter,
+    "average": custom_filter,
+    "diff_h": lambda img: difference_filters(img)[0],
+    "diff_v": lambda img: difference_filters(img)[1],
+    "sharpen": sharpen,
+    "sobel_x": lambda img, **p: sobel(img, **p)[0],
+    "sobel_y": lambda img, **p: sobel(img, **p)[1],
+    "sobel": lambda img, **p: sobel(img, **p)[2],
+    "canny": canny,
+    "faces": _faces_op,
+    "circles": detect_circles,
+    "lines": lambda img, **p: detect_lines(img, **p)[1],
+    "corners": detect_corners,
+    "color_classes": classify_colors,
+    "kmeans": segment_kmeans,
+    "kmeans_fast": segment_kmeans_fast,
+    "watershed": segment_watershed_auto,
+    "watershed_markers": segment_watershed_markers,
+    "watershed_strokes": segment_watershed_strokes,
+    "grabcut": grabcut,
+    "binary": binarize,
+    "erode": lambda img, ksize=5: morph_basic(img, ksize)[1],
+    "dilate": lambda img, ksize=5: morph_basic(img, ksize)[2],
+    "gradient": lambda img, ksize=5: morph_basic(img, ksize)[3],
+    "opening": lambda img, ksize=9: opening_tophat(img, ksize)[1],
+    "tophat": lambda img, ksize=9: opening_tophat(img, ksize)[2],
+    "rotate": rotate,
+    "translate": translate,
+    "zoom": zoom,
+    "crop": crop,
+    "gray": to_gray,
+}
+
+
+def _parse_value(text):
+    for cast in (int, float):
+        try: return cast(text)
+        except ValueError: pass
+    if ',' in text: return tuple(_parse_value(v) for v in text.split(','))
+    return text
+
+
+def parse_operation(spec):
+    # "name:key=value:key=value" -> (name, {key: value})
+    name, *pairs = spec.split(':'); params = {}
+    if name not in OPERATIONS: raise ValueError(f"Unknown operation '{name}'. Available: {', '.join(sorted(OPERATIONS))}")
+    for pair in pairs:
+        if '=' not in pair: raise ValueError(f"Invalid parameter '{pair}' in '{spec}' (expected key=value)")
+        key, value = pair.split('=', 1); params[key] = _parse_value(value)
+    return name, params
+
+
+def parse_chain(specs):
+    return [parse_operation(spec) for spec in specs]
+
+
+def chain_needs_cascades(chain):
+    return any(getattr(OPERATIONS[name], 'needs_cascades', False) for name, _ in chain)
+
+
+def run_operation(img, name, params=None, cascades=None):
+    func = OPERATIONS[name]; params = dict(params or {})
+    if getattr(func, 'needs_cascades', False) and cascades is not None: params['face_cascade'], params['eye_cascade'] = cascades
+    return func(img, **params)
+
+
+def run_chain(img, chain, cascades=None):
+    for name, params in chain: img = run_operation(img, name, params, cascades)
+    return img
@@ -0,0 +1,56 @@
+import cv2
+import numpy as np
+
+from caching import LRUCache
+
+# ==========================================================
+# Image State
+# Holds the loaded image read-only and derives other representations
+# (gray, float32, Canny edges) lazily. Derived arrays are
+# cached under a memory budget and dropped whenever a new image is set.
+# Everything handed out is a read-only view; callers that need to draw
+# on an image must take their own copy.
+# ==========================================================
+
+DEFAULT_CACHE_BYTES = 512 * 1024 * 1024
+
+
+def _read_only(arr):
+    arr.setflags(write=False)
+    return arr
+
+
+class ImageState:
+    def __init__(self, image=None, max_bytes=DEFAULT_CACHE_BYTES):
+        self.cache = LRUCache(max_bytes=max_bytes); self.version = 0; self._original = None
+        self.set_image(image)
+
+    def set_image(self, image):
+        self.cache.clear(); self.version += 1
+        # Takes ownership without copying: the array passed in becomes read-only
+        self._original = None if image is None else _read_only(np.ascontiguousarray(image))
+
+    @property
+    def original(self):
+        return self._original
+
+    @property
+    def is_empty(self):
+        return self._original is None
+
+    def _derived(self, key, compute):
+        # The version in the key keeps results from a previous image from ever being served
+        return self.cache.get_or_compute((self.version,) + key, lambda: _read_only(compute()))
+
+    def gray(self):
+        if self._original is None: return None
+        if self._original.ndim == 2: return self._original
+        return self._derived(("gray",), lambda: cv2.cvtColor(self._original, cv2.COLOR_RGB2GRAY))
+
+    def float32(self, gray=False):
+        if self._original is None: return None
+        return self._derived(("float32", gray), lambda: np.float32(self.gray() if gray else self._original))
+
+    def canny(self, threshold1=100, threshold2=200, aperture_size=3):
+        if self._original is None: return None
+        return self._derived(("canny", threshold1, threshold2, aperture_size), lambda: cv2.Canny(self.gray(), threshold1, threshold2, apertureSize=aperture_size))
@@ -0,0 +1,72 @@
+import time
+
+import cv2
+
+from caching import LRUCache
+
+# ==========================================================
+# Interactive Preview Helpers
+# Slider tools render on a preview-sized proxy of the image, throttle
+# slider events so the latest value is rendered at a steady rate while
+# dragging (and once more when the events stop), and memoize results by
+# parameters. The full-resolution result is computed only on commit,
+# by the edit stack running the committed operation.
+# ==========================================================
+
+def make_proxy(image, max_size=500):
+    h, w = image.shape[:2]; scale = min(1.0, max_size / w, max_size / h)
+    if scale >= 1.0: return image, 1.0
+    return cv2.resize(image, (max(1, int(w * scale)), max(1, int(h * scale))), interpolation=cv2.INTER_AREA), scale
+
+
+class Debouncer:
+    def __init__(self, root, delay_ms, func):
+        self.root = root; self.delay_ms = delay_ms; self.func = func; self._after_id = None
+
+    def call(self):
+        self.cancel(); self._after_id = self.root.after(self.delay_ms, self._fire)
+
+    def cancel(self):
+        if self._after_id is not None: self.root.after_cancel(self._after_id); self._after_id = None
+
+    def _fire(self):
+        self._after_id = None; self.func()
+
+
+class Throttle:
+    # Runs func at most once per interval_ms while calls keep coming, and always once after the last
+    # call, so the latest value shows up during a drag instead of only after it stops (a debouncer
+    # is reset by every event and Tk sends one about every 16 ms)
+    def __init__(self, root, interval_ms, func):
+        self.root = root; self.interval_ms = interval_ms; self.func = func; self._after_id = None; self._last = None
+
+    def call(self):
+        if self._after_id is not None: return  # the pending run will pick up the latest value
+        wait = 0 if self._last is None else max(0, int(self.interval_ms - (time.perf_counter() - self._last) * 1000))
+        self._after_id = self.root.after(wait, self._fire)
+
+    def cancel(self):
+        if self._after_id is not None: self.root.after_cancel(self._after_id); self._after_id = None
+
+    def _fire(self):
+        self._after_id = None; self._last = time.perf_counter(); self.func()
+
+
+class InteractivePreview:
+    # render(image, scale, **params) runs on the proxy and must look like the
+    # committed full-resolution operation, scaling any size-dependent
+    # parameters (kernel sizes, sigmas) by `scale`.
+    def __init__(self, root, image, render, on_frame, max_size=500, interval_ms=50, cache_size=32):
+        self.render = render; self.on_frame = on_frame; self.params = {}
+        self.proxy, self.scale = make_proxy(image, max_size)
+        self.cache = LRUCache(max_entries=cache_size); self.throttle = Throttle(root, interval_ms, self.render_preview)
+
+    def request(self, **params):
+        self.params = params; self.throttle.call()
+
+    def render_preview(self):
+        key = tuple(sorted(self.params.items()))
+        self.on_frame(self.cache.get_or_compute(key, lambda: self.render(self.proxy, self.scale, **self.params)))
+
+    def close(self):
+        self.throttle.cancel(); self.cache.clear()
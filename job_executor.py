@@ -0,0 +1,98 @@
+import itertools
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# ==========================================================
+# Background Job Scheduler
+# Heavy operations run on a small thread pool (OpenCV releases the GIL,
+# so threads run truly in parallel without pickling large images).
+# Completion callbacks are always delivered on the Tk thread by polling
+# a queue with root.after, never from the worker threads directly.
+# ==========================================================
+
+class JobCancelled(Exception):
+    pass
+
+
+class Job:
+    _ids = itertools.count(1)
+
+    def __init__(self, name):
+        self.id = next(Job._ids); self.name = name; self.status = "queued"; self.progress = 0.0; self.message = ""
+        self.result = None; self.error = None; self.future = None; self._cancel_event = threading.Event()
+
+    @property
+    def cancelled(self):
+        return self._cancel_event.is_set()
+
+    def cancel(self):
+        self._cancel_event.set()
+        if self.future is not None and self.future.cancel(): self.status = "cancelled"
+
+    def report(self, fraction, message=None):
+        # Called from the worker; doubles as the cancellation checkpoint
+        if self._cancel_event.is_set(): raise JobCancelled()
+        self.progress = max(0.0, min(1.0, float(fraction)))
+        if message is not None: self.message = message
+
+    @property
+    def finished(self):
+        return self.status in ("done", "failed", "cancelled")
+
+
+class JobScheduler:
+    def __init__(self, root, max_workers=2, poll_ms=50, on_change=None):
+        self.root = root; self.poll_ms = poll_ms; self.on_change = on_change
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self.jobs = []; self._finished = queue.Queue(); self._polling = False
+
+    def submit(self, name, func, *args, on_done=None, on_error=None, **kwargs):
+        # func is called as func(job, *args, **kwargs) on a worker thread
+        job = Job(name); job.on_done = on_done; job.on_error = on_error
+        job.future = self.executor.submit(self._run, job, func, args, kwargs)
+        job.future.add_done_callback(lambda f: self._finished.put(job))
+        self.jobs.append(job); self._ensure_polling(); self._notify()
+        return job
+
+    def _run(self, job, func, args, kwargs):
+        if job.cancelled: raise JobCancelled()
+        job.status = "running"
+        return func(job, *args, **kwargs)
+
+    def active_jobs(self):
+        return [job for job in self.jobs if not job.finished]
+
+    def cancel_all(self):
+        for job in self.active_jobs(): job.cancel()
+
+    def shutdown(self):
+        self.cancel_all(); self.executor.shutdown(wait=False)
+
+    def _ensure_polling(self):
+        if not self._polling: self._polling = True; self.root.after(self.poll_ms, self._poll)
+
+    def _poll(self):
+        while True:
+            try: job = self._finished.get_nowait()
+            except queue.Empty: break
+            self._deliver(job)
+        self.jobs = [job for job in self.jobs if not job.finished]
+        self._notify()
+        if self.jobs: self.root.after(self.poll_ms, self._poll)
+        else: self._polling = False
+
+    def _deliver(self, job):
+        future = job.future
+        if future.cancelled(): job.status = "cancelled"; return
+        error = future.exception()
+        if isinstance(error, JobCancelled) or job.cancelled: job.status = "cancelled"; return
+        if error is not None:
+            job.status = "failed"; job.error = error
+            if job.on_error: job.on_error(job, error)
+            return
+        job.status = "done"; job.progress = 1.0; job.result = future.result()
+        if job.on_done: job.on_done(job.result)
+
+    def _notify(self):
+        if self.on_change: self.on_change(self.jobs)
@@ -0,0 +1,39 @@
+import threading
+import time
+
+# ==========================================================
+# Background Loader
+# Runs a slow initialiser (e.g. parsing the Haar cascades) once on a
+# daemon thread so the window can appear first. get() returns the
+# result, waiting for it only if it is asked for before it is ready,
+# and starts the load itself if nobody has yet.
+# ==========================================================
+
+class BackgroundLoader:
+    def __init__(self, func, name="background-loader", on_loaded=None):
+        # on_loaded(result, seconds) runs on the loader thread
+        self.func = func; self.name = name; self.on_loaded = on_loaded
+        self.result = None; self.error = None; self.seconds = None
+        self._done = threading.Event(); self._lock = threading.Lock(); self._thread = None
+
+    def start(self):
+        with self._lock:
+            if self._thread is None: self._thread = threading.Thread(target=self._run, name=self.name, daemon=True); self._thread.start()
+        return self
+
+    @property
+    def ready(self):
+        return self._done.is_set()
+
+    def _run(self):
+        start = time.perf_counter()
+        try: self.result = self.func()
+        except Exception as e: self.error = e
+        finally: self.seconds = time.perf_counter() - start; self._done.set()
+        if self.error is None and self.on_loaded is not None: self.on_loaded(self.result, self.seconds)
+
+    def get(self, timeout=None):
+        self.start()
+        if not self._done.wait(timeout): raise TimeoutError(f"{self.name} did not finish within {timeout} s")
+        if self.error is not None: raise self.error
+        return self.result
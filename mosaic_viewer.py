@@ -0,0 +1,122 @@
+import tkinter as tk
+from tkinter import ttk
+
+import cv2
+import numpy as np
+
+from display_renderer import DisplayRenderer
+
+# ==========================================================
+# Mosaic Viewer
+# Shows a set of labelled results as one downscaled mosaic in a single
+# PhotoImage. Clicking a panel opens a zoom window that renders only the
+# visible part of that image (wheel to zoom up to pixel level, drag to
+# pan), so full-resolution pixels are only ever scaled for the viewport.
+# Everything is dropped when the windows close.
+# ==========================================================
+
+TITLE_HEIGHT = 24
+
+
+def to_display(img):
+    # uint8 RGB/gray for display; other dtypes are stretched to 0..255
+    if img.dtype != np.uint8: img = cv2.normalize(img, None, 0, 255, cv2.NORM_MINMAX, dtype=cv2.CV_8U)
+    return img
+
+
+def fit_size(shape, max_w, max_h):
+    h, w = shape[:2]; scale = min(max_w / w, max_h / h)
+    return max(1, int(w * scale)), max(1, int(h * scale))
+
+
+def build_mosaic(images, titles, cell_size=(400, 300), cols=3, background=(46, 46, 46), text_color=(224, 224, 224)):
+    # Returns the mosaic (RGB uint8) and the (x, y, w, h) rectangle of each image inside it
+    cell_w, cell_h = cell_size; cols = max(1, min(cols, len(images))); rows = -(-len(images) // cols)
+    mosaic = np.empty((rows * (cell_h + TITLE_HEIGHT), cols * cell_w, 3), np.uint8); mosaic[:] = background; rects = []
+    for i, (img, title) in enumerate(zip(images, titles)):
+        img = to_display(img); w, h = fit_size(img.shape, cell_w - 8, cell_h - 8)
+        small = cv2.resize(img, (w, h), interpolation=cv2.INTER_AREA if w < img.shape[1] else cv2.INTER_LINEAR)
+        if small.ndim == 2: small = cv2.cvtColor(small, cv2.COLOR_GRAY2RGB)
+        cx = (i % cols) * cell_w; cy = (i // cols) * (cell_h + TITLE_HEIGHT)
+        cv2.putText(mosaic, str(title), (cx + 6, cy + TITLE_HEIGHT - 7), cv2.FONT_HERSHEY_SIMPLEX, 0.55, text_color, 1, cv2.LINE_AA)
+        x = cx + (cell_w - w) // 2; y = cy + TITLE_HEIGHT + (cell_h - h) // 2
+        mosaic[y:y + h, x:x + w] = small; rects.append((x, y, w, h))
+    return mosaic, rects
+
+
+class MosaicViewer:
+    def __init__(self, root, images, titles, title="نتائج المعالجة", cell_size=(400, 300), cols=3, bg='#2E2E2E'):
+        self.images = list(images); self.titles = list(titles); self.renderer = DisplayRenderer(); self.zoom_windows = []
+        self.top = tk.Toplevel(root); self.top.title(title); self.top.configure(bg=bg)
+        self.mosaic, self.rects = build_mosaic(self.images, self.titles, cell_size, cols)
+        self.label = ttk.Label(self.top, background=bg, cursor="hand2"); self.label.pack(padx=10, pady=10)
+        ttk.Label(self.top, text="انقر على أي صورة لعرضها بالدقة الكاملة").pack(pady=(0, 10))
+        self.renderer.render(self.mosaic, self.label, max_size=max(self.mosaic.shape[:2]))
+        self.label.bind("<Button-1>", self.on_click); self.top.protocol("WM_DELETE_WINDOW", self.close)
+
+    def on_click(self, event):
+        for index, (x, y, w, h) in enumerate(self.rects):
+            if x <= event.x < x + w and y <= event.y < y + h: self.zoom_windows.append(ZoomWindow(self.top, self.images[index], self.titles[index])); return
+
+    def close(self):
+        for window in self.zoom_windows: window.close()
+        self.renderer.forget(self.label); self.top.destroy()
+        self.images = self.mosaic = self.zoom_windows = None
+
+
+class ZoomWindow:
+    MAX_ZOOM = 16.0
+
+    def __init__(self, parent, image, title, viewport=(900, 650)):
+        self.image = to_display(image); self.renderer = DisplayRenderer(); self.view_w, self.view_h = viewport
+        h, w = self.image.shape[:2]; self.fit_zoom = min(1.0, self.view_w / w, self.view_h / h); self.zoom = self.fit_zoom
+        self.cx, self.cy = w / 2.0, h / 2.0; self.drag = None
+        self.top = tk.Toplevel(parent); self.top.title(f"{title} ({w}x{h})")
+        self.label = ttk.Label(self.top, cursor="fleur"); self.label.pack()
+        self.status = ttk.Label(self.top); self.status.pack(fill=tk.X)
+        for sequence, handler in (("<MouseWheel>", self.on_wheel), ("<Button-4>", self.on_wheel), ("<Button-5>", self.on_wheel),
+                                  ("<ButtonPress-1>", self.on_press), ("<B1-Motion>", self.on_drag), ("<Double-Button-1>", self.reset_view)):
+            self.label.bind(sequence, handler)
+        self.top.protocol("WM_DELETE_WINDOW", self.close); self.render()
+
+    def visible_region(self):
+        # Source rectangle shown at the current zoom, clamped to the image
+        h, w = self.image.shape[:2]; src_w = min(w, self.view_w / self.zoom); src_h = min(h, self.view_h / self.zoom)
+        self.cx = min(max(self.cx, src_w / 2), w - src_w / 2); self.cy = min(max(self.cy, src_h / 2), h - src_h / 2)
+        x0 = int(round(self.cx - src_w / 2)); y0 = int(round(self.cy - src_h / 2))
+        return x0, y0, max(1, int(round(src_w))), max(1, int(round(src_h)))
+
+    def render(self):
+        if self.image is None: return
+        x0, y0, src_w, src_h = self.visible_region(); crop = self.image[y0:y0 + src_h, x0:x0 + src_w]
+        out_w, out_h = max(1, int(round(src_w * self.zoom))), max(1, int(round(src_h * self.zoom)))
+        # Magnified pixels stay square so single pixels can be inspected
+        view = cv2.resize(crop, (out_w, out_h), interpolation=cv2.INTER_AREA if self.zoom < 1 else cv2.INTER_NEAREST)
+        self.renderer.render(view, self.label, max_size=max(out_w, out_h))
+        self.status.config(text=f"{self.zoom * 100:.0f}%  ({x0}, {y0}) - ({x0 + src_w}, {y0 + src_h})   عجلة الفأرة للتكبير، اسحب للتحريك، نقرتان للملاءمة")
+
+    def on_wheel(self, event):
+        factor = 1.25 if getattr(event, "num", None) == 4 or getattr(event, "delta", 0) > 0 else 0.8
+        x0, y0, _, _ = self.visible_region()
+        # Keep the pixel under the cursor in place
+        px, py = x0 + event.x / self.zoom, y0 + event.y / self.zoom
+        self.zoom = min(self.MAX_ZOOM, max(self.fit_zoom, self.zoom * factor))
+        self.cx, self.cy = px - event.x / self.zoom + self.view_w / self.zoom / 2, py - event.y / self.zoom + self.view_h / self.zoom / 2
+        self.render()
+
+    def on_press(self, event):
+        self.drag = (event.x, event.y)
+
+    def on_drag(self, event):
+        if self.drag is None: return
+        dx, dy = event.x - self.drag[0], event.y - self.drag[1]; self.drag = (event.x, event.y)
+        self.cx -= dx / self.zoom; self.cy -= dy / self.zoom; self.render()
+
+    def reset_view(self, event=None):
+        h, w = self.image.shape[:2]; self.zoom = self.fit_zoom; self.cx, self.cy = w / 2.0, h / 2.0; self.render()
+
+    def close(self):
+        if self.image is None: return
+        self.renderer.forget(self.label); self.image = None
+        try: self.top.destroy()
+        except tk.TclError: pass  # already destroyed with its parent
@@ -0,0 +1,159 @@
+import itertools
+import os
+import queue
+import threading
+import time
+from collections import deque
+
+import cv2
+import numpy as np
+
+from camera_pipeline import put_latest
+from video_recorder import VideoRecorder
+
+# ==========================================================
+# Motion Gating
+# MotionDetector compares each frame, point-sampled down to a thumbnail,
+# against a slowly updated background; a thumbnail is enough to tell an
+# idle scene from a changing one. Motion stays "on" for a hold time after
+# the last change so effects and recordings do not flicker.
+# PreEventBuffer keeps the last few seconds as JPEG bytes, at a reduced
+# frame rate and encoded on its own thread, so the camera worker only
+# copies a frame now and then; MotionRecorder writes them out followed by
+# the live frames whenever motion starts, closing the file once the scene
+# has been idle again.
+# ==========================================================
+
+class MotionDetector:
+    def __init__(self, width=160, threshold=25, min_area=0.005, hold_seconds=2.0, background_rate=0.05):
+        self.width = width; self.threshold = threshold; self.min_area = min_area
+        self.hold_seconds = hold_seconds; self.background_rate = background_rate
+        self.background = None; self.level = 0.0; self.last_motion = None; self.active = False
+
+    def configure(self, threshold=None, min_area=None, hold_seconds=None):
+        if threshold is not None: self.threshold = threshold
+        if min_area is not None: self.min_area = min_area
+        if hold_seconds is not None: self.hold_seconds = hold_seconds
+
+    def reset(self):
+        self.background = None; self.level = 0.0; self.last_motion = None; self.active = False
+
+    def _thumbnail(self, frame):
+        # Nearest-neighbour picks only the thumbnail's pixels (a strided subsample) instead of
+        # averaging the whole frame; the blur below takes care of the noise
+        h, w = frame.shape[:2]; size = (self.width, max(1, round(h * self.width / w)))
+        small = cv2.resize(frame, size, interpolation=cv2.INTER_NEAREST)
+        if small.ndim == 3: small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        return cv2.GaussianBlur(small, (5, 5), 0)
+
+    def update(self, frame, t=None):
+        # Returns True while there is motion (or there was some within hold_seconds)
+        t = time.perf_counter() if t is None else t; small = self._thumbnail(frame)
+        if self.background is None or self.background.shape != small.shape:
+            # The first frame only becomes the background; nothing is known to have changed yet
+            self.background = small.astype(np.float32); self.level = 0.0; self.active = False; return False
+        diff = cv2.absdiff(small, cv2.convertScaleAbs(self.background))
+        self.level = cv2.countNonZero(cv2.threshold(diff, self.threshold, 255, cv2.THRESH_BINARY)[1]) / diff.size
+        cv2.accumulateWeighted(small, self.background, self.background_rate)
+        if self.level >= self.min_area: self.last_motion = t
+        self.active = self.last_motion is not None and t - self.last_motion <= self.hold_seconds
+        return self.active
+
+
+_STOP = object()
+
+
+class PreEventBuffer:
+    # Ring buffer of (timestamp, JPEG bytes, is_gray) bounded by age and total size. push() keeps at most
+    # max_fps frames per second and only copies them; a background thread does the JPEG encoding.
+    def __init__(self, seconds=5.0, max_bytes=64 * 1024 * 1024, quality=80, max_fps=15.0, queue_size=2):
+        self.seconds = seconds; self.max_bytes = max_bytes; self.params = [cv2.IMWRITE_JPEG_QUALITY, quality]
+        # 10% slack so capture-time jitter does not turn every other frame into every third
+        self.min_interval = 0.9 / max_fps if max_fps else 0.0; self.frames = deque(); self.nbytes = 0; self.dropped = 0
+        self._queue = queue.Queue(maxsize=queue_size); self._lock = threading.Lock(); self._generation = 0; self._last_t = None; self._thread = None
+
+    def push(self, frame_rgb, t):
+        # Frames are RGB or gray like the rest of the live path; JPEG stores them as-is
+        if self._last_t is not None and t - self._last_t < self.min_interval: return
+        if self._thread is None: self._thread = threading.Thread(target=self._run, name="pre-event-encoder", daemon=True); self._thread.start()
+        self._last_t = t; self.dropped += put_latest(self._queue, (self._generation, t, frame_rgb.copy()))
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is _STOP: break
+            generation, t, frame = item; ok, data = cv2.imencode('.jpg', frame, self.params)
+            if not ok: continue
+            with self._lock:
+                # A frame taken before the last drain/clear belongs to nothing any more
+                if generation != self._generation: continue
+                self.frames.append((t, data, frame.ndim == 2)); self.nbytes += data.nbytes
+                while self.frames and (t - self.frames[0][0] > self.seconds or self.nbytes > self.max_bytes):
+                    self.nbytes -= self.frames.popleft()[1].nbytes
+
+    def _detach(self):
+        with self._lock: frames = self.frames; self.frames = deque(); self.nbytes = 0; generation = self._generation; self._generation += 1
+        raw = []
+        while True:
+            try: item = self._queue.get_nowait()
+            except queue.Empty: break
+            if item is not _STOP and item[0] == generation: raw.append((item[2], item[1]))
+        self._last_t = None
+        return frames, raw
+
+    def drain(self):
+        # Empties the buffer at once and returns a generator of (frame, timestamp), oldest first: the JPEGs,
+        # decoded by whichever thread iterates it, then the frames not encoded yet (one being encoded
+        # right now is lost)
+        frames, raw = self._detach()
+        return itertools.chain(((cv2.imdecode(data, cv2.IMREAD_GRAYSCALE if is_gray else cv2.IMREAD_UNCHANGED), t) for t, data, is_gray in frames), raw)
+
+    def clear(self):
+        self._detach()
+
+    def close(self):
+        self._detach()
+        if self._thread is not None: put_latest(self._queue, _STOP); self._thread = None
+
+
+class MotionRecorder:
+    # Fed with (processed frame, capture time, motion flag) on the camera worker thread.
+    # on_event(kind, path) is called from that thread with "start"/"stop".
+    def __init__(self, directory=".", pre_seconds=5.0, fps=None, monitor=None, on_event=None, pre_fps=15.0):
+        # pre_fps caps the rate of the pre-event frames; the recorder repeats them to keep real-time speed
+        self.directory = directory; self.fps = fps; self.monitor = monitor; self.on_event = on_event
+        self.buffer = PreEventBuffer(pre_seconds, max_fps=pre_fps); self.recorder = None; self.events = 0; self.last_path = None
+        self._lock = threading.Lock(); self.closed = False
+
+    @property
+    def recording(self):
+        return self.recorder is not None
+
+    def push(self, frame, t, motion):
+        with self._lock:
+            if self.closed: return
+            if self.recorder is None:
+                if not motion: self.buffer.push(frame, t); return
+                self._start(t)
+            if motion: self.recorder.write(frame, t)
+            else: self._stop()
+
+    def _start(self, t):
+        self.last_path = os.path.join(self.directory, f"motion_{time.strftime('%Y%m%d_%H%M%S')}_{self.events:03d}.avi"); self.events += 1
+        # The pre-event frames are decoded and encoded on the recorder thread ahead of the live ones,
+        # so starting an event costs the camera worker nothing; live frames queue behind them and
+        # only the oldest are dropped if the encoder cannot catch up
+        self.recorder = VideoRecorder(self.last_path, fps=self.fps, monitor=self.monitor, backlog=self.buffer.drain()).start()
+        if self.on_event: self.on_event("start", self.last_path)
+
+    def _stop(self):
+        recorder = self.recorder; self.recorder = None
+        # The encoder finishes the file on its own thread; neither the camera worker nor the UI waits for it
+        recorder.request_stop()
+        if self.on_event: self.on_event("stop", recorder.path)
+
+    def close(self):
+        # Safe to call from another thread; an open event file is finished and closed
+        with self._lock:
+            self.closed = True; recorder = self.recorder; self.recorder = None; self.buffer.close()
+        if recorder is not None: recorder.request_stop()
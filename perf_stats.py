@@ -0,0 +1,127 @@
+import functools
+import json
+import os
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+# ==========================================================
+# Performance Monitor
+# Times named stages on any thread, keeps a rolling window of durations
+# per stage (p50/p95/max), counts frames for FPS and keeps the most recent
+# spans so they can be exported as a Chrome trace (chrome://tracing or
+# https://ui.perfetto.dev). Disabled monitors cost one attribute check.
+# ==========================================================
+
+class _Span:
+    __slots__ = ("monitor", "name", "start")
+
+    def __init__(self, monitor, name):
+        self.monitor = monitor; self.name = name; self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter(); return self
+
+    def __exit__(self, *exc):
+        self.monitor.record(self.name, self.start, time.perf_counter()); return False
+
+
+class _NullSpan:
+    __slots__ = ()
+    def __enter__(self): return self
+    def __exit__(self, *exc): return False
+
+
+NULL_SPAN = _NullSpan()
+
+
+def span(monitor, name):
+    # Lets optional monitors be threaded through without `if monitor` at every call site
+    return NULL_SPAN if monitor is None or not monitor.enabled else _Span(monitor, name)
+
+
+class PerfMonitor:
+    def __init__(self, window=300, max_trace_events=50_000, enabled=True):
+        self.window = window; self.enabled = enabled; self._lock = threading.Lock(); self._origin = time.perf_counter()
+        self._durations = {}; self._counts = {}; self._frames = deque(maxlen=window); self._counters = {}
+        self._trace = deque(maxlen=max_trace_events); self._threads = {}
+
+    def stage(self, name):
+        return span(self, name)
+
+    def record(self, name, start, end):
+        # start/end are time.perf_counter() values
+        thread = threading.current_thread()
+        with self._lock:
+            durations = self._durations.get(name)
+            if durations is None: durations = self._durations[name] = deque(maxlen=self.window)
+            durations.append(end - start); self._counts[name] = self._counts.get(name, 0) + 1
+            self._trace.append((name, start, end, thread.ident)); self._threads[thread.ident] = thread.name
+
+    def timed(self, name=None):
+        def decorator(func):
+            stage_name = name or func.__name__
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.stage(stage_name): return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def frame(self, t=None):
+        if self.enabled: self._frames.append(time.perf_counter() if t is None else t)
+
+    def set_counter(self, name, value):
+        self._counters[name] = value
+
+    @property
+    def fps(self):
+        frames = list(self._frames)
+        if len(frames) < 2 or frames[-1] <= frames[0]: return 0.0
+        return (len(frames) - 1) / (frames[-1] - frames[0])
+
+    def reset(self):
+        with self._lock:
+            self._durations.clear(); self._counts.clear(); self._frames.clear(); self._counters.clear(); self._trace.clear()
+
+    def summary(self):
+        with self._lock: snapshot = {name: (np.array(d), self._counts[name]) for name, d in self._durations.items() if d}
+        stages = {}
+        for name, (durations, count) in snapshot.items():
+            p50, p95 = np.percentile(durations, (50, 95)) * 1000.0
+            stages[name] = {"count": count, "p50_ms": float(p50), "p95_ms": float(p95), "max_ms": float(durations.max() * 1000.0), "mean_ms": float(durations.mean() * 1000.0)}
+        return {"fps": self.fps, "counters": dict(self._counters), "stages": stages}
+
+    def format_summary(self, prefix=None):
+        summary = self.summary()
+        lines = [f"FPS {summary['fps']:.1f}  " + "  ".join(f"{k}: {v}" for k, v in summary["counters"].items()), f"{'stage':24s} {'p50':>8s} {'p95':>8s} {'max':>8s} {'n':>6s}"]
+        for name, s in sorted(summary["stages"].items(), key=lambda item: -item[1]["p95_ms"]):
+            if prefix is None or name.startswith(prefix): lines.append(f"{name[:24]:24s} {s['p50_ms']:8.2f} {s['p95_ms']:8.2f} {s['max_ms']:8.2f} {s['count']:6d}")
+        return "\n".join(lines)
+
+    def chrome_trace(self):
+        # Complete ("X") events in microseconds since the monitor was created, plus thread names
+        with self._lock: spans = list(self._trace); threads = dict(self._threads)
+        pid = os.getpid()
+        events = [{"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": name}} for tid, name in threads.items()]
+        events += [{"name": name, "cat": name.split(":", 1)[0], "ph": "X", "pid": pid, "tid": tid,
+                    "ts": (start - self._origin) * 1e6, "dur": (end - start) * 1e6} for name, start, end, tid in spans]
+        return {"traceEvents": events, "displayTimeUnit": "ms", "otherData": self.summary()}
+
+    def export_chrome_trace(self, path):
+        with open(path, 'w', encoding='utf-8') as f: json.dump(self.chrome_trace(), f)
+        return path
+
+
+def instrument_methods(cls, prefixes, attr="perf"):
+    # Wraps every method whose name starts with one of `prefixes` in a stage
+    # named "ui:<method>" on the instance's monitor (looked up as `attr`).
+    def wrap(name, method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            with span(getattr(self, attr, None), f"ui:{name}"): return method(self, *args, **kwargs)
+        return wrapper
+    for name, method in list(vars(cls).items()):
+        if callable(method) and name.startswith(tuple(prefixes)): setattr(cls, name, wrap(name, method))
+    return cls
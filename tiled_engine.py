@@ -0,0 +1,115 @@
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+import numpy as np
+
+import image_engine as engine
+
+# ==========================================================
+# Tiled Engine
+# Runs neighbourhood filters tile by tile. Each tile is read with a halo
+# as wide as the chain's combined kernel reach, processed, and only its
+# core is written back, so the output matches a full-image run exactly.
+# Input can be a memory-mapped .npy file and output is written tile by
+# tile into a memory-mapped array, so peak RAM depends on the tile size
+# and worker count, not on the image size.
+# ==========================================================
+
+DEFAULT_TILE_SIZE = 1024
+
+
+def _half(ksize): return int(ksize) // 2
+
+
+# Pixels of context each operation needs on every side of a tile.
+# Operations missing here depend on the whole image (global normalisation,
+# Hough, segmentation...) and cannot be tiled.
+TILE_HALOS = {
+    "gray": lambda p: 0,
+    "binary": lambda p: 0,
+    "median": lambda p: _half(p.get("ksize", 5)),
+    "average": lambda p: _half(p.get("ksize", 5)),
+    "blur": lambda p: _half(p.get("ksize", 5)) + 1,
+    "sharpen": lambda p: int(np.ceil(4 * p.get("sigma", 3))) + 1,
+    "diff_h": lambda p: 1,
+    "diff_v": lambda p: 1,
+    "sobel_x": lambda p: _half(p.get("ksize", 5)),
+    "sobel_y": lambda p: _half(p.get("ksize", 5)),
+    "sobel": lambda p: _half(p.get("ksize", 5)),
+    "erode": lambda p: _half(p.get("ksize", 5)),
+    "dilate": lambda p: _half(p.get("ksize", 5)),
+    "gradient": lambda p: _half(p.get("ksize", 5)),
+    "opening": lambda p: 2 * _half(p.get("ksize", 9)),
+    "tophat": lambda p: 2 * _half(p.get("ksize", 9)),
+}
+
+
+def chain_halo(chain):
+    halo = 0
+    for name, params in chain:
+        if name not in TILE_HALOS: raise ValueError(f"Operation '{name}' needs the whole image and cannot be tiled")
+        halo += TILE_HALOS[name](params)
+    return halo
+
+
+def is_tileable(chain):
+    return all(name in TILE_HALOS for name, _ in chain)
+
+
+def iter_tiles(height, width, tile_size=DEFAULT_TILE_SIZE):
+    for y in range(0, height, tile_size):
+        for x in range(0, width, tile_size): yield y, min(height, y + tile_size), x, min(width, x + tile_size)
+
+
+def _process_tile(src, dst, chain, halo, tile):
+    y0, y1, x0, x1 = tile; h, w = src.shape[:2]
+    hy0, hy1, hx0, hx1 = max(0, y0 - halo), min(h, y1 + halo), max(0, x0 - halo), min(w, x1 + halo)
+    # np.array forces the (possibly memory-mapped) region into a contiguous buffer for OpenCV
+    result = engine.run_chain(np.array(src[hy0:hy1, hx0:hx1]), chain)
+    dst[y0:y1, x0:x1] = result[y0 - hy0:y1 - hy0, x0 - hx0:x1 - hx0]
+
+
+def output_spec(src, chain):
+    # Shape/dtype of the chain's output, found by running it on a tiny probe
+    probe = engine.run_chain(np.array(src[:8, :8]), chain)
+    return src.shape[:2] + probe.shape[2:], probe.dtype
+
+
+def process_tiled(src, chain, tile_size=DEFAULT_TILE_SIZE, workers=None, out=None, progress=None):
+    halo = chain_halo(chain); workers = workers or os.cpu_count() or 1
+    if out is None: shape, dtype = output_spec(src, chain); out = np.empty(shape, dtype)
+    tiles = list(iter_tiles(src.shape[0], src.shape[1], tile_size)); done = 0
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = set()
+        # At most two tiles per worker are in flight, which bounds memory
+        for tile in tiles:
+            pending.add(pool.submit(_process_tile, src, out, chain, halo, tile))
+            if len(pending) >= 2 * workers:
+                finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for f in finished: f.result(); done += 1
+                if progress: progress(done / len(tiles), f"tile {done}/{len(tiles)}")
+        for f in pending: f.result()
+    if progress: progress(1.0)
+    return out
+
+
+def open_source(path):
+    # .npy files are memory-mapped and read tile by tile; other formats are decoded once by OpenCV
+    if path.lower().endswith('.npy'): return np.load(path, mmap_mode='r')
+    return engine.read_image(path)
+
+
+def process_file_tiled(src_path, dst_path, chain, tile_size=DEFAULT_TILE_SIZE, workers=None, progress=None):
+    src = open_source(src_path); shape, dtype = output_spec(src, chain)
+    if dst_path.lower().endswith('.npy'):
+        out = np.lib.format.open_memmap(dst_path, mode='w+', dtype=dtype, shape=shape)
+        process_tiled(src, chain, tile_size, workers, out, progress); out.flush(); del out
+        return shape
+    # Encoders need the whole image, so tiles are staged in a temporary memory-mapped file first
+    fd, tmp_path = tempfile.mkstemp(suffix='.npy', dir=os.path.dirname(os.path.abspath(dst_path))); os.close(fd)
+    try:
+        out = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=dtype, shape=shape)
+        process_tiled(src, chain, tile_size, workers, out, progress); engine.write_image(dst_path, out); del out
+    finally: os.remove(tmp_path)
+    return shape
@@ -0,0 +1,212 @@
+import argparse
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+import cv2
+
+import image_engine as engine
+from face_tracking import FaceTracker
+
+# ==========================================================
+# Offline Video Processing
+# Runs the live effects chain over a video file as fast as the CPU allows.
+# The file is split into short frame ranges, more than there are workers;
+# each worker process seeks to its range and processes it into a temporary
+# segment file. Segments are appended to the output in order as soon as
+# they and all earlier ones are done, then deleted, and only a bounded
+# number are in flight, so temporary disk use does not grow with the
+# length of the video.
+# Example:
+#   python video_processor.py archive.mp4 out.avi --contrast 20 --sharpen 30 --faces --tracking --workers 8
+# ==========================================================
+
+# Temporary segments are lossless (HuffYUV) so the only loss is the final encode, the same as a
+# single-pass run; MJPG is the fallback for OpenCV builds without an FFmpeg HuffYUV encoder.
+# Both are intra-only, so stitching only has to decode each segment once.
+SEGMENT_FOURCCS = ('HFYU', 'MJPG')
+PROGRESS_EVERY = 10
+SEGMENT_SECONDS = 10.0  # default segment length
+PENDING_PER_WORKER = 2  # segments processed or waiting to be stitched, per worker
+
+_worker_settings = None; _worker_cascades = None; _worker_counter = None; _worker_stop = None
+
+
+def _init_worker(settings, cascade_dir, counter, stop_event):
+    global _worker_settings, _worker_cascades, _worker_counter, _worker_stop
+    _worker_settings = settings; _worker_counter = counter; _worker_stop = stop_event
+    _worker_cascades = engine.load_cascades(cascade_dir) if settings.get("face_detect") else (None, None)
+
+
+def video_info(path):
+    capture = cv2.VideoCapture(path)
+    try:
+        if not capture.isOpened(): raise IOError(f"Could not open video: {path}")
+        return {"frames": int(capture.get(cv2.CAP_PROP_FRAME_COUNT)), "fps": capture.get(cv2.CAP_PROP_FPS) or 25.0,
+                "width": int(capture.get(cv2.CAP_PROP_FRAME_WIDTH)), "height": int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT))}
+    finally: capture.release()
+
+
+def split_segments(frame_count, segments):
+    # Contiguous [start, end) ranges; the last one is open-ended (end=None) because container
+    # frame counts are estimates and the remainder is read until the end of the file
+    segments = max(1, min(segments, frame_count or 1)); step = -(-max(frame_count, 1) // segments)
+    ranges = [(start, start + step) for start in range(0, max(frame_count, 1), step)]
+    ranges[-1] = (ranges[-1][0], None)
+    return ranges
+
+
+def to_bgr(frame):
+    return cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR) if frame.ndim == 2 else cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
+
+
+def _open_segment_writer(dst, fps, size):
+    for fourcc in SEGMENT_FOURCCS:
+        writer = cv2.VideoWriter(dst, cv2.VideoWriter_fourcc(*fourcc), fps, size)
+        if writer.isOpened(): return writer
+        writer.release()
+    raise IOError(f"Could not open video file for writing: {dst}")
+
+
+def _process_segment(src, dst, start, end, fps, size):
+    capture = cv2.VideoCapture(src); writer = None
+    chain = engine.LiveEffectsChain(output_buffers=1); face_cascade, eye_cascade = _worker_cascades
+    tracker = FaceTracker(face_cascade, eye_cascade, **_worker_settings.get("tracking", engine.DEFAULT_TRACKING_SETTINGS)) if face_cascade is not None and _worker_settings.get("face_tracking") else None
+    frames = unreported = 0
+    try:
+        writer = _open_segment_writer(dst, fps, size)
+        if start: capture.set(cv2.CAP_PROP_POS_FRAMES, start)
+        while end is None or start + frames < end:
+            if _worker_stop.is_set(): break
+            ret, frame = capture.read()
+            if not ret: break
+            writer.write(to_bgr(chain.process(frame, _worker_settings, face_cascade, eye_cascade, tracker))); frames += 1; unreported += 1
+            if unreported == PROGRESS_EVERY:
+                with _worker_counter.get_lock(): _worker_counter.value += unreported
+                unreported = 0
+    finally:
+        capture.release()
+        if writer is not None: writer.release()
+        with _worker_counter.get_lock(): _worker_counter.value += unreported
+    return frames
+
+
+def _open_output(dst, fps, size, fourcc):
+    writer = cv2.VideoWriter(dst, cv2.VideoWriter_fourcc(*fourcc), fps, size)
+    if not writer.isOpened(): raise IOError(f"Could not open video file for writing: {dst}")
+    return writer
+
+
+def _append_segment(writer, path):
+    capture = cv2.VideoCapture(path); frames = 0
+    try:
+        while True:
+            ret, frame = capture.read()
+            if not ret: break
+            writer.write(frame); frames += 1
+    finally: capture.release()
+    return frames
+
+
+def stitch_segments(segment_paths, dst, fps, size, fourcc='XVID'):
+    writer = _open_output(dst, fps, size, fourcc)
+    try: return sum(_append_segment(writer, path) for path in segment_paths)
+    finally: writer.release()
+
+
+def check_free_space(directory, size, frames):
+    # Lossless segments take about as much as the raw frames; refuse to start rather than fill the disk
+    needed = size[0] * size[1] * 3 * frames; free = shutil.disk_usage(directory).free
+    if free < needed: raise IOError(f"Not enough free space in {directory} for temporary segments: about {needed / 2 ** 30:.1f} GB needed, "
+                                    f"{free / 2 ** 30:.1f} GB free (use another temporary directory or shorter segments)")
+
+
+def process_video(src, dst, settings=None, workers=None, segments=None, fourcc='XVID', cascade_dir=engine.CASCADE_DIR, progress=None, poll_seconds=0.2,
+                  tmp_dir=None, segment_seconds=SEGMENT_SECONDS):
+    # progress(fraction, message) may raise to cancel (e.g. JobCancelled); running workers are told to stop.
+    # segments overrides segment_seconds; temporary segments go to tmp_dir (default: next to dst).
+    settings = dict(engine.DEFAULT_LIVE_SETTINGS, **(settings or {})); info = video_info(src)
+    workers = workers or os.cpu_count() or 1; size = (info["width"], info["height"]); total = max(info["frames"], 1)
+    ranges = split_segments(info["frames"], segments or max(workers, -(-total // max(1, round(info["fps"] * segment_seconds)))))
+    max_pending = workers * PENDING_PER_WORKER; tmp_parent = tmp_dir or os.path.dirname(os.path.abspath(dst))
+    check_free_space(tmp_parent, size, min(total, -(-total // len(ranges)) * max_pending))
+    tmp_dir = tempfile.mkdtemp(prefix="segments_", dir=tmp_parent)
+    paths = [os.path.join(tmp_dir, f"segment_{i:04d}.avi") for i in range(len(ranges))]
+    # Spawned (not forked) workers, since this also runs from a thread of the Tk app
+    ctx = multiprocessing.get_context("spawn"); counter = ctx.Value('q', 0); stop_event = ctx.Event(); start_time = time.perf_counter()
+    writer = _open_output(dst, info["fps"], size, fourcc); frames = 0; completed = set(); stitched = submitted = 0
+    try:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=ctx, initializer=_init_worker, initargs=(settings, cascade_dir, counter, stop_event)) as pool:
+            pending = {}
+            try:
+                while stitched < len(ranges):
+                    # Segments beyond the window wait until earlier ones have been stitched and deleted
+                    while submitted < len(ranges) and submitted - stitched < max_pending:
+                        start, end = ranges[submitted]
+                        pending[pool.submit(_process_segment, src, paths[submitted], start, end, info["fps"], size)] = submitted; submitted += 1
+                    finished, _ = wait(pending, timeout=poll_seconds, return_when=FIRST_COMPLETED)
+                    for future in finished: future.result(); completed.add(pending.pop(future))
+                    while stitched in completed:
+                        frames += _append_segment(writer, paths[stitched]); os.remove(paths[stitched]); completed.discard(stitched); stitched += 1
+                    if progress:
+                        done = counter.value; elapsed = time.perf_counter() - start_time
+                        progress(min(done / total, 1.0) * 0.99, f"{done}/{total} frames, {done / elapsed if elapsed > 0 else 0:.0f} fps, {stitched}/{len(ranges)} segments written")
+            except BaseException:
+                stop_event.set(); pool.shutdown(wait=True, cancel_futures=True); raise
+    except BaseException:
+        # A cancelled or failed run leaves no truncated output behind
+        writer.release(); writer = None
+        try: os.remove(dst)
+        except OSError: pass
+        raise
+    finally:
+        if writer is not None: writer.release()
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    elapsed = time.perf_counter() - start_time
+    if progress: progress(1.0)
+    return {"frames": frames, "segments": len(ranges), "workers": workers, "seconds": elapsed,
+            "fps": frames / elapsed if elapsed > 0 else 0.0, "realtime_factor": frames / info["fps"] / elapsed if elapsed > 0 else 0.0}
+
+
+def print_progress(fraction, message=None):
+    bar = "#" * int(fraction * 40)
+    sys.stdout.write(f"\r[{bar:<40s}] {fraction * 100:5.1f}% {message or ''}   "); sys.stdout.flush()
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Apply the live camera effects to a video file using parallel frame-range workers.")
+    parser.add_argument("input"); parser.add_argument("output")
+    parser.add_argument("--contrast", type=float, default=0.0); parser.add_argument("--exposure", type=float, default=0.0)
+    parser.add_argument("--sharpen", type=float, default=0.0, help="0-100, like the camera slider")
+    parser.add_argument("--flip", action="store_true"); parser.add_argument("--gray", action="store_true"); parser.add_argument("--canny", action="store_true")
+    parser.add_argument("--faces", action="store_true", help="Draw face and eye boxes")
+    parser.add_argument("--tracking", action="store_true", help="With --faces: detect every N frames and track in between")
+    parser.add_argument("--detect-every", type=int, default=engine.DEFAULT_TRACKING_SETTINGS["detect_every"])
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes (default: CPU count)")
+    parser.add_argument("--segments", type=int, default=None, help=f"Number of frame ranges (default: {SEGMENT_SECONDS:g} s each, at least one per worker)")
+    parser.add_argument("--segment-seconds", type=float, default=SEGMENT_SECONDS, help="Length of each frame range when --segments is not given")
+    parser.add_argument("--tmp-dir", default=None, help="Directory for temporary segment files (default: next to the output)")
+    parser.add_argument("--fourcc", default='XVID', help="Output codec FourCC")
+    parser.add_argument("--cascade-dir", default=engine.CASCADE_DIR, help="Directory with Haar cascade XML files")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if not os.path.isfile(args.input): print(f"[ERROR] Input file not found: {args.input}", file=sys.stderr); return 2
+    settings = {"contrast": args.contrast, "exposure": args.exposure, "sharpen": args.sharpen, "flip": args.flip, "grayscale": args.gray, "canny": args.canny,
+                "face_detect": args.faces, "face_tracking": args.tracking, "tracking": dict(engine.DEFAULT_TRACKING_SETTINGS, detect_every=args.detect_every)}
+    try: stats = process_video(args.input, args.output, settings, args.workers, args.segments, args.fourcc, args.cascade_dir, progress=print_progress,
+                               tmp_dir=args.tmp_dir, segment_seconds=args.segment_seconds)
+    except (IOError, ValueError) as e: print(f"\n[ERROR] {e}", file=sys.stderr); return 2
+    print(f"\n[SUCCESS] {stats['frames']} frames in {stats['seconds']:.1f}s ({stats['fps']:.1f} fps, {stats['realtime_factor']:.1f}x real time) "
+          f"using {stats['workers']} workers / {stats['segments']} segments")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,132 @@
+import queue
+import threading
+import time
+
+import cv2
+
+from camera_pipeline import put_latest
+from perf_stats import span
+
+# ==========================================================
+# Asynchronous Video Recorder
+# Frames are copied into a bounded queue and encoded on a background
+# thread, so encoding never slows capture or the UI. The output frame
+# rate is the measured capture rate (or the one given), and frames are
+# placed by their capture timestamp: gaps are filled by repeating the
+# previous frame and frames arriving ahead of schedule are skipped, so
+# playback speed matches real time.
+# Queue policies when the encoder falls behind:
+#   drop_oldest - discard the oldest queued frame (default, keeps latency low)
+#   drop_newest - discard the incoming frame
+#   block       - wait up to `block_timeout` seconds for room (backpressure)
+# A `backlog` iterable of (frame, timestamp), e.g. frames decoded lazily from
+# a pre-event buffer, is consumed on the encoder thread ahead of the queue.
+# ==========================================================
+
+POLICIES = ("drop_oldest", "drop_newest", "block")
+_STOP = object()
+
+
+class VideoRecorder:
+    def __init__(self, path, fps=None, fourcc='XVID', queue_size=64, policy="drop_oldest", block_timeout=0.5,
+                 probe_frames=30, max_gap_seconds=10.0, monitor=None, backlog=None):
+        if policy not in POLICIES: raise ValueError(f"Unknown queue policy '{policy}'. Available: {', '.join(POLICIES)}")
+        self.path = path; self.fps = fps if fps and fps > 0 else None; self.fourcc = fourcc; self.policy = policy
+        self.block_timeout = block_timeout; self.probe_frames = probe_frames; self.max_gap_seconds = max_gap_seconds; self.monitor = monitor
+        self.queue = queue.Queue(maxsize=queue_size); self.thread = None; self.writer = None; self.size = None; self.error = None
+        self.received = 0; self.dropped = 0; self.written = 0; self.duplicated = 0; self.skipped = 0
+        self._pending = []; self._t0 = None; self._lock = threading.Lock(); self._stopping = False; self.backlog = backlog
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name="video-recorder", daemon=True); self.thread.start()
+        return self
+
+    def write(self, frame, timestamp=None):
+        # Safe to call from any thread. The frame is copied because callers reuse their buffers.
+        # Returns False when the frame was dropped.
+        if self.thread is None or self._stopping or self.error is not None: return False
+        item = (frame.copy(), time.perf_counter() if timestamp is None else timestamp); self.received += 1
+        if self.policy == "drop_oldest": dropped = put_latest(self.queue, item); accepted = True
+        else:
+            try:
+                if self.policy == "block": self.queue.put(item, timeout=self.block_timeout)
+                else: self.queue.put_nowait(item)
+                dropped = 0; accepted = True
+            except queue.Full: dropped = 1; accepted = False
+        if dropped: self._count_drop(dropped)
+        return accepted
+
+    def _count_drop(self, n):
+        if not n: return
+        with self._lock: self.dropped += n
+        if self.monitor is not None: self.monitor.set_counter("rec_dropped", self.dropped)
+
+    def request_stop(self):
+        # Never blocks: the encoder finishes what is queued and closes the file on its own thread.
+        # A full queue loses its oldest frame to the stop marker; a dead encoder needs no marker.
+        if self.thread is None or self._stopping: return
+        self._stopping = True
+        if self.thread.is_alive() and self.error is None: self._count_drop(put_latest(self.queue, _STOP))
+
+    @property
+    def finished(self):
+        # True once the file is closed (or was never opened); poll this instead of joining from a UI thread
+        return self.thread is None or not self.thread.is_alive()
+
+    def stop(self, timeout=10.0):
+        # Encodes whatever is still queued, closes the file and returns the final stats.
+        # Waits up to `timeout` seconds, so UI code should use request_stop() and poll `finished`.
+        self.request_stop()
+        if self.thread is not None: self.thread.join(timeout)
+        return self.stats()
+
+    def stats(self):
+        return {"path": self.path, "fps": self.fps or 0.0, "policy": self.policy, "queue_depth": self.queue.qsize(), "queue_size": self.queue.maxsize,
+                "received": self.received, "dropped": self.dropped, "written": self.written, "duplicated": self.duplicated, "skipped": self.skipped,
+                "duration": self.written / self.fps if self.fps else 0.0, "error": self.error}
+
+    def _run(self):
+        try:
+            backlog = self.backlog; self.backlog = None
+            for item in backlog or (): self.received += 1; self._handle(item)
+            while True:
+                item = self.queue.get()
+                if item is _STOP: break
+                if self.monitor is not None: self.monitor.set_counter("rec_queue", self.queue.qsize())
+                self._handle(item)
+            if self.writer is None and self._pending: self._open()
+        except Exception as e: self.error = e
+        finally:
+            if self.writer is not None: self.writer.release(); self.writer = None
+
+    def _handle(self, item):
+        if self.writer is None:
+            # Hold the first frames until the frame rate is known
+            self._pending.append(item)
+            if self.fps is not None or len(self._pending) >= self.probe_frames: self._open()
+        else: self._write_paced(*item)
+
+    def _open(self):
+        pending = self._pending; self._pending = []
+        if self.fps is None:
+            span_seconds = pending[-1][1] - pending[0][1]
+            self.fps = (len(pending) - 1) / span_seconds if len(pending) > 1 and span_seconds > 0 else 20.0
+        h, w = pending[0][0].shape[:2]; self.size = (w, h)
+        self.writer = cv2.VideoWriter(self.path, cv2.VideoWriter_fourcc(*self.fourcc), self.fps, self.size)
+        if not self.writer.isOpened(): self.writer = None; raise IOError(f"Could not open video file for writing: {self.path}")
+        for item in pending: self._write_paced(*item)
+
+    def _write_paced(self, frame, timestamp):
+        # Frame n of the file shows time t0 + n / fps; this frame covers every slot up to its own timestamp
+        if self._t0 is None: self._t0 = timestamp
+        target = int(round((timestamp - self._t0) * self.fps)) + 1
+        if target <= self.written: self.skipped += 1; return
+        repeats = min(target - self.written, max(1, int(self.max_gap_seconds * self.fps)))
+        with span(self.monitor, "record:encode"):
+            if frame.ndim == 2: bgr = cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR)
+            else: bgr = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
+            if (bgr.shape[1], bgr.shape[0]) != self.size: bgr = cv2.resize(bgr, self.size, interpolation=cv2.INTER_AREA)
+            for _ in range(repeats): self.writer.write(bgr)
+        # A gap longer than max_gap_seconds is shortened; later frames keep their spacing
+        if target - self.written > repeats: self._t0 += (target - self.written - repeats) / self.fps
+        self.written += repeats; self.duplicated += repeats - 1
@@ -0,0 +1,122 @@
+import time
+import tkinter as tk
+from tkinter import ttk, messagebox
+
+import cv2
+import numpy as np
+
+import image_engine as engine
+from interactive_preview import Debouncer, make_proxy
+
+# ==========================================================
+# Interactive Watershed Editor
+# Markers are painted on a Tk canvas from mouse events alone, so nothing
+# runs while the user is not drawing. Strokes are kept as point lists in
+# full-image coordinates; each finished stroke is drawn into a preview-
+# sized marker map and the watershed is re-run on the preview after a
+# short debounce, so the regions follow every stroke. "Apply" hands over
+# only the strokes and the preview size: the "watershed_strokes" step
+# repeats the preview watershed, scales its regions up and re-floods a
+# narrow band around their boundaries at full resolution.
+# ==========================================================
+
+# name -> (label, stroke colour, region tint)
+MARKERS = {"foreground": (1, "#00FF00", (0, 255, 0)), "background": (2, "#FF3030", (255, 48, 48))}
+BOUNDARY_COLOR = (255, 255, 0)
+
+
+class WatershedEditor:
+    def __init__(self, root, image, on_commit, title="Interactive Watershed", max_size=800, brush=5, delay_ms=60, bg='#2E2E2E'):
+        # on_commit(strokes, preview_size) receives the parameters of engine.segment_watershed_strokes
+        self.image = engine.to_rgb(image); self.on_commit = on_commit
+        # The scale is taken from the rounded preview size, the same one the committed step derives
+        self.preview, _ = make_proxy(self.image, max_size); ph, pw = self.preview.shape[:2]; self.scale = pw / self.image.shape[1]
+        self.strokes = []; self.current = None; self.markers = np.zeros((ph, pw), np.int32); self.labels = None; self.photo = None
+        self.palette = np.zeros((3, 3), np.uint8)
+        for label, _, tint in MARKERS.values(): self.palette[label] = tint
+        self.top = tk.Toplevel(root); self.top.title(title); self.top.configure(bg=bg)
+        self.canvas = tk.Canvas(self.top, width=pw, height=ph, highlightthickness=0, bg=bg, cursor="pencil"); self.canvas.pack(padx=10, pady=10)
+        self.image_item = self.canvas.create_image(0, 0, anchor=tk.NW)
+        controls = ttk.Frame(self.top); controls.pack(fill=tk.X, padx=10)
+        self.marker = tk.StringVar(value="foreground"); self.brush = tk.IntVar(value=brush)
+        ttk.Radiobutton(controls, text="الكائن (f)", value="foreground", variable=self.marker).pack(side=tk.LEFT, padx=5)
+        ttk.Radiobutton(controls, text="الخلفية (b)", value="background", variable=self.marker).pack(side=tk.LEFT, padx=5)
+        ttk.Label(controls, text="Brush").pack(side=tk.LEFT, padx=(15, 2)); ttk.Spinbox(controls, from_=1, to=50, textvariable=self.brush, width=5).pack(side=tk.LEFT)
+        ttk.Button(controls, text="↶ تراجع", command=self.undo).pack(side=tk.LEFT, padx=5); ttk.Button(controls, text="🗑 مسح", command=self.clear).pack(side=tk.LEFT)
+        self.status = ttk.Label(self.top, text="ارسم على الكائن (f) وعلى الخلفية (b)، ثم اضغط Enter أو زر التطبيق"); self.status.pack(fill=tk.X, padx=10, pady=5)
+        ttk.Button(self.top, text="✔ تطبيق على الصورة", command=self.commit).pack(fill=tk.X, padx=10, pady=(0, 10))
+        for sequence, handler in (("<ButtonPress-1>", self.on_press), ("<B1-Motion>", self.on_drag), ("<ButtonRelease-1>", self.on_release)):
+            self.canvas.bind(sequence, handler)
+        for sequence, handler in (("<KeyPress-f>", lambda e: self.marker.set("foreground")), ("<KeyPress-b>", lambda e: self.marker.set("background")),
+                                  ("<Control-z>", lambda e: self.undo()), ("<Return>", lambda e: self.commit()), ("<Escape>", lambda e: self.close())):
+            self.top.bind(sequence, handler)
+        self.debouncer = Debouncer(root, delay_ms, self.segment)
+        self.top.protocol("WM_DELETE_WINDOW", self.close); self.top.focus_set(); self.render()
+
+    # ---------------------------- drawing ----------------------------
+    def _clamp(self, event):
+        ph, pw = self.preview.shape[:2]
+        return min(max(event.x, 0), pw - 1), min(max(event.y, 0), ph - 1)
+
+    def _brush_radius(self):
+        try: return max(1, int(self.brush.get()))
+        except tk.TclError: return 5  # half-typed spinbox value
+
+    def on_press(self, event):
+        x, y = self._clamp(event); label, color, _ = MARKERS[self.marker.get()]; r = self._brush_radius()
+        tag = f"stroke{len(self.strokes)}"; self.current = (label, r, [(x, y)], tag, color)
+        self.canvas.create_oval(x - r, y - r, x + r, y + r, fill=color, outline="", tags=tag)
+
+    def on_drag(self, event):
+        if self.current is None: return
+        _, r, points, tag, color = self.current; x, y = self._clamp(event); px, py = points[-1]
+        if (x, y) == (px, py): return
+        # Only the new segment is drawn; the image underneath is left alone until the stroke ends
+        self.canvas.create_line(px, py, x, y, width=2 * r, fill=color, capstyle=tk.ROUND, tags=tag)
+        points.append((x, y))
+
+    def on_release(self, event):
+        if self.current is None: return
+        label, r, points, _, _ = self.current; self.current = None
+        # Stored in full-image coordinates, rounded to 1/100 pixel and immutable so the edit step stays
+        # small and hashes cheaply; only this stroke is added to the preview markers
+        stroke = (label, round(r / self.scale, 2), tuple((round(x / self.scale, 2), round(y / self.scale, 2)) for x, y in points))
+        self.strokes.append(stroke); engine.rasterize_markers([stroke], self.markers.shape, self.scale, markers=self.markers)
+        self.debouncer.call()
+
+    def undo(self):
+        if not self.strokes: return
+        self.strokes.pop(); self.canvas.delete(f"stroke{len(self.strokes)}"); self._redraw_markers()
+
+    def clear(self):
+        for i in range(len(self.strokes)): self.canvas.delete(f"stroke{i}")
+        self.strokes = []; self._redraw_markers()
+
+    def _redraw_markers(self):
+        self.markers = engine.rasterize_markers(self.strokes, self.markers.shape, self.scale); self.debouncer.call()
+
+    # -------------------------- segmentation --------------------------
+    def segment(self):
+        # Runs on the Tk thread after the debounce; a preview-sized watershed takes a few tens of ms
+        if not self.strokes: self.labels = None; self.render(); return
+        start = time.perf_counter(); self.labels = cv2.watershed(self.preview, self.markers.copy())
+        self.render(); self.status.config(text=f"{len(self.strokes)} strokes  |  preview {self.preview.shape[1]}x{self.preview.shape[0]} in {(time.perf_counter() - start) * 1000:.0f} ms")
+
+    def render(self):
+        from PIL import Image, ImageTk
+        view = self.preview
+        if self.labels is not None:
+            regions = np.clip(self.labels, 0, len(self.palette) - 1).astype(np.uint8)
+            view = cv2.addWeighted(self.preview, 0.6, self.palette[regions], 0.4, 0); view[self.labels == -1] = BOUNDARY_COLOR
+        pil_image = Image.fromarray(np.ascontiguousarray(view))
+        if self.photo is None: self.photo = ImageTk.PhotoImage(image=pil_image); self.canvas.itemconfig(self.image_item, image=self.photo)
+        else: self.photo.paste(pil_image)
+
+    def commit(self):
+        labels = {label for label, _, _ in self.strokes}
+        if labels != {MARKERS["foreground"][0], MARKERS["background"][0]}: messagebox.showwarning("تنبيه", "ارسم علامة واحدة على الأقل للكائن وأخرى للخلفية.", parent=self.top); return
+        strokes = tuple(self.strokes); preview_size = (self.preview.shape[1], self.preview.shape[0]); self.close(); self.on_commit(strokes, preview_size)
+
+    def close(self):
+        self.debouncer.cancel(); self.top.destroy()
+        self.image = self.preview = self.markers = self.labels = self.photo = None